@@ -1,20 +1,75 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
+from contextlib import asynccontextmanager
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
-import shutil
 import os
 import json
+import asyncio
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import openpyxl
 import time
 
-from sheet_insights.parser import extract_markdown, get_sheet_names
-from sheet_insights.insights import get_insights
+from sheet_insights.parser import (
+    extract_sheets, write_markdown_files, get_sheet_names, get_extraction_pool, shutdown_extraction_pool,
+    EXTRACTION_MODE, EXTRACTION_WORKERS, EXTRACTION_THREADS
+)
+from sheet_insights.insights import get_insights, get_insights_batch_async, iter_insights_as_completed, cached_insights, INSIGHT_PARAMS, SHEET_TIMEOUT_SECONDS, plan_token_budget
 from sheet_insights.general_summary import generate_general_insights
-from sheet_insights.additional_insights import generate_additional_insights
-
-app = FastAPI()
+from sheet_insights.additional_insights import generate_additional_insights, is_failed_result
+from sheet_insights.cache import insight_cache
+from sheet_insights.config import (
+    close_async_client, LLM_MAX_CONCURRENCY, INCREMENTAL_ANALYSIS, API_WORKERS, PERSIST_MARKDOWN,
+    ARTEFACT_RETENTION_DAYS, ARTEFACT_GC_INTERVAL_HOURS, UPLOAD_BLOB_DIR, WORKBOOK_VERSIONS_DIR,
+    WORKBOOK_VERSIONS_RETENTION_DAYS,
+    SPECULATIVE_ADDITIONAL_INSIGHTS, JOB_TRACE, JOB_TOKEN_BUDGET,
+)
+from sheet_insights.xlsx_reader import READER_ENGINE
+from sheet_insights.encoder import TABLE_ENCODING, SHEET_TOKEN_BUDGET
+from sheet_insights.jobs import job_store, create_job_queue
+from sheet_insights.scheduler import llm_scheduler, CircuitOpenError
+from sheet_insights.instant import instant_insights, instant_general_insights
+from sheet_insights.kpi_cube import KPICube, load_kpi_cube
+from sheet_insights.versions import workbook_versions
+from sheet_insights.results import result_store, SHEET_INSIGHTS, GENERAL_INSIGHTS, ADDITIONAL_INSIGHTS, KPI_STATS, TRACE, TOKEN_USAGE
+from sheet_insights.http_cache import response_cache
+from sheet_insights.uploads import upload_store, UploadTooLarge, InvalidUpload
+from sheet_insights.retention import ArtefactCollector
+from sheet_insights.metrics import metrics, FALLBACKS, timed, start_trace, current_trace
+from sheet_insights.token_usage import start_ledger, current_ledger
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_store.init()
+    job_queue.start()
+    cleanup_task = asyncio.create_task(artefact_collector.run_periodically())
+    if EXTRACTION_MODE == "process":
+        # Spawn the extraction workers up front so the first upload doesn't pay for it
+        await asyncio.to_thread(get_extraction_pool)
+    yield
+    cleanup_task.cancel()
+    for task in list(speculative_tasks.values()):
+        task.cancel()
+    await job_queue.stop()
+    shutdown_extraction_pool()
+    await close_async_client()
+
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Refuse uploads whose declared size is over the limit before their body is read"""
+    content_length = request.headers.get("content-length")
+    if request.method == "POST" and content_length and content_length.isdigit():
+        # Multipart framing adds a little on top of the file itself
+        if int(content_length) > upload_store.max_bytes + 64 * 1024:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Upload exceeds the {upload_store.max_bytes // (1024 * 1024)} MB limit"}
+            )
+    return await call_next(request)
 
 # Add CORS middleware
 app.add_middleware(
@@ -27,97 +82,336 @@ app.add_middleware(
 
 UPLOAD_DIR = Path('uploads')
 MARKDOWN_DIR = Path("results/markdown_output")
-INSIGHTS_FILE = Path('results/insights.json')
-GENERAL_INSIGHTS_FILE = Path('results/general-info.json')
-ADDITIONAL_INSIGHTS_FILE = Path('results/additional-insights.json')
 RESULTS_DIR = Path('results')
 
 # Create directories
-for folder in [UPLOAD_DIR, MARKDOWN_DIR, RESULTS_DIR]:
+for folder in [UPLOAD_DIR, RESULTS_DIR]:
     folder.mkdir(parents=True, exist_ok=True)
 
+# Old artefacts are deleted in the background so disk use stays bounded
+ARTEFACT_MAX_AGE = ARTEFACT_RETENTION_DAYS * 86400
+artefact_collector = ArtefactCollector([
+    (MARKDOWN_DIR, "*.md", ARTEFACT_MAX_AGE),
+    (UPLOAD_BLOB_DIR, "*/*.xlsx", ARTEFACT_MAX_AGE),
+    (UPLOAD_BLOB_DIR, ".*.part", 3600),  # abandoned partial uploads
+    (WORKBOOK_VERSIONS_DIR, "*.json", WORKBOOK_VERSIONS_RETENTION_DAYS * 86400),
+    (WORKBOOK_VERSIONS_DIR, "*.tmp", 3600),
+], interval_seconds=ARTEFACT_GC_INTERVAL_HOURS * 3600)
+
+# Results live per run in a store every worker process shares; readers see the latest completed run
+result_store.init()
+
 @app.get("/")
 def read_root():
     return RedirectResponse(url='/docs')
 
 
 
-@app.post("/upload_excel/")
-async def upload_excel(file: UploadFile = File(...)):
+async def save_upload(file: UploadFile):
+    """Validate and store an uploaded workbook, returning its content-addressed path on disk"""
     if not file.filename.endswith(".xlsx"):
         raise HTTPException(status_code=400, detail="Only .xlsx files are supported.")
 
-    # Save uploaded file
-    file_path = UPLOAD_DIR / file.filename
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    # Stream the upload into the blob store, hashing and size-checking it on the way
+    try:
+        file_path, digest, size, deduplicated = await upload_store.ingest(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    reuse_note = ", identical to an earlier upload" if deduplicated else ""
+    print(f"📁 Uploaded file: {file.filename} ({size / 1024:.0f} KB, sha256 {digest[:12]}{reuse_note})")
+    return file_path
+
+
+def prepare_sheets(file_path: Path, run_id: str, mode: str = "llm"):
+    """Extract the supplier sheets of a workbook as (markdown_text, sheet_name) pairs.
+
+    Sheets whose values are unchanged since the previous upload of the same
+    workbook are not re-extracted; if the LLM already analysed them their
+    insights are returned in `reused` and they are left out of the pairs.
+    Returns (pairs to analyse, processed sheet names, KPI statistics of all
+    processed sheets, reused insights by sheet name).
+    """
+    # Get all sheet names for validation
+    all_sheet_names = get_sheet_names(str(file_path))
+    if not all_sheet_names:
+        raise HTTPException(status_code=400, detail="No sheets found in the Excel file")
+
+    print(f"📋 Found sheets: {all_sheet_names}")
+
+    # Skip first two sheets: "Average Summary" and "Analysis SUMMARY"
+    if len(all_sheet_names) > 2:
+        print(f"📋 Skipping first two sheets: '{all_sheet_names[0]}' and '{all_sheet_names[1]}'")
+        sheets_to_process = all_sheet_names[2:]
+    elif len(all_sheet_names) > 1:
+        print(f"📋 Skipping first sheet: '{all_sheet_names[0]}'")
+        sheets_to_process = all_sheet_names[1:]
+    else:
+        print(f"📋 Processing single sheet: '{all_sheet_names[0]}'")
+        sheets_to_process = all_sheet_names
+
+    print(f"🔄 Sheets to process: {sheets_to_process}")
+
+    # Sheets whose zip CRCs match the previous version of this workbook are not even parsed
+    if INCREMENTAL_ANALYSIS:
+        with timed("diff"):
+            previous_versions, fingerprints, candidates = workbook_versions.candidates(str(file_path), sheets_to_process)
+    else:
+        candidates = list(sheets_to_process)
+
+    extracted, tables = [], {}
+    if candidates:
+        # Parse each candidate once, in memory: its text, rows and KPI statistics all come from this pass
+        with timed("extract", sheets=len(candidates)):
+            extracted = extract_sheets(
+                str(file_path),
+                sheets_to_process=candidates,
+                skip_first_sheet=False,  # We're explicitly providing the sheets to process
+                tables=tables,
+            )
+
+        if not extracted and len(candidates) == len(sheets_to_process):
+            raise HTTPException(status_code=400, detail="No sheets could be processed")
+        print(f"📝 Extracted {len(extracted)} sheets")
+
+    # Candidates re-saved without value changes (e.g. formatting only) are still unchanged
+    if INCREMENTAL_ANALYSIS:
+        versions, changed, cell_changes = workbook_versions.diff(
+            previous_versions, fingerprints, sheets_to_process, {name: table["rows"] for name, table in tables.items()}
+        )
+        for sheet_name in changed:
+            cells = cell_changes.get(sheet_name)
+            detail = f" ({len(cells)} cells: {', '.join(cells[:8])}{', ...' if len(cells) > 8 else ''})" if cells else ""
+            print(f"🔀 Changed: '{sheet_name}'{detail}")
+        print(f"♻️ {len(sheets_to_process) - len(changed)}/{len(sheets_to_process)} sheets unchanged since the previous upload")
+    else:
+        versions, changed = {}, list(sheets_to_process)
+
+    texts = {sheet_name: text for sheet_name, text in extracted if sheet_name in changed}
+    if PERSIST_MARKDOWN and texts:
+        markdown_paths, _ = write_markdown_files(texts.items(), MARKDOWN_DIR)
+        print(f"📝 Wrote {len(markdown_paths)} markdown files to {MARKDOWN_DIR}")
+    for sheet_name in texts:
+        print(f"📄 Prepared: '{sheet_name}'")
+
+    # Locally computed KPI statistics, saved for /kpi_stats; their facts are already in the sheet text.
+    # Unchanged sheets keep the statistics stored with their previous version
+    kpi_stats = {}
+    for sheet_name in sheets_to_process:
+        table = tables.get(sheet_name)
+        if table is not None and table["kpis"] is not None:
+            kpi_stats[sheet_name] = table["kpis"]
+        elif sheet_name not in changed and sheet_name in versions:
+            kpi_stats[sheet_name] = versions[sheet_name].get("kpis", [])
+    save_kpi_stats(run_id, kpi_stats)
+    cube_path = kpi_cube_path(run_id)
+    cube_path.parent.mkdir(parents=True, exist_ok=True)
+    KPICube.from_stats(kpi_stats).save(cube_path)
+
+    markdown_texts_and_names, reused = [], {}
+    for sheet_name in sheets_to_process:
+        if sheet_name in texts:
+            markdown_texts_and_names.append((texts[sheet_name], sheet_name))
+            continue
+        previous = versions.get(sheet_name)
+        if sheet_name in changed or not previous or previous.get("text") is None:
+            continue
+        # Unchanged sheet: reuse its insights, or re-analyse its stored text if the LLM never answered
+        insight = cached_insights(previous["text"]) if mode != "instant" else None
+        if insight is not None:
+            reused[sheet_name] = insight
+        else:
+            markdown_texts_and_names.append((previous["text"], sheet_name))
+
+    if INCREMENTAL_ANALYSIS:
+        for sheet_name in changed:
+            if sheet_name in texts:
+                versions[sheet_name].update(text=texts[sheet_name], kpis=kpi_stats.get(sheet_name, []))
+            else:
+                versions.pop(sheet_name, None)  # not extracted, so try again next time
+        workbook_versions.save(sheets_to_process, versions)
+
+    if reused:
+        print(f"♻️ Reusing insights for {len(reused)} unchanged sheets")
+
+    if mode != "instant" and JOB_TOKEN_BUDGET and markdown_texts_and_names:
+        plan = plan_token_budget(markdown_texts_and_names, JOB_TOKEN_BUDGET)
+        ledger = current_ledger()
+        if ledger is not None:
+            ledger.plan = plan
+
+    return markdown_texts_and_names, sheets_to_process, kpi_stats, reused
+
+
+def kpi_cube_path(run_id: str):
+    return result_store.run_dir(run_id) / "kpi_cube.npz"
+
+
+def save_kpi_stats(run_id: str, kpi_stats: dict):
+    result_store.put(run_id, KPI_STATS, kpi_stats)
+    print(f"💾 Saved KPI statistics for run {run_id}")
+
+
+def save_insights(run_id: str, insights: dict):
+    result_store.put(run_id, SHEET_INSIGHTS, insights)
+    print(f"💾 Saved insights for run {run_id}")
+
+
+def resolve_run(run_id: str = None):
+    """The requested run, or the latest completed one; 404 if there is none"""
+    if run_id is not None:
+        if not result_store.has_run(run_id):
+            raise HTTPException(status_code=404, detail=f"Run '{run_id}' not found")
+        return run_id
+    run_id = result_store.latest_run_id()
+    if run_id is None:
+        raise HTTPException(status_code=404, detail='No results found. Please upload and process an Excel file first.')
+    return run_id
+
+
+def merge_insights(sheets_to_process: list, insights: dict, reused: dict):
+    """Combine fresh and reused insights in workbook sheet order"""
+    merged = {**reused, **insights}
+    return {name: merged[name] for name in sheets_to_process if name in merged}
 
-    print(f"📁 Uploaded file: {file.filename}")
 
+async def iter_sheet_insights(markdown_texts_and_names: list, kpi_stats: dict, mode: str = "llm"):
+    """Yield (sheet_name, insights) from the LLM, or straight from the KPI rules in instant mode"""
+    if mode == "instant":
+        for _, sheet_name in markdown_texts_and_names:
+            yield sheet_name, instant_insights(kpi_stats.get(sheet_name, []))
+        return
+    sheet_stream = iter_insights_as_completed(markdown_texts_and_names, kpi_stats=kpi_stats)
     try:
-        # Get all sheet names for validation
-        all_sheet_names = get_sheet_names(str(file_path))
-        if not all_sheet_names:
-            raise HTTPException(status_code=400, detail="No sheets found in the Excel file")
-        
-        print(f"📋 Found sheets: {all_sheet_names}")
-
-        # Skip first two sheets: "Average Summary" and "Analysis SUMMARY"
-        if len(all_sheet_names) > 2:
-            print(f"📋 Skipping first two sheets: '{all_sheet_names[0]}' and '{all_sheet_names[1]}'")
-            sheets_to_process = all_sheet_names[2:]
-        elif len(all_sheet_names) > 1:
-            print(f"📋 Skipping first sheet: '{all_sheet_names[0]}'")
-            sheets_to_process = all_sheet_names[1:]
-        else:
-            print(f"📋 Processing single sheet: '{all_sheet_names[0]}'")
-            sheets_to_process = all_sheet_names
+        async for sheet_name, insight in sheet_stream:
+            yield sheet_name, insight
+    finally:
+        # Closing this generator early must cancel the per-sheet calls still in flight
+        await sheet_stream.aclose()
+
+
+def build_general_insights(run_id: str, insights: dict, kpi_stats: dict, mode: str = "llm"):
+    """Cross-sheet summary from the LLM; rule-based in instant mode or while the LLM is unavailable"""
+    if mode != "instant":
+        try:
+            return generate_general_insights(insights, kpi_cube=load_kpi_cube(kpi_cube_path(run_id)))
+        except CircuitOpenError:
+            print("⚡ LLM unavailable, using instant general insights")
+            FALLBACKS.inc(stage="general", kind="instant")
+    return instant_general_insights(kpi_stats)
+
+
+def start_general_insights(run_id: str, kpi_stats: dict, mode: str = "llm"):
+    """Start the cross-sheet summary alongside the sheet insights when it doesn't need them.
+
+    With a KPI cube the summary prompt is built from the cube alone, which is
+    ready as soon as the sheets are parsed; only without one does the summary
+    have to wait for the sheet insights. Returns the task, or None.
+    """
+    if mode == "instant" or not load_kpi_cube(kpi_cube_path(run_id)).kpis:
+        return None
+    print(f"🔄 Generating general insights alongside the sheet insights...")
+    return asyncio.create_task(asyncio.to_thread(build_general_insights, run_id, {}, kpi_stats, mode))
+
+
+async def summarise_insights(run_id: str, insights: dict, kpi_stats: dict, mode: str = "llm", summary_task=None):
+    """Finish the cross-sheet summary, store it and complete the run, making it the latest one readers see.
+
+    Additional insights are then generated in the background, so
+    /generate_more_insights can usually answer from the result store.
+    """
+    if summary_task is not None:
+        general = await summary_task
+    else:
+        print(f"🔄 Generating general insights...")
+        general = await asyncio.to_thread(build_general_insights, run_id, insights, kpi_stats, mode)
 
-        print(f"🔄 Sheets to process: {sheets_to_process}")
+    await asyncio.to_thread(result_store.put, run_id, GENERAL_INSIGHTS, general)
+    await asyncio.to_thread(result_store.complete, run_id)
+    await asyncio.to_thread(save_run_records, run_id)
 
-        # Extract markdown with proper sheet name handling
-        markdown_paths, name_mapping = extract_markdown(
-            str(file_path),
-            MARKDOWN_DIR,
-            sheets_to_process=sheets_to_process,
-            skip_first_sheet=False  # We're explicitly providing the sheets to process
-        )
+    if mode != "instant" and SPECULATIVE_ADDITIONAL_INSIGHTS:
+        speculate_additional_insights(run_id, insights, general)
+    return general
 
-        if not markdown_paths:
-            raise HTTPException(status_code=400, detail="No sheets could be processed")
 
-        print(f"📝 Generated {len(markdown_paths)} markdown files")
-        print(f"🗺️ Name mapping: {name_mapping}")
+# In-flight background generations of additional insights, by run id
+speculative_tasks = {}
 
-        # Optimized batch processing for insights
-        print(f"🚀 Starting optimized batch insight generation for {len(markdown_paths)} sheets...")
 
-        # Prepare data for batch processing
-        markdown_texts_and_names = []
-        for markdown_file in markdown_paths:
-            try:
-                with open(markdown_file, "r", encoding="utf-8") as f:
-                    text = f.read()
+def speculate_additional_insights(run_id: str, insights: dict, general: list):
+    """Generate a run's additional insights in the background and store them"""
+    async def run():
+        try:
+            additional = await asyncio.to_thread(generate_additional_insights, insights, general)
+            if not is_failed_result(additional):
+                await asyncio.to_thread(result_store.put, run_id, ADDITIONAL_INSIGHTS, additional)
+                print(f"✨ Additional insights ready for run {run_id}")
+            await asyncio.to_thread(save_run_records, run_id)
+            return additional
+        finally:
+            speculative_tasks.pop(run_id, None)
+
+    speculative_tasks[run_id] = asyncio.create_task(run())
+
+
+def save_run_records(run_id: str):
+    """Store the current upload's token usage, and its trace if it is being traced, with its run"""
+    ledger = current_ledger()
+    if ledger is not None and ledger.run_id == run_id:
+        result_store.put(run_id, TOKEN_USAGE, ledger.as_dict())
+    trace = current_trace()
+    if trace is not None and trace.run_id == run_id:
+        result_store.put(run_id, TRACE, trace.as_dict())
+
+
+def token_usage_summary():
+    ledger = current_ledger()
+    return ledger.summary() if ledger is not None else None
+
+
+def cancel_pending(task):
+    """Drop an early summary task whose upload failed or was abandoned (its thread finishes on its own)"""
+    if task is not None and not task.done():
+        task.cancel()
+
 
-                # Get the original sheet name from mapping
-                clean_name = markdown_file.stem
-                original_sheet_name = name_mapping.get(clean_name, clean_name)
+@app.post("/upload_excel/")
+async def upload_excel(
+    file: UploadFile = File(...),
+    mode: str = Query("llm", pattern="^(llm|instant)$"),
+    trace: bool = Query(False),
+):
+    """Upload a workbook and generate insights; mode=instant skips the LLM and uses KPI rules"""
+    file_path = await save_upload(file)
+    run_id = result_store.create_run(file.filename)
+    start_ledger(run_id)
+    if trace or JOB_TRACE:
+        start_trace(run_id)
+    summary_task = None
 
-                markdown_texts_and_names.append((text, original_sheet_name))
-                print(f"📄 Prepared: '{original_sheet_name}'")
+    try:
+        markdown_texts_and_names, sheets_to_process, kpi_stats, reused = await asyncio.to_thread(
+            prepare_sheets, file_path, run_id, mode
+        )
+        summary_task = start_general_insights(run_id, kpi_stats, mode)
 
-            except Exception as e:
-                print(f"❌ Error reading {markdown_file.name}: {e}")
-                continue
+        # Optimized batch processing for insights
+        print(f"🚀 Starting optimized batch insight generation for {len(markdown_texts_and_names)} sheets...")
 
         # Use optimized batch processing
         start_time = time.time()
 
-        # Import the batch function
-        from sheet_insights.insights import get_insights_batch_async
-
-        # Process all sheets in parallel using async batch processing
-        batch_results = await get_insights_batch_async(markdown_texts_and_names, max_workers=12)
+        with timed("sheet_insights", sheets=len(markdown_texts_and_names)):
+            if mode == "instant":
+                batch_results = [instant_insights(kpi_stats.get(name, [])) for _, name in markdown_texts_and_names]
+            else:
+                # Process all sheets in parallel using async batch processing
+                batch_results = await get_insights_batch_async(
+                    markdown_texts_and_names, max_workers=LLM_MAX_CONCURRENCY, kpi_stats=kpi_stats
+                )
 
         total_time = time.time() - start_time
         print(f"⚡ Optimized batch processing completed in {total_time:.2f}s")
@@ -140,174 +434,469 @@ async def upload_excel(file: UploadFile = File(...)):
 
         print(f"📊 Successfully generated insights for {processed_count}/{len(markdown_texts_and_names)} sheets")
 
-        # Save insights to file
-        with open(INSIGHTS_FILE, "w", encoding='utf-8') as f:
-            json.dump(insights, f, indent=2, ensure_ascii=False)
+        # Merge in the unchanged sheets' insights, keeping workbook order
+        insights = merge_insights(sheets_to_process, insights, reused)
 
-        print(f"💾 Saved insights to: {INSIGHTS_FILE}")
+        # Save insights for this run
+        save_insights(run_id, insights)
 
-        # Generate general insights
-        print(f"🔄 Generating general insights...")
-        general = generate_general_insights(str(INSIGHTS_FILE), str(GENERAL_INSIGHTS_FILE))
-
-        # Load insights for response
-        with open(INSIGHTS_FILE, "r", encoding="utf-8") as f:
-            insights_content = json.load(f)
+        # Generate general insights (or collect the ones started alongside the sheets)
+        general = await summarise_insights(run_id, insights, kpi_stats, mode, summary_task)
 
         print(f"🎉 Processing completed successfully!")
 
         return {
             "message": f"Successfully processed {len(sheets_to_process)} sheets",
+            "run_id": run_id,
             "processed_sheets": list(insights.keys()),
-            "insights": insights_content,
-            "general-insights": general
+            "reanalysed_sheets": [name for _, name in markdown_texts_and_names],
+            "reused_sheets": list(reused),
+            "insights": insights,
+            "general-insights": general,
+            "token_usage": token_usage_summary()
         }
 
+    except HTTPException:
+        cancel_pending(summary_task)
+        await asyncio.to_thread(result_store.fail, run_id)
+        raise
     except Exception as e:
+        cancel_pending(summary_task)
+        await asyncio.to_thread(result_store.fail, run_id)
         print(f"❌ Error during processing: {e}")
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
 
+
+def format_stream_event(event: dict, stream_format: str):
+    """Encode one streaming event as an NDJSON line or a Server-Sent Event"""
+    payload = json.dumps(event, ensure_ascii=False)
+    if stream_format == "sse":
+        return f"event: {event['event']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+@app.post("/upload_excel/stream")
+async def upload_excel_stream(
+    file: UploadFile = File(...),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+    mode: str = Query("llm", pattern="^(llm|instant)$"),
+    trace: bool = Query(False),
+):
+    """Upload a workbook and stream each sheet's insights as soon as its LLM call finishes.
+
+    Events are emitted in order: `start`, one `sheet` per completed sheet,
+    `general` with the cross-sheet summary, then `done` (or `error`).
+    """
+    file_path = await save_upload(file)
+    run_id = result_store.create_run(file.filename)
+    start_ledger(run_id)
+    if trace or JOB_TRACE:
+        start_trace(run_id)
+    # Parse before streaming starts so bad workbooks still get a proper 4xx status
+    markdown_texts_and_names, sheets_to_process, kpi_stats, reused = await asyncio.to_thread(
+        prepare_sheets, file_path, run_id, mode
+    )
+
+    async def event_stream():
+        start_time = time.time()
+        summary_task = start_general_insights(run_id, kpi_stats, mode)
+        sheet_stream = iter_sheet_insights(markdown_texts_and_names, kpi_stats, mode)
+        completed = False
+        try:
+            yield format_stream_event({
+                "event": "start",
+                "run_id": run_id,
+                "sheets": [name for _, name in markdown_texts_and_names],
+                "reused_sheets": list(reused)
+            }, format)
+
+            # Unchanged sheets first: their insights are already known
+            for sheet_name, insight in reused.items():
+                yield format_stream_event({
+                    "event": "sheet",
+                    "sheet": sheet_name,
+                    "insights": insight,
+                    "reused": True,
+                    "elapsed": round(time.time() - start_time, 3)
+                }, format)
+
+            insights = {}
+            with timed("sheet_insights", sheets=len(markdown_texts_and_names)):
+                async for sheet_name, insight in sheet_stream:
+                    if insight:
+                        insights[sheet_name] = insight
+                        print(f"✅ Streamed insights for: '{sheet_name}'")
+                    yield format_stream_event({
+                        "event": "sheet",
+                        "sheet": sheet_name,
+                        "insights": insight,
+                        "elapsed": round(time.time() - start_time, 3)
+                    }, format)
+
+            insights = merge_insights(sheets_to_process, insights, reused)
+            save_insights(run_id, insights)
+
+            general = await summarise_insights(run_id, insights, kpi_stats, mode, summary_task)
+            completed = True
+            yield format_stream_event({"event": "general", "general-insights": general}, format)
+
+            yield format_stream_event({
+                "event": "done",
+                "message": f"Successfully processed {len(sheets_to_process)} sheets",
+                "run_id": run_id,
+                "processed_sheets": list(insights.keys()),
+                "token_usage": token_usage_summary(),
+                "elapsed": round(time.time() - start_time, 3)
+            }, format)
+
+        except Exception as e:
+            print(f"❌ Error during streamed processing: {e}")
+            yield format_stream_event({"event": "error", "detail": f"Processing failed: {str(e)}"}, format)
+        finally:
+            # Also runs when the client disconnects: stop spending tokens on a result nobody reads
+            await sheet_stream.aclose()
+            cancel_pending(summary_task)
+            if not completed:
+                print(f"🛑 Streamed run {run_id} ended before it completed")
+                await asyncio.to_thread(result_store.fail, run_id)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(event_stream(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def run_upload_job(job_id: str, file_path: str):
+    """Background pipeline for a queued upload: parse, per-sheet insights, general summary"""
+    await job_store.update(job_id, stage="parsing")
+    # The job id doubles as the run id, so /all_insights?run_id=<job_id> reads this job's results
+    run_id = result_store.create_run(Path(file_path).name, run_id=job_id)
+    start_ledger(run_id)
+    if JOB_TRACE:
+        start_trace(run_id)
+    summary_task = None
+    try:
+        markdown_texts_and_names, sheets_to_process, kpi_stats, reused = await asyncio.to_thread(
+            prepare_sheets, Path(file_path), run_id
+        )
+
+        progress = {"sheets_total": len(markdown_texts_and_names) + len(reused), "sheets_done": len(reused)}
+        await job_store.update(job_id, stage="insights", progress=progress)
+        summary_task = start_general_insights(run_id, kpi_stats)
+
+        insights = {}
+        with timed("sheet_insights", sheets=len(markdown_texts_and_names)):
+            async for sheet_name, insight in iter_sheet_insights(markdown_texts_and_names, kpi_stats):
+                if insight:
+                    insights[sheet_name] = insight
+                progress["sheets_done"] += 1
+                await job_store.update(job_id, progress=progress)
+
+        insights = merge_insights(sheets_to_process, insights, reused)
+        save_insights(run_id, insights)
+
+        await job_store.update(job_id, stage="summary")
+        general = await summarise_insights(run_id, insights, kpi_stats, summary_task=summary_task)
+    except BaseException:
+        # Failed or cancelled: the run will never complete
+        cancel_pending(summary_task)
+        await asyncio.to_thread(result_store.fail, run_id)
+        raise
+
+    return {
+        "message": f"Successfully processed {len(sheets_to_process)} sheets",
+        "run_id": run_id,
+        "processed_sheets": list(insights.keys()),
+        "reanalysed_sheets": [name for _, name in markdown_texts_and_names],
+        "reused_sheets": list(reused),
+        "insights": insights,
+        "general-insights": general,
+        "token_usage": token_usage_summary()
+    }
+
+
+job_queue = create_job_queue(run_upload_job)
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...)):
+    """Store an upload and queue it for background processing, returning a job ID immediately"""
+    if job_queue.is_full():
+        raise HTTPException(status_code=503, detail="Job queue is full, please retry shortly")
+
+    file_path = await save_upload(file)
+    try:
+        job_id = await job_queue.submit(file.filename, str(file_path))
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full, please retry shortly")
+
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs")
+async def list_jobs(limit: int = Query(50, ge=1, le=500), status: str = None):
+    """List recent jobs, newest first, without their result payloads"""
+    return {"jobs": await job_store.list(limit=limit, status=status), "queue": job_queue.stats()}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Poll a job's status, per-stage progress and, once completed, its result"""
+    job = await job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    if not await job_store.get(job_id, include_result=False):
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not await job_queue.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job has already finished")
+    return {"job_id": job_id, "status": "cancelled"}
+
+def cached_response(request: Request, endpoint: str, run_id: str, build, **options):
+    """Serve an endpoint's JSON from the response cache until the run's results change"""
+    version = result_store.version(run_id) if run_id else None
+    return response_cache.respond(request, (endpoint, run_id), version, build, **options)
+
+def json_download(request: Request, run_id: str, kind: str, filename: str, missing_detail: str):
+    """Serve one stored result of a run as a JSON file download"""
+    run_id = resolve_run(run_id)
+
+    def build():
+        data = result_store.get(run_id, kind)
+        if data is None:
+            raise HTTPException(status_code=404, detail=missing_detail)
+        return data
+
+    return cached_response(request, f"download/{kind}", run_id, build, filename=filename, indent=2)
+
 @app.get('/download/insights')
-def download_insights():
-    if not INSIGHTS_FILE.exists():
-        raise HTTPException(status_code=404, detail='Insights file not found')
-    return FileResponse(path=INSIGHTS_FILE, filename="insights.json", media_type='application/json')
+def download_insights(request: Request, run_id: str = None):
+    return json_download(request, run_id, SHEET_INSIGHTS, "insights.json", 'Insights file not found')
 
 @app.get('/download/general')
-def download_general():
-    if not GENERAL_INSIGHTS_FILE.exists():
-        raise HTTPException(status_code=404, detail='General info file not found')
-    return FileResponse(path=GENERAL_INSIGHTS_FILE, filename='general-info.json', media_type='application/json')
+def download_general(request: Request, run_id: str = None):
+    return json_download(request, run_id, GENERAL_INSIGHTS, 'general-info.json', 'General info file not found')
 
 @app.post('/generate_more_insights')
-def generate_more_insights():
-    """Generate additional insights based on data not covered in previous insights"""
+async def generate_more_insights(run_id: str = None, refresh: bool = False):
+    """Additional insights based on data not covered in previous insights.
+
+    Usually already generated in the background after the upload; refresh=true
+    asks the LLM for a new set.
+    """
     try:
-        # Check if required files exist
-        if not INSIGHTS_FILE.exists():
+        run_id = await asyncio.to_thread(resolve_run, run_id)
+        results = await asyncio.to_thread(
+            result_store.get_many, run_id, (SHEET_INSIGHTS, GENERAL_INSIGHTS, ADDITIONAL_INSIGHTS)
+        )
+
+        # Check if required results exist
+        if results[SHEET_INSIGHTS] is None:
             raise HTTPException(status_code=404, detail='Insights file not found. Please upload and process an Excel file first.')
 
-        if not GENERAL_INSIGHTS_FILE.exists():
+        if results[GENERAL_INSIGHTS] is None:
             raise HTTPException(status_code=404, detail='General insights file not found. Please upload and process an Excel file first.')
 
+        additional_insights = None
+        if not refresh:
+            additional_insights = results[ADDITIONAL_INSIGHTS]
+            task = speculative_tasks.get(run_id)
+            if additional_insights is None and task is not None:
+                print(f"⏳ Waiting for the background additional insights of run {run_id}...")
+                additional_insights = await asyncio.shield(task)
+            if additional_insights is not None and not is_failed_result(additional_insights):
+                print(f"✅ Served precomputed additional insights")
+                return {
+                    "message": "Successfully generated additional insights",
+                    "run_id": run_id,
+                    "additional_insights": additional_insights
+                }
+
         print(f"🔄 Generating additional insights...")
 
         # Generate additional insights
-        additional_insights = generate_additional_insights(
-            str(INSIGHTS_FILE),
-            str(GENERAL_INSIGHTS_FILE),
-            str(ADDITIONAL_INSIGHTS_FILE)
+        additional_insights = await asyncio.to_thread(
+            generate_additional_insights, results[SHEET_INSIGHTS], results[GENERAL_INSIGHTS]
         )
+        if not is_failed_result(additional_insights):
+            await asyncio.to_thread(result_store.put, run_id, ADDITIONAL_INSIGHTS, additional_insights)
 
         print(f"✅ Successfully generated additional insights")
 
         return {
             "message": "Successfully generated additional insights",
+            "run_id": run_id,
             "additional_insights": additional_insights
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error generating additional insights: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to generate additional insights: {str(e)}")
 
 @app.get('/download/additional_insights')
-def download_additional_insights():
+def download_additional_insights(request: Request, run_id: str = None):
     """Download additional insights file"""
-    if not ADDITIONAL_INSIGHTS_FILE.exists():
-        raise HTTPException(status_code=404, detail='Additional insights file not found')
-    return FileResponse(path=ADDITIONAL_INSIGHTS_FILE, filename="additional-insights.json", media_type='application/json')
+    return json_download(
+        request, run_id, ADDITIONAL_INSIGHTS, "additional-insights.json", 'Additional insights file not found'
+    )
 
 @app.get('/sheet_insights')
-def get_sheet_insights():
+def get_sheet_insights(request: Request, run_id: str = None):
     """Get individual sheet insights for deep dive view"""
     try:
-        if not INSIGHTS_FILE.exists():
-            raise HTTPException(status_code=404, detail='Sheet insights file not found. Please upload and process an Excel file first.')
+        run_id = resolve_run(run_id)
 
-        # Load individual sheet insights
-        with open(INSIGHTS_FILE, "r", encoding="utf-8") as f:
-            sheet_insights = json.load(f)
+        def build():
+            # Load individual sheet insights
+            sheet_insights = result_store.get(run_id, SHEET_INSIGHTS)
+            if sheet_insights is None:
+                raise HTTPException(status_code=404, detail='Sheet insights file not found. Please upload and process an Excel file first.')
 
-        return {
-            "message": "Sheet insights retrieved successfully",
-            "sheet_insights": sheet_insights
-        }
+            return {
+                "message": "Sheet insights retrieved successfully",
+                "sheet_insights": sheet_insights
+            }
+
+        return cached_response(request, "sheet_insights", run_id, build)
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error loading sheet insights: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to load sheet insights: {str(e)}")
 
-@app.get('/all_insights')
-def get_all_insights():
-    """Get all available insights in one response"""
-    try:
-        result = {
-            "status": "success",
-            "available_insights": {}
-        }
+@app.get('/kpi_stats')
+def get_kpi_stats(sheet: str = None, run_id: str = None):
+    """Get the locally computed KPI statistics (mean, min/max, trend, MoM, outliers) per sheet"""
+    kpi_stats = result_store.get(resolve_run(run_id), KPI_STATS)
+    if kpi_stats is None:
+        raise HTTPException(status_code=404, detail='KPI statistics not found. Please upload and process an Excel file first.')
 
-        # Load individual sheet insights
-        if INSIGHTS_FILE.exists():
-            with open(INSIGHTS_FILE, "r", encoding="utf-8") as f:
-                result["available_insights"]["sheet_insights"] = json.load(f)
-        else:
-            result["available_insights"]["sheet_insights"] = None
+    if sheet is not None:
+        if sheet not in kpi_stats:
+            raise HTTPException(status_code=404, detail=f"No KPI statistics for sheet '{sheet}'")
+        kpi_stats = {sheet: kpi_stats[sheet]}
 
-        # Load general insights
-        if GENERAL_INSIGHTS_FILE.exists():
-            with open(GENERAL_INSIGHTS_FILE, "r", encoding="utf-8") as f:
-                result["available_insights"]["general_insights"] = json.load(f)
-        else:
-            result["available_insights"]["general_insights"] = None
-
-        # Load additional insights
-        if ADDITIONAL_INSIGHTS_FILE.exists():
-            with open(ADDITIONAL_INSIGHTS_FILE, "r", encoding="utf-8") as f:
-                result["available_insights"]["additional_insights"] = json.load(f)
-        else:
-            result["available_insights"]["additional_insights"] = None
+    return {
+        "message": "KPI statistics retrieved successfully",
+        "kpi_stats": kpi_stats
+    }
 
-        # Add summary
-        result["summary"] = {
-            "sheet_insights_count": len(result["available_insights"]["sheet_insights"]) if result["available_insights"]["sheet_insights"] else 0,
-            "general_insights_count": len(result["available_insights"]["general_insights"]) if result["available_insights"]["general_insights"] else 0,
-            "additional_insights_count": len(result["available_insights"]["additional_insights"]) if result["available_insights"]["additional_insights"] else 0
-        }
+@app.get('/kpi_comparisons')
+def get_kpi_comparisons(run_id: str = None):
+    """Supplier rankings, percentiles and KPI correlations from a workbook's KPI cube (latest run by default)"""
+    cube_path = kpi_cube_path(resolve_run(run_id))
+    if not cube_path.exists():
+        raise HTTPException(status_code=404, detail='KPI data not found. Please upload and process an Excel file first.')
 
-        return result
+    cube = load_kpi_cube(cube_path)
+    return {
+        "message": "KPI comparisons computed successfully",
+        "suppliers": cube.suppliers,
+        **cube.comparisons()
+    }
 
+@app.get('/all_insights')
+def get_all_insights(request: Request, run_id: str = None):
+    """Get all available insights in one response"""
+    try:
+        if run_id is None:
+            run_id = result_store.latest_run_id()
+        else:
+            resolve_run(run_id)
+
+        def build():
+            result = {
+                "status": "success",
+                "available_insights": {}
+            }
+
+            # Sheet, general and additional insights of one run, read together
+            stored = result_store.get_many(run_id, (SHEET_INSIGHTS, GENERAL_INSIGHTS, ADDITIONAL_INSIGHTS)) if run_id else {}
+            result["run_id"] = run_id
+            result["available_insights"]["sheet_insights"] = stored.get(SHEET_INSIGHTS)
+            result["available_insights"]["general_insights"] = stored.get(GENERAL_INSIGHTS)
+            result["available_insights"]["additional_insights"] = stored.get(ADDITIONAL_INSIGHTS)
+
+            # Add summary
+            result["summary"] = {
+                "sheet_insights_count": len(result["available_insights"]["sheet_insights"]) if result["available_insights"]["sheet_insights"] else 0,
+                "general_insights_count": len(result["available_insights"]["general_insights"]) if result["available_insights"]["general_insights"] else 0,
+                "additional_insights_count": len(result["available_insights"]["additional_insights"]) if result["available_insights"]["additional_insights"] else 0
+            }
+
+            return result
+
+        return cached_response(request, "all_insights", run_id, build)
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error loading all insights: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to load insights: {str(e)}")
 
+@app.delete('/cache/insights')
+def clear_insight_cache():
+    """Drop all cached per-sheet insights so the next upload re-queries the LLM"""
+    insight_cache.clear()
+    return {"message": "Insight cache cleared", "insight_cache": insight_cache.stats()}
+
 @app.get('/status')
 def get_status():
     """Get processing status and available files with performance metrics"""
     return {
         "markdown_files": len(list(MARKDOWN_DIR.glob("*.md"))) if MARKDOWN_DIR.exists() else 0,
         "performance_optimizations": {
-            "llamaparse_workers": 8,  # Increased from 4
-            "max_thread_workers": min(12, max(1, os.cpu_count() or 1)),  # Optimized
-            "fast_mode_enabled": True,
-            "async_processing_enabled": True,
-            "batch_processing_enabled": True,
-            "text_truncation_enabled": True,
-            "parallel_sheet_extraction": True,
-            "optimized_excel_loading": True,
-            "reduced_api_timeouts": True,
+            "max_concurrent_llm_calls": LLM_MAX_CONCURRENCY,
+            "table_encoding": TABLE_ENCODING,
+            "sheet_token_budget": SHEET_TOKEN_BUDGET,
+            "extraction_mode": EXTRACTION_MODE,
+            "xlsx_reader_engine": READER_ENGINE,
+            "extraction_workers": EXTRACTION_WORKERS if EXTRACTION_MODE == "process" else EXTRACTION_THREADS,
             "cpu_cores": os.cpu_count(),
-            "estimated_speedup": "3-5x faster than previous version"
         },
         "api_optimizations": {
-            "max_tokens_reduced": "400 (from 800)",
-            "timeout_reduced": "10s (from 30s)",
-            "temperature": 0.0,
-            "streaming_disabled": True,
-            "fallback_insights_enabled": True
-        }
+            "max_tokens": INSIGHT_PARAMS["max_tokens"],
+            "timeout_seconds": SHEET_TIMEOUT_SECONDS,
+            "temperature": INSIGHT_PARAMS["temperature"]
+        },
+        "job_trace": JOB_TRACE,
+        "insight_cache": insight_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "uploads": upload_store.stats(),
+        "artefact_gc": artefact_collector.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "job_queue": job_queue.stats()
     }
 
 
+@app.get('/metrics')
+def get_metrics():
+    """Prometheus metrics: stage, extraction and LLM latency histograms plus fallback, retry and cache counters"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get('/token_usage')
+def get_token_usage(run_id: str = None):
+    """Tokens a run spent per call, stage and sheet, plus its token budget plan"""
+    run_id = resolve_run(run_id)
+    usage = result_store.get(run_id, TOKEN_USAGE)
+    if usage is None:
+        raise HTTPException(status_code=404, detail=f"No token usage recorded for run '{run_id}'")
+    return usage
+
+
+@app.get('/trace')
+def get_trace(run_id: str = None):
+    """Timeline of a traced upload's stages and LLM calls (upload with trace=true or set JOB_TRACE=true)"""
+    run_id = resolve_run(run_id)
+    trace = result_store.get(run_id, TRACE)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Run '{run_id}' was not traced. Upload with trace=true or set JOB_TRACE=true.")
+    return trace
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -316,12 +905,14 @@ if __name__ == "__main__":
     print("📖 API documentation available at: http://localhost:8001/docs")
     print("🔄 Press Ctrl+C to stop the server")
 
-    # Run the server on port 8001
+    # Run the server on port 8001. Results are shared through the result store,
+    # so API_WORKERS > 1 scales across cores (reload only works with one process)
     uvicorn.run(
         "app:app",  # Use import string for reload to work properly
         host="0.0.0.0",
         port=8001,
-        reload=True,  # Enable auto-reload for development
+        reload=API_WORKERS <= 1,  # Enable auto-reload for development
+        workers=API_WORKERS,
         log_level="info"
     )
 
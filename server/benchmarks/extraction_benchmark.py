@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Extraction scaling benchmark: thread pool vs. process pool from 1 to N cores.
+Run from the server directory:  python -m benchmarks.extraction_benchmark --sheets 60
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.workbook_generator import generate_workbook
+from sheet_insights.parser import extract_markdown, get_extraction_pool, get_sheet_names, shutdown_extraction_pool
+
+
+def time_extraction(workbook, sheets, mode, workers, repeats):
+    best = None
+    for _ in range(repeats):
+        output_dir = Path(tempfile.mkdtemp(prefix="bench_md_"))
+        try:
+            start_time = time.perf_counter()
+            paths, _ = extract_markdown(str(workbook), output_dir, sheets_to_process=sheets, mode=mode, max_workers=workers)
+            elapsed = time.perf_counter() - start_time
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        assert len(paths) == len(sheets), f"expected {len(sheets)} sheets, got {len(paths)}"
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sheets", type=int, default=60)
+    parser.add_argument("--extra-rows", type=int, default=40, help="filler rows per sheet to add parse weight")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workbook = Path(tmp) / "bench.xlsx"
+        generate_workbook(workbook, sheets=args.sheets, extra_rows=args.extra_rows)
+        sheets = get_sheet_names(str(workbook))[2:]
+        print(f"📊 Workbook: {len(sheets)} supplier sheets, {workbook.stat().st_size / 1024:.0f} KB")
+
+        worker_counts = sorted({1, *[2 ** i for i in range(1, 8) if 2 ** i <= args.max_workers], args.max_workers})
+
+        rows = []
+        baseline = time_extraction(workbook, sheets, "thread", 6, args.repeats)
+        rows.append(("thread", 6, baseline))
+        for workers in worker_counts:
+            get_extraction_pool(workers)  # warm pool, excluded from timing
+            rows.append(("process", workers, time_extraction(workbook, sheets, "process", workers, args.repeats)))
+        shutdown_extraction_pool()
+
+    single = next(t for mode, w, t in rows if mode == "process" and w == 1)
+    print("\n" + "=" * 50)
+    print(f"{'mode':<10}{'workers':>8}{'best (s)':>12}{'speedup':>10}")
+    for mode, workers, elapsed in rows:
+        print(f"{mode:<10}{workers:>8}{elapsed:>12.3f}{single / elapsed:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Azure OpenAI chat completions API, for offline benchmarks.
+Answers every prompt shape the server sends (single sheet, packed sheets, summaries)
+with plausible JSON after a configurable latency (as the {"insights": [...]} object when
+structured output is requested), and fails a configurable share of requests with 500s
+or 429s (with a retry-after-ms hint) or answers them with near-JSON that needs repair.
+A share of requests can also stall for stall_ms, to reproduce a slow tail.
+
+Run standalone and point the server at it:
+    python -m benchmarks.mock_openai --port 8900 --latency-ms 800 --rate-limit-rate 0.05
+    AZURE_ENDPOINT=http://127.0.0.1:8900 AZURE_OPENAI_DEPLOYMENT=benchmark python app.py
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def _insights(subject, count, rng):
+    return [
+        f"{subject} insight {i + 1}: KPI averaged {rng.uniform(1, 100):.1f} in June, {rng.choice(['up', 'down'])} {rng.randint(1, 40)}% on May"
+        for i in range(count)
+    ]
+
+
+def fake_reply(prompt, rng, structured=False):
+    """JSON content shaped like what the real model returns for this prompt"""
+    sheets = re.findall(r"^Sheet: (.*)$", prompt, re.M)
+    if sheets:
+        return json.dumps({name.strip(): _insights(name.strip(), 5, rng) for name in sheets})
+    count = re.search(r"(?:exactly|at most) (\d+)", prompt)
+    insights = _insights("Workbook", int(count.group(1)) if count else 5, rng)
+    return json.dumps({"insights": insights} if structured else insights)
+
+
+def malformed(content, rng):
+    """Near-JSON the way models get it wrong: fenced with chatter, trailing commas, or cut off"""
+    kind = rng.choice(["fenced", "trailing_comma", "truncated"])
+    if kind == "fenced":
+        return f"Here are the insights:\n```json\n{content}\n```\nLet me know if you need more."
+    if kind == "trailing_comma":
+        return re.sub(r"\]", ",]", content, count=1)
+    return content[:max(1, int(len(content) * 0.8))]
+
+
+class StubStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.malformed = 0
+        self.stalled = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "rate_limited": self.rate_limited,
+                "malformed": self.malformed,
+                "stalled": self.stalled,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+
+
+def create_stub_app(latency_ms=500.0, jitter_ms=200.0, error_rate=0.0, rate_limit_rate=0.0, retry_after_ms=500, seed=7,
+                    malformed_rate=0.0, stall_rate=0.0, stall_ms=5000.0):
+    """FastAPI app serving OpenAI-compatible chat completions (Azure and plain /v1 routes)"""
+    app = FastAPI(title="Mock Azure OpenAI")
+    app.state.stats = stats = StubStats()
+    rng = random.Random(seed)
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt = "\n".join(message.get("content") or "" for message in body.get("messages", []))
+        stats.add(requests=1)
+        # Latency is drawn per request and scales a little with prompt size, like the real service
+        delay = max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms) + len(prompt) / 4 * 0.02) / 1000
+        if rng.random() < stall_rate:
+            stats.add(stalled=1)
+            delay += stall_ms / 1000
+        await asyncio.sleep(delay)
+
+        roll = rng.random()
+        if roll < rate_limit_rate:
+            stats.add(rate_limited=1)
+            return JSONResponse(
+                {"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit."}},
+                status_code=429, headers={"retry-after-ms": str(retry_after_ms)},
+            )
+        if roll < rate_limit_rate + error_rate:
+            stats.add(errors=1)
+            return JSONResponse({"error": {"code": "500", "message": "Internal server error"}}, status_code=500)
+
+        # A re-ask after an unreadable reply ends with a short follow-up; answer the original prompt
+        user_prompts = [message.get("content") or "" for message in body.get("messages", []) if message.get("role") == "user"]
+        structured = (body.get("response_format") or {}).get("type") in ("json_schema", "json_object")
+        content = fake_reply(max(user_prompts, key=len, default=""), rng, structured)
+        if rng.random() < malformed_rate:
+            stats.add(malformed=1)
+            content = malformed(content, rng)
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(content) // 4
+        stats.add(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        return {
+            "id": f"chatcmpl-mock-{stats.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model") or "mock",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    app.post("/openai/deployments/{deployment}/chat/completions")(chat_completions)
+    app.post("/v1/chat/completions")(chat_completions)
+    return app
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StubServer:
+    """Run the stub on a background thread: `with StubServer(latency_ms=50) as stub: stub.url`"""
+
+    def __init__(self, port=None, **options):
+        self.port = port or free_port()
+        self.app = create_stub_app(**options)
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def stats(self):
+        return self.app.state.stats
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--jitter-ms", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--retry-after-ms", type=int, default=500)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of replies sent as near-JSON")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="share of requests delayed by --stall-ms")
+    parser.add_argument("--stall-ms", type=float, default=5000.0)
+    args = parser.parse_args()
+
+    app = create_stub_app(
+        args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate, args.retry_after_ms,
+        malformed_rate=args.malformed_rate, stall_rate=args.stall_rate, stall_ms=args.stall_ms,
+    )
+    print(f"🧪 Mock Azure OpenAI on http://127.0.0.1:{args.port}")
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
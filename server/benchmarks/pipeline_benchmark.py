@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end pipeline benchmark: synthetic workbook, mock Azure OpenAI, per-stage timings.
+Needs no network or API keys. Stages: parse, encode, kpi, llm (sheet insights), summary
+(general + additional) and end_to_end (one POST /upload_excel/ through the app).
+Run from the server directory:
+    python -m benchmarks.pipeline_benchmark --sheets 60 --latency-ms 200
+    python -m benchmarks.pipeline_benchmark --baseline before.json --output after.json
+Exits with status 1 when a stage exceeds its threshold or regresses against the baseline.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.mock_openai import StubServer
+from benchmarks.workbook_generator import generate_workbook
+
+SERVER_DIR = Path(__file__).resolve().parents[1]
+DEFAULT_THRESHOLDS = Path(__file__).with_name("pipeline_thresholds.json")
+NOISE_FLOOR_SECONDS = 0.05  # differences below this are never reported as regressions
+
+
+def configure_environment(stub_url):
+    """Point the app at the stub and make every run do the full work (no caches, no speculation)"""
+    os.environ.update({
+        "AZURE_ENDPOINT": stub_url,
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "AZURE_OPENAI_DEPLOYMENT": "benchmark",
+        "INSIGHT_CACHE_ENABLED": "false",
+        "INCREMENTAL_ANALYSIS": "false",
+        "SPECULATIVE_ADDITIONAL_INSIGHTS": "false",
+    })
+    os.environ.setdefault("LLAMA_API_KEY", "benchmark")
+
+
+def run_stages(workbook, stub, repeats):
+    """Time each stage `repeats` times; returns {stage: [seconds]} and {stage: stub requests per run}"""
+    # Imported only now: the OpenAI clients read AZURE_ENDPOINT when sheet_insights.config loads
+    from fastapi.testclient import TestClient
+    from sheet_insights.additional_insights import generate_additional_insights
+    from sheet_insights.encoder import encode_table
+    from sheet_insights.general_summary import generate_general_insights
+    from sheet_insights.insights import get_insights_batch_async
+    from sheet_insights.kpi_cube import KPICube
+    from sheet_insights.kpi_stats import sheet_kpi_stats
+    from sheet_insights.parser import extract_sheets, get_sheet_names, read_table_rows
+    from sheet_insights.xlsx_reader import open_workbook
+    import app as server_app
+
+    sheets = get_sheet_names(str(workbook))[1:]
+    client = TestClient(server_app.app)
+    workbook_bytes = Path(workbook).read_bytes()
+    timings, requests = {}, {}
+
+    def timed(stage, fn):
+        before = stub.stats.requests
+        start_time = time.perf_counter()
+        result = fn()
+        timings.setdefault(stage, []).append(time.perf_counter() - start_time)
+        requests[stage] = stub.stats.requests - before
+        return result
+
+    def parse():
+        wb = open_workbook(str(workbook))
+        try:
+            return [read_table_rows(wb[name]) for name in sheets]
+        finally:
+            wb.close()
+
+    def upload():
+        response = client.post("/upload_excel/", files={"file": ("benchmark.xlsx", workbook_bytes)})
+        response.raise_for_status()
+
+    for _ in range(repeats):
+        tables = timed("parse", parse)
+        timed("encode", lambda: [encode_table(rows, header_rows) for header_rows, rows in tables])
+        pairs = [(text, name) for name, text in extract_sheets(str(workbook), sheets_to_process=sheets)]
+        kpi_stats = timed("kpi", lambda: {name: sheet_kpi_stats(*table) for name, table in zip(sheets, tables)})
+        cube = KPICube.from_stats(kpi_stats)
+        results = timed("llm", lambda: asyncio.run(get_insights_batch_async(pairs, kpi_stats=kpi_stats)))
+        insights = {name: result for (_, name), result in zip(pairs, results) if isinstance(result, list)}
+
+        def summarise():
+            general = generate_general_insights(insights, kpi_cube=cube)
+            return generate_additional_insights(insights, general)
+
+        timed("summary", summarise)
+        timed("end_to_end", upload)
+    return timings, requests
+
+
+def check(report, thresholds, baseline, max_regression):
+    """List of human-readable failures: stages over their threshold or slower than the baseline"""
+    failures = []
+    for stage, result in report["stages"].items():
+        limit = thresholds.get(stage)
+        if limit is not None and result["median"] > limit:
+            failures.append(f"{stage}: {result['median']:.3f}s exceeds the {limit:.3f}s threshold")
+        previous = (baseline or {}).get("stages", {}).get(stage)
+        if previous:
+            allowed = previous["median"] * (1 + max_regression)
+            if result["median"] > allowed and result["median"] - previous["median"] > NOISE_FLOOR_SECONDS:
+                failures.append(
+                    f"{stage}: {result['median']:.3f}s is {result['median'] / previous['median'] - 1:+.0%} "
+                    f"against the baseline's {previous['median']:.3f}s"
+                )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sheets", type=int, default=60)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--extra-rows", type=int, default=0, help="filler rows per sheet to add parse weight")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="mock LLM latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of mock LLM requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of mock LLM requests failing with 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of mock LLM replies sent as near-JSON")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="share of mock LLM requests delayed by --stall-ms")
+    parser.add_argument("--stall-ms", type=float, default=5000.0)
+    parser.add_argument("--output", default="pipeline_benchmark.json", help="where to write the JSON report")
+    parser.add_argument("--thresholds", default=str(DEFAULT_THRESHOLDS), help="JSON of per-stage limits in seconds")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--max-regression", type=float, default=None, help="allowed slowdown against the baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    output = Path(args.output).resolve()
+    with open(args.thresholds, "r", encoding="utf-8") as f:
+        thresholds = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    max_regression = args.max_regression if args.max_regression is not None else thresholds.get("max_regression", 0.25)
+
+    stub_options = {
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "error_rate": args.error_rate,
+        "rate_limit_rate": args.rate_limit_rate,
+        "malformed_rate": args.malformed_rate,
+        "stall_rate": args.stall_rate,
+        "stall_ms": args.stall_ms,
+    }
+    sys.path.insert(0, str(SERVER_DIR))
+    with tempfile.TemporaryDirectory(prefix="pipeline_bench_") as tmp, StubServer(**stub_options) as stub:
+        configure_environment(stub.url)
+        workbook = Path(tmp) / "bench.xlsx"
+        generate_workbook(workbook, sheets=args.sheets, months=args.months, extra_rows=args.extra_rows)
+        print(f"📊 Workbook: {args.sheets} supplier sheets, {workbook.stat().st_size / 1024:.0f} KB; mock LLM at {stub.url}")
+
+        # The app keeps results, uploads and caches under relative paths; keep them out of the tree
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            timings, requests = run_stages(workbook, stub, args.repeats)
+        finally:
+            os.chdir(cwd)
+        stub_stats = stub.stats.snapshot()
+
+    from sheet_insights.scheduler import llm_scheduler
+
+    report = {
+        "benchmark": "pipeline",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": dict(vars(args), **stub_options),
+        "stages": {
+            stage: {
+                "median": round(statistics.median(runs), 4),
+                "min": round(min(runs), 4),
+                "max": round(max(runs), 4),
+                "runs": [round(run, 4) for run in runs],
+                "llm_requests": requests.get(stage, 0),
+            }
+            for stage, runs in timings.items()
+        },
+        "mock_llm": stub_stats,
+        "scheduler": llm_scheduler.stats(),
+    }
+    failures = check(report, thresholds.get("stages", {}), baseline, max_regression)
+    report["failures"] = failures
+    output.write_text(json.dumps(report, indent=2))
+
+    print("\n" + "=" * 58)
+    print(f"{'stage':<12}{'median (s)':>12}{'min (s)':>10}{'max (s)':>10}{'LLM calls':>12}")
+    for stage, result in report["stages"].items():
+        print(f"{stage:<12}{result['median']:>12.3f}{result['min']:>10.3f}{result['max']:>10.3f}{result['llm_requests']:>12}")
+    print(f"\n📝 Report written to {output}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ All stages within thresholds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Synthetic ACMA KPI workbook generator for offline benchmarks.
+Produces the same layout as the real supplier performance matrices in uploads/.
+Run from the server directory:  python -m benchmarks.workbook_generator bench.xlsx --sheets 500 --months 6
+"""
+
+import argparse
+import random
+from openpyxl import Workbook
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+KPI_ROWS = [
+    ("Safety- Accident data", "nos", (0, 2)),
+    ("Production loss due to Material shortage", "Hrs", (0, 4)),
+    ("OK delivery cycles- as per delivery calculation sheet of ACMA (%)", "%", (50, 100)),
+    ("Number of trips / month", "nos", (10, 80)),
+    ("Qty Shipped / month", "nos", (5000, 250000)),
+    ("No of Parts/ Trip", "nos", None),
+    ("Vehicle turnaround time", "Hrs", (0.5, 8)),
+    ("Machin break down Hrs", "Hrs", (0, 4)),
+    ("No of Machines breakdown", "nos", (0, 3)),
+]
+
+FIRST_MONTH_COL = 7  # column G
+FIRST_KPI_ROW = 6
+
+
+def column_letter(col):
+    letters = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def add_supplier_sheet(wb, name, months=5, extra_rows=0, rng=None):
+    """Append one supplier performance matrix with `months` filled month columns"""
+    rng = rng or random.Random(name)
+    ws = wb.create_sheet(title=name[:31])
+    ws.cell(row=1, column=2, value="Supplier Partner Performance Matrix ")
+    ws.cell(row=2, column=2, value="Tata AutoComp Business Unit: Chinchwad")
+    ws.cell(row=2, column=13, value=f"Name of Supplier Partner: {name}")
+    ws.cell(row=3, column=2, value="Buyer: Mr. Patil")
+    for col, title in ((2, "Sr No "), (3, "Parameters "), (6, "Unit"), (7, "Rating "), (20, "Responsible person"), (21, "Remarks ")):
+        ws.cell(row=4, column=col, value=title)
+    for i, month in enumerate(MONTHS):
+        ws.cell(row=5, column=FIRST_MONTH_COL + i, value=month)
+    ws.cell(row=5, column=FIRST_MONTH_COL + 12, value="Average ")
+
+    first_col = column_letter(FIRST_MONTH_COL)
+    last_col = column_letter(FIRST_MONTH_COL + 11)
+    for i, (parameter, unit, value_range) in enumerate(KPI_ROWS):
+        row = FIRST_KPI_ROW + i
+        ws.cell(row=row, column=1, value="Group 2" if i == 0 else None)
+        ws.cell(row=row, column=2, value=i + 1)
+        ws.cell(row=row, column=3, value=parameter)
+        ws.cell(row=row, column=6, value=unit)
+        for m in range(months):
+            col = FIRST_MONTH_COL + m
+            letter = column_letter(col)
+            if value_range is None:
+                # Parts per trip is derived from qty shipped / trips, as in the real sheets
+                value = f"={letter}{FIRST_KPI_ROW + 4}/{letter}{FIRST_KPI_ROW + 3}"
+            else:
+                low, high = value_range
+                value = rng.randint(low, high) if isinstance(low, int) and isinstance(high, int) else round(rng.uniform(low, high), 2)
+            ws.cell(row=row, column=col, value=value)
+        ws.cell(row=row, column=FIRST_MONTH_COL + 12, value=f"=AVERAGE({first_col}{row}:{last_col}{row})")
+        ws.cell(row=row, column=20, value="Owner")
+
+    notes_row = FIRST_KPI_ROW + len(KPI_ROWS)
+    ws.cell(row=notes_row, column=2, value="Notes: \n1)\n2)\n3)")
+
+    for r in range(extra_rows):
+        row = notes_row + 1 + r
+        for col in range(2, 20):
+            ws.cell(row=row, column=col, value=rng.randint(0, 1000))
+    return ws
+
+
+def generate_workbook(path, sheets=50, months=5, extra_rows=0, seed=42):
+    """Write a workbook with two summary sheets followed by `sheets` supplier sheets"""
+    rng = random.Random(seed)
+    wb = Workbook()
+    wb.active.title = "Average Summary"
+    wb.create_sheet("Analysis SUMMARY")
+    for i in range(sheets):
+        add_supplier_sheet(wb, f"Supplier {i + 1:03d}", months=months, extra_rows=extra_rows, rng=rng)
+    wb.save(path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--sheets", type=int, default=50, help="supplier sheets")
+    parser.add_argument("--months", type=int, default=5, help="filled month columns (1-12)")
+    parser.add_argument("--extra-rows", type=int, default=0, help="filler rows per sheet to add parse weight")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate_workbook(args.path, sheets=args.sheets, months=args.months, extra_rows=args.extra_rows, seed=args.seed)
+    print(f"📊 Wrote {args.path}: {args.sheets} supplier sheets, {args.months} months, {args.extra_rows} extra rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 import json
 from sheet_insights.config import client
+from sheet_insights.hierarchical import condense_sheet_insights
+from sheet_insights.metrics import timed
+from sheet_insights.scheduler import llm_scheduler
+from sheet_insights.structured import (
+    ReplyFormatError, call_with_repair, parse_insight_list, response_format, insight_list_schema,
+)
 import os
 
 ADDITIONAL_INSIGHTS_PROMPT = """
 You are an expert data analyst with deep analytical skills.
 
 You have been provided with:
-1. Individual sheet-wise insights (5 insights per supplier/sheet)
+1. Individual sheet-wise insights (5 insights per supplier/sheet), or for large workbooks findings condensed from groups of sheets
 2. General comparative insights (10 insights across all sheets)
 
 Your task is to generate exactly 5 NEW and DEEPER insights that were NOT covered in the previous insights. Focus on:
@@ -30,36 +36,43 @@ Requirements:
 - Include statistical observations and data-driven conclusions
 - Highlight anomalies, outliers, and unexpected patterns
 
-Return your answer as a **valid JSON list with exactly 5 strings**.
+Return your answer as a **valid JSON object {"insights": [...]} with exactly 5 strings**.
 Return only JSON. No markdown, no prose, no explanations.
 
-If there is not enough new data to generate meaningful additional insights, return: ["Insufficient new data patterns available for additional insights"].
+If there is not enough new data to generate meaningful additional insights, return: {"insights": ["Insufficient new data patterns available for additional insights"]}.
 """
 
+# Returned instead of insights when generation fails
+INVALID_REPLY = ["Error: Failed to generate valid additional insights"]
+GENERATION_FAILED = ["Error: Failed to generate additional insights"]
 
-def generate_additional_insights(insights_path: str, general_insights_path: str, output_path: str = "additional-insights.json"):
+
+def is_failed_result(additional_insights):
+    """True for the placeholder lists returned when generation failed (never worth caching)"""
+    return additional_insights in (INVALID_REPLY, GENERATION_FAILED)
+
+
+def generate_additional_insights(sheet_insights: dict, general_insights: list):
     """
     Generate additional insights based on existing insights and general insights
     
     Args:
-        insights_path: Path to the individual sheet insights JSON file
-        general_insights_path: Path to the general insights JSON file
-        output_path: Path to save the additional insights
+        sheet_insights: Individual sheet insights by sheet name
+        general_insights: General comparative insights
     
     Returns:
         List of additional insights
     """
+    with timed("additional_insights"):
+        return _generate_additional_insights(sheet_insights, general_insights)
+
+
+def _generate_additional_insights(sheet_insights: dict, general_insights: list):
     try:
-        # Load existing insights
-        with open(insights_path, "r", encoding="utf-8") as f:
-            sheet_insights = json.load(f)
-        
-        with open(general_insights_path, "r", encoding="utf-8") as f:
-            general_insights = json.load(f)
-        
-        # Prepare the input for the AI model
+        # Prepare the input for the AI model; large workbooks are condensed hierarchically first
+        data, condensed = condense_sheet_insights(sheet_insights)
         input_data = {
-            "sheet_insights": sheet_insights,
+            "condensed_sheet_findings" if condensed else "sheet_insights": data,
             "general_insights": general_insights
         }
         
@@ -67,48 +80,45 @@ def generate_additional_insights(insights_path: str, general_insights_path: str,
         
         print(f"🤖 Calling AI model for additional insights generation...")
         
-        response = client.chat.completions.create(
-            model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
-            messages=[
-                {"role": "system", "content": "You are an expert business analyst specializing in supply chain and operational analytics."},
-                {"role": "user", "content": ADDITIONAL_INSIGHTS_PROMPT + f"\n\nExisting Data:\n```json\n{input_text}\n```"}
-            ],
-            temperature=0.4,  # Slightly higher temperature for more creative insights
-            max_tokens=2000
-        )
-        
-        reply = response.choices[0].message.content.strip()
-        print(f"📝 Raw AI response received")
+        def send(messages):
+            return llm_scheduler.call(
+                client.chat.completions.create,
+                stage="additional",
+                model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+                messages=messages,
+                temperature=0.4,  # Slightly higher temperature for more creative insights
+                max_tokens=2000,
+                **response_format("additional_insights", insight_list_schema())
+            )
+
+        messages = [
+            {"role": "system", "content": "You are an expert business analyst specializing in supply chain and operational analytics."},
+            {"role": "user", "content": ADDITIONAL_INSIGHTS_PROMPT + f"\n\nExisting Data:\n```json\n{input_text}\n```"}
+        ]
         
-        # Parse the JSON response
+        # Near-JSON replies are repaired locally; only unreadable ones are asked again
         try:
-            additional_insights = json.loads(reply)
-            
-            # Validate that we got exactly 5 insights
-            if not isinstance(additional_insights, list):
-                raise ValueError("Response is not a list")
+            additional_insights = call_with_repair(
+                send, messages, lambda reply: parse_insight_list(reply, "additional"), "additional"
+            )
+            print(f"📝 AI response received")
 
             if len(additional_insights) != 5:
                 print(f"⚠️ Warning: Expected 5 insights, got {len(additional_insights)}")
             
-            # Save to file
-            with open(output_path, "w", encoding="utf-8") as f:
-                json.dump(additional_insights, f, indent=2, ensure_ascii=False)
-            
-            print(f"💾 Saved additional insights to: {output_path}")
             return additional_insights
             
-        except json.JSONDecodeError as e:
+        except ReplyFormatError as e:
             print(f"❌ Failed to parse AI response as JSON: {e}")
             # Save raw response for debugging
             with open("additional_insights_raw_output.txt", "w", encoding="utf-8") as f:
-                f.write(reply)
+                f.write(e.reply)
             print(f"🔍 Raw response saved to additional_insights_raw_output.txt for debugging")
-            return ["Error: Failed to generate valid additional insights"]
+            return list(INVALID_REPLY)
             
     except Exception as e:
         print(f"❌ Error in generate_additional_insights: {e}")
-        return ["Error: Failed to generate additional insights"]
+        return list(GENERATION_FAILED)
 
 
 def get_additional_insights_summary(additional_insights_path: str):
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from sheet_insights.config import (
+    INSIGHT_CACHE_DIR,
+    INSIGHT_CACHE_ENABLED,
+    INSIGHT_CACHE_MAX_AGE_DAYS,
+    INSIGHT_CACHE_MAX_ENTRIES,
+)
+from sheet_insights.metrics import CACHE_REQUESTS
+
+
+class InsightCache:
+    """Content-addressed on-disk cache of per-sheet insights.
+
+    Entries are keyed on a hash of the sheet table together with everything
+    that shapes the LLM answer (prompt, deployment, sampling params), so a
+    re-uploaded sheet with identical content is served without an API call.
+    """
+
+    def __init__(self, cache_dir, max_entries=2000, max_age_seconds=90 * 86400, enabled=True, evict_every=None):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.enabled = enabled
+        # Evicting scans the whole directory, so it runs once per batch of writes rather than per write
+        self.evict_every = evict_every or max(1, max_entries // 20)
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(table_text: str, prompt: str, model: str, params: dict):
+        """Build a stable cache key from sheet content and request settings"""
+        digest = hashlib.sha256()
+        for part in (table_text, prompt, model or "", json.dumps(params, sort_keys=True)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    def _path(self, key: str):
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str):
+        """Return cached insights for key, or None on a miss or expired entry"""
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        try:
+            age = time.time() - path.stat().st_mtime
+            if age > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+                with self._lock:
+                    self.misses += 1
+                    self.evictions += 1
+                CACHE_REQUESTS.inc(cache="insight", result="miss")
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            # Touch on hit so eviction drops least recently used entries first
+            os.utime(path, None)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            CACHE_REQUESTS.inc(cache="insight", result="miss")
+            return None
+
+        with self._lock:
+            self.hits += 1
+        CACHE_REQUESTS.inc(cache="insight", result="hit")
+        return entry.get("insights")
+
+    def set(self, key: str, insights, sheet_name: str = ""):
+        """Store insights for key; every evict_every writes, old entries over capacity are evicted.
+
+        The cache can briefly hold up to evict_every entries beyond
+        max_entries, and expired entries are also dropped when read.
+        """
+        if not self.enabled:
+            return
+
+        entry = {"sheet_name": sheet_name, "created_at": time.time(), "insights": insights}
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Failed to write insight cache entry for '{sheet_name}': {e}")
+            tmp_path.unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            self._writes += 1
+            due = self._writes >= self.evict_every
+            if due:
+                self._writes = 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones above max_entries"""
+        now = time.time()
+        entries = []
+        removed = 0
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:
+                continue
+            if now - mtime > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                entries.append((mtime, path))
+
+        overflow = len(entries) - self.max_entries
+        if overflow > 0:
+            entries.sort()
+            for _, path in entries[:overflow]:
+                path.unlink(missing_ok=True)
+                removed += 1
+
+        if removed:
+            with self._lock:
+                self.evictions += removed
+
+    def clear(self):
+        for path in self.cache_dir.glob("*.json"):
+            path.unlink(missing_ok=True)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(list(self.cache_dir.glob("*.json"))) if self.enabled else 0,
+            "max_entries": self.max_entries,
+            "max_age_days": round(self.max_age_seconds / 86400, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+insight_cache = InsightCache(
+    INSIGHT_CACHE_DIR,
+    max_entries=INSIGHT_CACHE_MAX_ENTRIES,
+    max_age_seconds=INSIGHT_CACHE_MAX_AGE_DAYS * 86400,
+    enabled=INSIGHT_CACHE_ENABLED,
+)
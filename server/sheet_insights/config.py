@@ -1,6 +1,10 @@
 import os
+import math
+import asyncio
+import weakref
+import httpx
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
 
 load_dotenv()
 
@@ -14,11 +18,135 @@ client = AzureOpenAI(
     azure_endpoint=AZURE_ENDPOINT,
     api_version="2025-01-01-preview",
     timeout=15.0,  # Reduced timeout for faster failure detection
-    max_retries=2   # Reduced retries for faster processing
+    max_retries=0   # Retries are handled by sheet_insights.scheduler
 )
 
-# Note: async_client removed to avoid import issues
-# Will use regular client with asyncio.to_thread for async processing
+# Native async client for per-sheet insights: one keep-alive connection pool per
+# event loop, sized to the concurrency limit, instead of a thread per request
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "12"))
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the AsyncAzureOpenAI client bound to the running event loop"""
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        # Hedged duplicates take no concurrency slot, so the pool has room for them on top
+        hedge_headroom = math.ceil(LLM_HEDGE_MAX_SHARE * LLM_MAX_CONCURRENCY) if LLM_HEDGING else 0
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONCURRENCY + hedge_headroom,
+                max_keepalive_connections=LLM_MAX_CONCURRENCY + hedge_headroom,
+                keepalive_expiry=60.0,
+            ),
+            timeout=httpx.Timeout(15.0, connect=5.0),
+        )
+        async_client = AsyncAzureOpenAI(
+            api_key=AZURE_API_KEY,
+            azure_endpoint=AZURE_ENDPOINT,
+            api_version="2025-01-01-preview",
+            timeout=15.0,
+            max_retries=0,
+            http_client=http_client,
+        )
+        _async_clients[loop] = async_client
+    return async_client
+
+
+async def close_async_client():
+    """Close the running loop's client and its connection pool (app shutdown)"""
+    async_client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if async_client is not None:
+        await async_client.close()
+
+# Rate-limit scheduler in front of every chat completion (0 disables a bucket);
+# set these to the deployment's quota so calls are paced instead of hitting 429s
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "0"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "0"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))  # timeouts / 5xx
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "6"))  # 429s
+# Hedged requests (async calls only): a call still unanswered at LLM_HEDGE_PERCENTILE of the stage's
+# recent latencies gets a duplicate request, the first answer wins and the other is cancelled
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
+LLM_HEDGE_STAGES = [stage.strip() for stage in os.getenv("LLM_HEDGE_STAGES", "sheet,packed").split(",") if stage.strip()]
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MAX_SHARE = float(os.getenv("LLM_HEDGE_MAX_SHARE", "0.1"))  # at most this share of calls is duplicated
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))  # latencies seen before hedging starts
+# After this many failed calls in a row, stop calling the LLM and serve instant insights
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# Pack small sheets into one insight request answered as JSON keyed by sheet name
+INSIGHT_PACKING = os.getenv("INSIGHT_PACKING", "true").lower() == "true"
+PACK_SMALL_SHEET_TOKENS = int(os.getenv("PACK_SMALL_SHEET_TOKENS", "600"))  # sheets at or under this are packed
+PACK_TOKEN_CEILING = int(os.getenv("PACK_TOKEN_CEILING", "3200"))  # sheet text per packed request
+PACK_MAX_SHEETS = int(os.getenv("PACK_MAX_SHEETS", "8"))
+
+# Structured output for insight calls: "json_schema" (strict schema), "json_object", or "off" for
+# deployments without it; replies are repaired locally and only unreadable ones are asked again
+LLM_RESPONSE_FORMAT = os.getenv("LLM_RESPONSE_FORMAT", "json_schema").lower()
+LLM_FORMAT_RETRIES = int(os.getenv("LLM_FORMAT_RETRIES", "1"))
+
+# Per-upload token budget (prompt + completion caps) split across sheets by information content; 0 = unlimited
+JOB_TOKEN_BUDGET = int(os.getenv("JOB_TOKEN_BUDGET", "0"))
+BUDGET_MIN_SHEET_TOKENS = int(os.getenv("BUDGET_MIN_SHEET_TOKENS", "150"))  # table text every sheet keeps
+BUDGET_SUMMARY_RESERVE = int(os.getenv("BUDGET_SUMMARY_RESERVE", "6000"))  # held back for the summaries
+
+# Per-sheet insight cache - unchanged sheets are served without an LLM call
+INSIGHT_CACHE_ENABLED = os.getenv("INSIGHT_CACHE_ENABLED", "true").lower() == "true"
+INSIGHT_CACHE_DIR = os.getenv("INSIGHT_CACHE_DIR", "results/insight_cache")
+INSIGHT_CACHE_MAX_ENTRIES = int(os.getenv("INSIGHT_CACHE_MAX_ENTRIES", "2000"))
+INSIGHT_CACHE_MAX_AGE_DAYS = float(os.getenv("INSIGHT_CACHE_MAX_AGE_DAYS", "90"))
+
+# Previous version of each workbook, so a monthly re-upload only re-analyses changed sheets
+INCREMENTAL_ANALYSIS = os.getenv("INCREMENTAL_ANALYSIS", "true").lower() == "true"
+WORKBOOK_VERSIONS_DIR = os.getenv("WORKBOOK_VERSIONS_DIR", "results/workbook_versions")
+# One snapshot per workbook, replaced on every upload; kept well past the monthly upload cadence
+# so a late month still finds its baseline
+WORKBOOK_VERSIONS_RETENTION_DAYS = float(os.getenv("WORKBOOK_VERSIONS_RETENTION_DAYS", "120"))
+
+# Generate additional insights in the background once the general summary is stored
+SPECULATIVE_ADDITIONAL_INSIGHTS = os.getenv("SPECULATIVE_ADDITIONAL_INSIGHTS", "true").lower() == "true"
+
+# Summaries of large workbooks are built hierarchically: sheet insights beyond
+# SUMMARY_DIRECT_TOKENS are condensed in parallel chunks, then chunk findings are reduced again
+SUMMARY_DIRECT_TOKENS = int(os.getenv("SUMMARY_DIRECT_TOKENS", "12000"))
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000"))
+SUMMARY_CHUNK_FINDINGS = int(os.getenv("SUMMARY_CHUNK_FINDINGS", "8"))
+SUMMARY_RANKED_SUPPLIERS = int(os.getenv("SUMMARY_RANKED_SUPPLIERS", "20"))  # longer KPI rankings keep the top and bottom
+
+# Record a timeline of stages and LLM calls for every upload (or per request with trace=true), served at /trace
+JOB_TRACE = os.getenv("JOB_TRACE", "false").lower() == "true"
+
+# Uploaded workbooks, stored once per content hash
+UPLOAD_BLOB_DIR = os.getenv("UPLOAD_BLOB_DIR", "uploads/blobs")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "50")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_KB", "1024")) * 1024
+
+# Extracted sheets stay in memory; set PERSIST_MARKDOWN=true to also write them to disk for debugging
+PERSIST_MARKDOWN = os.getenv("PERSIST_MARKDOWN", "false").lower() == "true"
+# Artefacts (uploads, debug markdown) untouched for this long are deleted
+ARTEFACT_RETENTION_DAYS = float(os.getenv("ARTEFACT_RETENTION_DAYS", "30"))
+ARTEFACT_GC_INTERVAL_HOURS = float(os.getenv("ARTEFACT_GC_INTERVAL_HOURS", "6"))
+
+# Background job queue for uploads
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "results/jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "50"))
+
+# Per-run results (sheet insights, summaries, KPI data) shared by all API worker processes
+RESULT_DB_PATH = os.getenv("RESULT_DB_PATH", "results/results.db")
+RESULT_RUNS_DIR = os.getenv("RESULT_RUNS_DIR", "results/runs")
+RESULT_RUNS_KEEP = int(os.getenv("RESULT_RUNS_KEEP", "50"))
+# Runs still unfinished after this long were abandoned (e.g. the process died) and may be pruned
+RESULT_STALE_RUN_HOURS = float(os.getenv("RESULT_STALE_RUN_HOURS", "24"))
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))  # >1 runs uvicorn with several processes, without reload
+
+# In-memory cache of serialised read responses (ETag / 304, gzip or brotli above the size floor)
+RESPONSE_CACHE_ENTRIES = int(os.getenv("RESPONSE_CACHE_ENTRIES", "256"))
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
 
 from llama_cloud_services import LlamaParse
 
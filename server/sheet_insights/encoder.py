@@ -0,0 +1,210 @@
+import os
+import re
+import threading
+
+# Read here rather than in config.py so spawned extraction workers can use it
+# without importing the OpenAI / LlamaParse clients.
+TABLE_ENCODING = os.getenv("TABLE_ENCODING", "compact")  # "compact" or "markdown"
+SHEET_TOKEN_BUDGET = int(os.getenv("SHEET_TOKEN_BUDGET", "1200"))
+TIKTOKEN_ENCODING = os.getenv("TIKTOKEN_ENCODING", "o200k_base")
+
+MONTHS = ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec")
+DELIMITER = "|"
+SHORT_CELL_CHARS = 24
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """Load the tiktoken encoding once; None when it can't be loaded (e.g. offline)"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+                except Exception as e:
+                    print(f"⚠️ tiktoken encoding '{TIKTOKEN_ENCODING}' unavailable ({e}), estimating tokens from length")
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str):
+    """Count prompt tokens with tiktoken, or estimate ~4 characters per token"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+EXCEL_ERRORS = ("#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#N/A", "#NUM!", "#NULL!")
+
+
+def _is_empty(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _is_blank(value):
+    """Empty, or an Excel error such as the #DIV/0! left in unfilled month columns"""
+    return _is_empty(value) or (isinstance(value, str) and value.strip() in EXCEL_ERRORS)
+
+
+def format_cell(value, max_chars=60):
+    """Render one cell compactly: trimmed numbers, single-line text, no delimiters"""
+    if _is_empty(value):
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float):
+        if value.is_integer():
+            return str(int(value))
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    if isinstance(value, int):
+        return str(value)
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d")
+
+    text = re.sub(r"\s+", " ", str(value)).strip().replace(DELIMITER, "/")
+    if len(text) > max_chars:
+        cut = text[:max_chars - 1].rsplit(" ", 1)[0] or text[:max_chars - 1]
+        text = cut + "…"
+    return text
+
+
+def _header_labels(header_rows, columns):
+    """Merge the two header rows into one label per kept column.
+
+    The ACMA sheets put "Parameters"/"Unit"/"Rating" on one row and the month
+    names under "Rating" on the next; the lower, more specific label wins.
+    """
+    labels = []
+    for col in columns:
+        label = ""
+        for row in header_rows:
+            if col < len(row) and not _is_empty(row[col]):
+                label = format_cell(row[col], SHORT_CELL_CHARS)
+        labels.append(label)
+    return labels
+
+
+def _is_month(label):
+    return label[:3].lower() in MONTHS and len(label) <= 9
+
+
+def _collapse_months(labels):
+    """Replace a run of consecutive month labels with "Jan..May" to save header tokens"""
+    collapsed = []
+    i = 0
+    while i < len(labels):
+        j = i
+        while j < len(labels) and _is_month(labels[j]):
+            j += 1
+        run = [label[:3].lower() for label in labels[i:j]]
+        if len(run) >= 3 and all(MONTHS.index(b) == MONTHS.index(a) + 1 for a, b in zip(run, run[1:])):
+            collapsed.append(f"{labels[i]}..{labels[j - 1]}")
+            i = j
+        else:
+            collapsed.append(labels[i])
+            i += 1
+    return collapsed
+
+
+def _numbers(cells):
+    values = []
+    for cell in cells:
+        if isinstance(cell, (int, float)) and not isinstance(cell, bool):
+            values.append(float(cell))
+    return values
+
+
+def _summarise_row(row, label_cols, value_cols):
+    """One-line stand-in for a row that did not fit: its label plus min/max/mean"""
+    label = " ".join(format_cell(row[c], SHORT_CELL_CHARS) for c in label_cols if c < len(row) and not _is_empty(row[c]))
+    values = _numbers(row[c] for c in value_cols if c < len(row))
+    if not values:
+        return label or None
+    mean = sum(values) / len(values)
+    return f"{label}: n={len(values)} min={format_cell(min(values))} max={format_cell(max(values))} mean={format_cell(mean)}"
+
+
+def encode_table(rows, header_rows=(), token_budget=None):
+    """Encode a sheet's table as dense delimiter-separated lines within a token budget.
+
+    Drops all-empty rows and columns, merges the header rows into one line, and
+    renders numbers without padding. If the table is still over budget, long
+    text cells are shortened, then trailing rows are replaced by one-line
+    summaries; rows are never cut in half.
+    """
+    token_budget = token_budget or SHEET_TOKEN_BUDGET
+    rows = [row for row in rows if any(not _is_empty(cell) for cell in row)]
+    if not rows:
+        return ["No data found"]
+
+    width = max(len(row) for row in rows)
+    columns = [c for c in range(width) if any(c < len(row) and not _is_blank(row[c]) for row in rows)]
+    labels = _header_labels(header_rows, columns)
+
+    # Columns holding text in most rows (parameter, unit) identify a row in summaries;
+    # month columns (or everything after the labels) hold the values to summarise
+    label_cols = [c for c in columns if sum(isinstance(row[c], str) for row in rows if c < len(row)) > len(rows) // 2][:2]
+    value_cols = [c for c, label in zip(columns, labels) if _is_month(label)]
+    if not value_cols:
+        value_cols = [c for c in columns if not label_cols or c > label_cols[-1]]
+
+    for max_chars in (60, SHORT_CELL_CHARS):
+        lines = []
+        if any(labels):
+            lines.append("columns: " + DELIMITER.join(_collapse_months(labels)))
+        for row in rows:
+            cells = [format_cell(row[c] if c < len(row) else None, max_chars) for c in columns]
+            lines.append(DELIMITER.join(cells).rstrip(DELIMITER))
+
+        line_tokens = [count_tokens(line) + 1 for line in lines]
+        if sum(line_tokens) <= token_budget:
+            return lines
+
+    # Still too big: keep whole rows in order, summarise the rest
+    kept, used = [], 0
+    header_count = 1 if any(labels) else 0
+    reserve = min(token_budget // 4, 200)
+    for i, (line, tokens) in enumerate(zip(lines, line_tokens)):
+        if used + tokens > token_budget - reserve and i >= header_count:
+            break
+        kept.append(line)
+        used += tokens
+
+    omitted = rows[len(kept) - header_count:]
+    for j, row in enumerate(omitted):
+        summary = _summarise_row(row, label_cols, value_cols)
+        if not summary:
+            continue
+        summary = f"~ {summary}"
+        tokens = count_tokens(summary) + 1
+        if used + tokens > token_budget - 12:
+            kept.append(f"(+{len(omitted) - j} more rows omitted)")
+            break
+        kept.append(summary)
+        used += tokens
+    return kept
+
+
+def fit_text_to_budget(text: str, token_budget=None):
+    """Trim already-encoded text to the token budget at line boundaries"""
+    token_budget = token_budget or SHEET_TOKEN_BUDGET
+    if count_tokens(text) <= token_budget:
+        return text, False
+
+    lines = text.splitlines()
+    kept, used = [], 0
+    for i, line in enumerate(lines):
+        tokens = count_tokens(line) + 1
+        if used + tokens > token_budget - 12:
+            kept.append(f"(+{len(lines) - i} more rows omitted)")
+            break
+        kept.append(line)
+        used += tokens
+    return "\n".join(kept), True
@@ -0,0 +1,345 @@
+import re
+
+import numpy as np
+
+# Formula subset used by the ACMA KPI sheets: AVERAGE/SUM/MIN/MAX/COUNT over
+# same-sheet ranges, arithmetic and cell references (e.g. =AVERAGE(G7:R7), =G10/G9).
+# Anything else (other functions, cross-sheet or external links) is left untouched.
+
+TOKEN = re.compile(
+    r"\s*(?:"
+    r"(?P<range>\$?[A-Z]{1,3}\$?\d+:\$?[A-Z]{1,3}\$?\d+)"
+    r"|(?P<func>[A-Z][A-Z0-9.]*)\("
+    r"|(?P<ref>\$?[A-Z]{1,3}\$?\d+)"
+    r"|(?P<number>\d+(?:\.\d*)?(?:[Ee][+-]?\d+)?|\.\d+(?:[Ee][+-]?\d+)?)"
+    r"|(?P<op>[-+*/^(),%])"
+    r")"
+)
+CELL = re.compile(r"\$?([A-Z]{1,3})\$?(\d+)")
+
+EXCEL_ERRORS = ("#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#N/A", "#NUM!", "#NULL!")
+
+
+class FormulaError(Exception):
+    """An Excel error value (#DIV/0!, #VALUE!, ...) produced while evaluating"""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class Unsupported(Exception):
+    """Formula uses syntax or references outside the supported subset"""
+
+
+class Pending(Exception):
+    """Formula depends on another formula that has not been resolved yet"""
+
+
+def _column_index(letters):
+    index = 0
+    for char in letters:
+        index = index * 26 + (ord(char) - 64)
+    return index
+
+
+def _cell(ref):
+    letters, row = CELL.fullmatch(ref).groups()
+    return int(row), _column_index(letters)
+
+
+def tokenize(formula):
+    tokens = []
+    pos = 0
+    text = formula.upper()
+    while pos < len(text):
+        if text[pos:].strip() == "":
+            break
+        match = TOKEN.match(text, pos)
+        if not match:
+            raise Unsupported(formula)
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "range":
+            start, end = value.split(":")
+            tokens.append(("range", _cell(start) + _cell(end)))
+        elif kind == "ref":
+            tokens.append(("ref", _cell(value)))
+        elif kind == "number":
+            tokens.append(("number", float(value)))
+        else:
+            tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser producing a small tuple AST"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        kind, got = self.take()
+        if got != value:
+            raise Unsupported(f"expected {value!r}")
+
+    def parse(self):
+        node = self.expression()
+        if self.pos != len(self.tokens):
+            raise Unsupported("trailing tokens")
+        return node
+
+    def expression(self):
+        node = self.term()
+        while self.peek()[1] in ("+", "-"):
+            node = ("bin", self.take()[1], node, self.term())
+        return node
+
+    def term(self):
+        node = self.power()
+        while self.peek()[1] in ("*", "/"):
+            node = ("bin", self.take()[1], node, self.power())
+        return node
+
+    def power(self):
+        node = self.unary()
+        while self.peek()[1] == "^":
+            self.take()
+            node = ("bin", "^", node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek()[1] in ("-", "+"):
+            sign = self.take()[1]
+            node = self.unary()
+            return ("neg", node) if sign == "-" else node
+        node = self.primary()
+        while self.peek()[1] == "%":
+            self.take()
+            node = ("bin", "/", node, ("number", 100.0))
+        return node
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == "number":
+            return ("number", value)
+        if kind == "ref":
+            return ("ref", value)
+        if kind == "range":
+            return ("range", value)
+        if kind == "func":
+            if value not in FUNCTIONS:
+                raise Unsupported(value)
+            args = []
+            if self.peek()[1] != ")":
+                args.append(self.expression())
+                while self.peek()[1] == ",":
+                    self.take()
+                    args.append(self.expression())
+            self.expect(")")
+            return ("call", value, args)
+        if value == "(":
+            node = self.expression()
+            self.expect(")")
+            return node
+        raise Unsupported(f"unexpected token {value!r}")
+
+
+def _average(values):
+    if values.size == 0:
+        raise FormulaError("#DIV/0!")
+    return float(values.mean())
+
+
+FUNCTIONS = {
+    "SUM": lambda values: float(values.sum()),
+    "AVERAGE": _average,
+    "MIN": lambda values: float(values.min()) if values.size else 0.0,
+    "MAX": lambda values: float(values.max()) if values.size else 0.0,
+    "COUNT": lambda values: float(values.size),
+}
+
+
+class FormulaGrid:
+    """Evaluates formula cells of a block of rows against a NumPy view of its values.
+
+    The block starts at sheet row `first_row`; references outside it are
+    unsupported because their values were never read.
+    """
+
+    def __init__(self, rows, first_row):
+        self.first_row = first_row
+        width = max((len(row) for row in rows), default=0)
+        self.rows = [list(row) + [None] * (width - len(row)) for row in rows]
+        self.shape = (len(self.rows), width)
+        self.numbers = np.full(self.shape, np.nan)
+        self.errors = np.zeros(self.shape, dtype=bool)
+        self.pending = np.zeros(self.shape, dtype=bool)
+        self.unresolved = np.zeros(self.shape, dtype=bool)
+        self.formulas = {}
+
+        for r, row in enumerate(self.rows):
+            for c, value in enumerate(row):
+                if isinstance(value, str) and value.startswith("=") and len(value) > 1:
+                    self.formulas[(r, c)] = value
+                    self.pending[r, c] = True
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.numbers[r, c] = value
+                elif isinstance(value, str) and value in EXCEL_ERRORS:
+                    self.errors[r, c] = True
+
+    def _index(self, row, col):
+        r, c = row - self.first_row, col - 1
+        if not (0 <= r < self.shape[0]):
+            raise Unsupported("reference outside the extracted block")
+        return r, c
+
+    def _scalar(self, row, col):
+        r, c = self._index(row, col)
+        if c >= self.shape[1]:
+            return 0.0
+        if self.pending[r, c]:
+            raise Pending()
+        if self.unresolved[r, c]:
+            raise Unsupported("depends on an unsupported formula")
+        if self.errors[r, c]:
+            raise FormulaError(self.rows[r][c])
+        if not np.isnan(self.numbers[r, c]):
+            return float(self.numbers[r, c])
+        value = self.rows[r][c]
+        if value is None or value == "" or (isinstance(value, str) and not value.strip()):
+            return 0.0
+        if isinstance(value, bool):
+            return float(value)
+        raise FormulaError("#VALUE!")
+
+    def _range(self, bounds):
+        row1, col1, row2, col2 = bounds
+        r1, c1 = self._index(min(row1, row2), min(col1, col2))
+        r2, c2 = self._index(max(row1, row2), max(col1, col2))
+        window = (slice(r1, r2 + 1), slice(c1, c2 + 1))
+        if self.pending[window].any():
+            raise Pending()
+        if self.unresolved[window].any():
+            raise Unsupported("depends on an unsupported formula")
+        errors = self.errors[window]
+        if errors.any():
+            er, ec = np.argwhere(errors)[0]
+            raise FormulaError(self.rows[r1 + er][c1 + ec])
+        values = self.numbers[window]
+        return values[~np.isnan(values)]
+
+    def _eval(self, node):
+        kind = node[0]
+        if kind == "number":
+            return node[1]
+        if kind == "ref":
+            return self._scalar(*node[1])
+        if kind == "range":
+            raise Unsupported("range outside a function")
+        if kind == "neg":
+            return -self._eval(node[1])
+        if kind == "call":
+            parts = []
+            for arg in node[2]:
+                if arg[0] == "range":
+                    parts.append(self._range(arg[1]))
+                else:
+                    parts.append(np.array([self._eval(arg)]))
+            values = np.concatenate(parts) if parts else np.array([])
+            return FUNCTIONS[node[1]](values)
+
+        _, op, left, right = node
+        a, b = self._eval(left), self._eval(right)
+        if op == "+":
+            return a + b
+        if op == "-":
+            return a - b
+        if op == "*":
+            return a * b
+        if op == "/":
+            if b == 0:
+                raise FormulaError("#DIV/0!")
+            return a / b
+        if a < 0 and not float(b).is_integer():
+            # A negative base with a fractional exponent has no real result, so Excel gives #NUM!
+            raise FormulaError("#NUM!")
+        try:
+            result = a ** b
+        except (OverflowError, ZeroDivisionError):
+            raise FormulaError("#NUM!")
+        if isinstance(result, complex) or not np.isfinite(result):
+            raise FormulaError("#NUM!")
+        return result
+
+    def evaluate(self):
+        """Resolve formulas until no more progress, returning the rows as tuples"""
+        compiled = {}
+        for cell, formula in self.formulas.items():
+            try:
+                compiled[cell] = _Parser(tokenize(formula[1:])).parse()
+            except Unsupported:
+                # Keep the formula text as-is
+                self.pending[cell] = False
+                self.unresolved[cell] = True
+
+        while compiled:
+            progressed = False
+            for (r, c), ast in list(compiled.items()):
+                try:
+                    value = self._eval(ast)
+                except Pending:
+                    continue
+                except Unsupported:
+                    self.pending[r, c] = False
+                    self.unresolved[r, c] = True
+                    del compiled[(r, c)]
+                    progressed = True
+                    continue
+                except FormulaError as e:
+                    self.rows[r][c] = e.code
+                    self.errors[r, c] = True
+                else:
+                    # Four decimals is plenty for KPI values and keeps prompts short
+                    value = round(value, 4)
+                    if float(value).is_integer():
+                        value = int(value)
+                    self.rows[r][c] = value
+                    self.numbers[r, c] = value
+                self.pending[r, c] = False
+                del compiled[(r, c)]
+                progressed = True
+            if not progressed:
+                # Circular references: leave them unevaluated
+                for cell in compiled:
+                    self.pending[cell] = False
+                    self.unresolved[cell] = True
+                break
+
+        return [tuple(row) for row in self.rows]
+
+
+def has_formulas(rows):
+    return any(isinstance(value, str) and value.startswith("=") for row in rows for value in row)
+
+
+def evaluate_formulas(rows, first_row=1):
+    """Replace formula strings in a block of rows with locally computed values.
+
+    rows are the tuples yielded by iter_rows starting at sheet row first_row.
+    Unsupported formulas are returned unchanged; Excel errors such as #DIV/0!
+    are returned as their error text, matching cached workbook values.
+    """
+    if not has_formulas(rows):
+        return rows
+    return FormulaGrid(rows, first_row).evaluate()
@@ -1,5 +1,11 @@
 import json
-from sheet_insights.config import client
+from sheet_insights.config import client, SUMMARY_RANKED_SUPPLIERS
+from sheet_insights.hierarchical import condense_sheet_insights
+from sheet_insights.metrics import timed
+from sheet_insights.scheduler import llm_scheduler
+from sheet_insights.structured import (
+    ReplyFormatError, call_with_repair, parse_insight_list, response_format, insight_list_schema,
+)
 import os
 
 SUMMARY_PROMPT = """
@@ -14,35 +20,70 @@ Given the following JSON object of sheet-wise insights, generate exactly 10 deep
 - Avoid generic or vague summaries.
 - Skip sheets that only say “No data available”.
 
-Return your answer as a **valid JSON list with exactly 10 strings**.
+Return your answer as a **valid JSON object {"insights": [...]} with exactly 10 strings**.
 Return only JSON. No markdown, no prose, no explanations, no bullet points.
 
-If there is not enough data, return: ["Not enough data available"].
+If there is not enough data, return: {"insights": ["Not enough data available"]}.
 """
 
+# Used for large workbooks, whose sheet insights were first condensed group by group
+SUMMARY_CONDENSED_PROMPT = SUMMARY_PROMPT.replace(
+    "JSON object of sheet-wise insights",
+    "JSON object of findings condensed from groups of sheets (keys name the sheets each group covers)",
+)
 
-def generate_general_insights(all_insights_path: str, output_path: str = "General-info.json"):
-    with open(all_insights_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+# Used when the workbook's KPI cube is available: the model compares suppliers
+# from locally computed tables instead of re-reading its own per-sheet bullets
+SUMMARY_TABLES_PROMPT = """
+You are an expert data analyst.
+
+Given the following cross-supplier KPI comparison tables (computed exactly from the workbook: supplier rankings by monthly average, percentiles and correlations), generate exactly 10 deep and comparative insights across all suppliers. Make sure to :
+- Keep the word limit 10-15 words per point.
+- Use the exact numbers from the tables; do not recompute them.
+- Compare and contrast suppliers, naming leaders, laggards and outliers against the median.
+- Reveal underlying trends, anomalies, or correlations.
+- Avoid generic or vague summaries.
+
+Return your answer as a **valid JSON object {"insights": [...]} with exactly 10 strings**.
+Return only JSON. No markdown, no prose, no explanations, no bullet points.
+
+If there is not enough data, return: {"insights": ["Not enough data available"]}.
+"""
+
+
+def generate_general_insights(sheet_insights: dict, kpi_cube=None):
+    """Cross-sheet insights from the KPI cube's comparison tables, or from the sheet insights without one"""
+    with timed("general_insights"):
+        return _generate_general_insights(sheet_insights, kpi_cube)
+
+
+def _generate_general_insights(sheet_insights: dict, kpi_cube=None):
+    if kpi_cube is not None and kpi_cube.kpis:
+        prompt = SUMMARY_TABLES_PROMPT + f"\n```\n{kpi_cube.comparison_tables(max_ranked=SUMMARY_RANKED_SUPPLIERS)}\n```"
+    else:
+        # Hundreds of sheets don't fit one prompt; condense them hierarchically first
+        data, condensed = condense_sheet_insights(sheet_insights)
+        input_text = json.dumps(data, indent=2)
+        prompt = (SUMMARY_CONDENSED_PROMPT if condensed else SUMMARY_PROMPT) + f"\n```\n{input_text}\n```"
 
-    input_text = json.dumps(data, indent=2)
+    def send(messages):
+        return llm_scheduler.call(
+            client.chat.completions.create,
+            stage="general",
+            model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+            messages=messages,
+            temperature=0.3,
+            max_tokens=1200,
+            **response_format("general_insights", insight_list_schema())
+        )
 
-    response = client.chat.completions.create(
-        model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
-        messages=[
-            {"role": "system", "content": "You are a helpful business analyst."},
-            {"role": "user", "content": SUMMARY_PROMPT + f"\n```\n{input_text}\n```"}
-        ],
-        temperature=0.3,
-        max_tokens=1200
-    )
-    reply = response.choices[0].message.content.strip()
+    messages = [
+        {"role": "system", "content": "You are a helpful business analyst."},
+        {"role": "user", "content": prompt}
+    ]
     try:
-        general = json.loads(reply)
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(general, f, indent=2)
-        return general
-    except json.JSONDecodeError:
+        return call_with_repair(send, messages, lambda reply: parse_insight_list(reply, "general"), "general")
+    except ReplyFormatError as e:
         with open("general_summary_raw.txt", "w", encoding="utf-8") as f:
-            f.write(reply)
+            f.write(e.reply)
         return []
@@ -0,0 +1,134 @@
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from sheet_insights.config import (
+    client, LLM_MAX_CONCURRENCY, SUMMARY_DIRECT_TOKENS, SUMMARY_CHUNK_TOKENS, SUMMARY_CHUNK_FINDINGS,
+)
+from sheet_insights.encoder import count_tokens
+from sheet_insights.metrics import FALLBACKS, timed
+from sheet_insights.scheduler import llm_scheduler
+from sheet_insights.structured import call_with_repair, parse_insight_list, response_format, insight_list_schema
+
+CONDENSE_PROMPT = """
+You are an expert data analyst.
+
+Given the following JSON object of insights for a group of supplier sheets (or of findings already condensed from groups of sheets), condense them into at most {findings} findings for the whole group. Make sure to :
+- Keep the word limit 15-25 words per point.
+- Name the suppliers and keep exact numbers, percentages, or statistical findings.
+- Keep leaders, laggards, outliers, trends, anomalies and correlations; drop generic or repeated points.
+- Skip sheets that only say “No data available”.
+
+Return your answer as a **valid JSON object {{"insights": [...]}} of strings**.
+Return only JSON. No markdown, no prose, no explanations, no bullet points.
+"""
+
+
+def _label(names):
+    """Key for a group's findings, e.g. "Daxter … Wipro (40 sheets)" """
+    if len(names) == 1:
+        return names[0]
+    return f"{names[0]} … {names[-1]} ({len(names)} sheets)"
+
+
+def _chunk(items, token_budget):
+    """Group consecutive (names, data, tokens) items into chunks of at most token_budget.
+
+    A chunk always takes at least two items, so every round at least halves
+    the number of items and the reduction terminates.
+    """
+    chunks, current, size = [], [], 0
+    for item in items:
+        if len(current) >= 2 and size + item[2] > token_budget:
+            chunks.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += item[2]
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _item(names, data):
+    return names, data, count_tokens(json.dumps(data, ensure_ascii=False))
+
+
+def _condense_chunk(chunk):
+    """One LLM call turning a chunk into a single item of findings; None if the call fails or the reply isn't usable"""
+    names = [name for item_names, _, _ in chunk for name in item_names]
+    payload = {_label(item_names): data for item_names, data, _ in chunk}
+    prompt = CONDENSE_PROMPT.format(findings=SUMMARY_CHUNK_FINDINGS) + f"\n```\n{json.dumps(payload, indent=2, ensure_ascii=False)}\n```"
+
+    def send(messages):
+        return llm_scheduler.call(
+            client.chat.completions.create,
+            stage="condense",
+            model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+            messages=messages,
+            temperature=0.3,
+            max_tokens=60 * SUMMARY_CHUNK_FINDINGS,
+            **response_format("condensed_findings", insight_list_schema())
+        )
+
+    messages = [
+        {"role": "system", "content": "You are a helpful business analyst."},
+        {"role": "user", "content": prompt}
+    ]
+    try:
+        findings = call_with_repair(send, messages, lambda reply: parse_insight_list(reply, "condense"), "condense")
+    except Exception as e:
+        # One failed chunk (bad reply, API error, open circuit) must not sink the chunks that succeeded
+        print(f"⚠️ Could not condense {_label(names)} ({type(e).__name__}: {e}), leaving it out of the summary")
+        FALLBACKS.inc(stage="condense", kind="dropped")
+        return None
+    return _item(names, findings[:SUMMARY_CHUNK_FINDINGS])
+
+
+def _truncate(sheet_insights: dict, token_budget: int):
+    """As many whole sheets, in order, as fit token_budget"""
+    data, used = {}, 0
+    for name, insights in sheet_insights.items():
+        tokens = _item([name], insights)[2]
+        if data and used + tokens > token_budget:
+            break
+        data[name] = insights
+        used += tokens
+    return data
+
+
+def condense_sheet_insights(sheet_insights: dict, token_budget: int = None):
+    """Shrink sheet insights until they fit one summary prompt.
+
+    Returns (data, condensed). Insights within token_budget come back as they
+    are; larger ones are split into chunks of SUMMARY_CHUNK_TOKENS that are
+    condensed in parallel (map), and the resulting findings are chunked and
+    condensed again (reduce) until they fit. Each round shrinks the input by
+    the chunk fan-in, so the number of sequential rounds grows with the log of
+    the sheet count. Condensed data maps group labels to lists of findings.
+    If every chunk of a round fails, the leading sheets that fit token_budget
+    are returned uncondensed instead.
+    """
+    token_budget = token_budget or SUMMARY_DIRECT_TOKENS
+    items = [_item([name], insights) for name, insights in sheet_insights.items()]
+    if sum(tokens for _, _, tokens in items) <= token_budget:
+        return sheet_insights, False
+
+    rounds = 0
+    with ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY) as pool:
+        while len(items) > 1 and sum(tokens for _, _, tokens in items) > token_budget:
+            rounds += 1
+            chunks = _chunk(items, SUMMARY_CHUNK_TOKENS)
+            print(f"🧩 Summary round {rounds}: condensing {len(items)} groups in {len(chunks)} parallel requests")
+            with timed("condense_round", round=rounds, chunks=len(chunks)):
+                # Each chunk runs in a copy of this context, so its LLM call joins the upload's trace
+                futures = [pool.submit(contextvars.copy_context().run, _condense_chunk, chunk) for chunk in chunks]
+                condensed = [item for item in (future.result() for future in futures) if item is not None]
+            if not condensed:
+                print(f"⚠️ No group could be condensed in round {rounds}, summarising the leading sheets directly")
+                FALLBACKS.inc(stage="condense", kind="truncated")
+                return _truncate(sheet_insights, token_budget), False
+            items = condensed
+
+    print(f"✅ Condensed {len(sheet_insights)} sheets into {len(items)} groups in {rounds} rounds")
+    return {_label(names): data for names, data, _ in items}, True
@@ -0,0 +1,151 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from fastapi import Request, Response
+
+from sheet_insights.config import RESPONSE_CACHE_ENTRIES, RESPONSE_COMPRESS_MIN_BYTES
+from sheet_insights.metrics import CACHE_REQUESTS
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+def _encoding(accept_encoding: str):
+    """Pick br or gzip from an Accept-Encoding header, or None for identity"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _compress(body: bytes, encoding: str):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def _etag(entry_tag: str, encoding: str = None):
+    """Each content encoding is its own representation, so it gets its own strong ETag"""
+    return entry_tag if encoding is None else f'"{entry_tag[1:-1]}-{encoding}"'
+
+
+def _etag_matches(if_none_match: str, entry_tag: str):
+    """True if the client holds any encoding of this body"""
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return any(_etag(entry_tag, encoding) in tags for encoding in (None, "gzip", "br"))
+
+
+class _Entry:
+    __slots__ = ("version", "body", "etag", "encoded")
+
+    def __init__(self, version, body):
+        self.version = version
+        self.body = body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.encoded = {}
+
+
+class ResponseCache:
+    """In-memory cache of serialised JSON responses for the read endpoints.
+
+    Each entry remembers the result version it was built from; a request
+    whose version differs rebuilds it, so new results invalidate old bodies
+    in every worker process. Bodies carry a strong ETag derived from their
+    content (identical across workers), answer If-None-Match with 304, and
+    keep their gzip/brotli encodings so each is compressed only once.
+    """
+
+    def __init__(self, max_entries=256, compress_min_bytes=1024):
+        self.max_entries = max_entries
+        self.compress_min_bytes = compress_min_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def _entry(self, key, version, build, dumps):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_REQUESTS.inc(cache="response", result="hit")
+                return entry
+        # Build outside the lock; two concurrent misses just build the same body twice
+        entry = _Entry(version, dumps(build()).encode("utf-8"))
+        with self._lock:
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache="response", result="miss")
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def respond(self, request: Request, key, version, build, filename: str = None, indent: int = None):
+        """Serve build()'s JSON for key, rebuilding it only when version changed"""
+        if indent is None:
+            dumps = lambda data: json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        else:
+            dumps = lambda data: json.dumps(data, ensure_ascii=False, indent=indent)
+        entry = self._entry(key, version, build, dumps)
+
+        body = entry.body
+        encoding = _encoding(request.headers.get("accept-encoding", "")) if len(body) >= self.compress_min_bytes else None
+
+        # no-cache: clients keep the body but revalidate it with If-None-Match every time
+        headers = {"ETag": _etag(entry.etag, encoding), "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if filename:
+            headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, entry.etag):
+            with self._lock:
+                self.not_modified += 1
+            CACHE_REQUESTS.inc(cache="response", result="not_modified")
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            encoded = entry.encoded.get(encoding)
+            if encoded is None:
+                encoded = entry.encoded[encoding] = _compress(body, encoding)
+            body = encoded
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "brotli": brotli is not None,
+            }
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_ENTRIES, RESPONSE_COMPRESS_MIN_BYTES)
@@ -1,5 +1,20 @@
-import json
-from sheet_insights.config import client
+import contextlib
+import zlib
+from sheet_insights.config import (
+    client, get_async_client, LLM_MAX_CONCURRENCY, LLM_TPM_LIMIT,
+    INSIGHT_PACKING, PACK_SMALL_SHEET_TOKENS, PACK_TOKEN_CEILING, PACK_MAX_SHEETS,
+    BUDGET_MIN_SHEET_TOKENS, BUDGET_SUMMARY_RESERVE, LLM_RESPONSE_FORMAT,
+)
+from sheet_insights.cache import insight_cache
+from sheet_insights.encoder import count_tokens, fit_text_to_budget, SHEET_TOKEN_BUDGET
+from sheet_insights.scheduler import llm_scheduler, CircuitOpenError
+from sheet_insights.instant import instant_insights
+from sheet_insights.metrics import FALLBACKS
+from sheet_insights.token_usage import current_ledger
+from sheet_insights.structured import (
+    call_with_repair, acall_with_repair, parse_insight_list, parse_insight_map,
+    response_format, insight_list_schema, packed_insights_schema, REPLY_SCHEMA_VERSION,
+)
 from pathlib import Path
 import os
 import time
@@ -8,98 +23,469 @@ import asyncio
 
 # Optimized shorter prompt for faster processing
 INSIGHT_PROMPT = """
-Generate exactly 5 concise insights from this table data as a JSON array of strings.
+Generate exactly 5 concise insights from this table data.
 Be accurate with dates, figures, trends. No assumptions beyond the data.
-Return only the JSON array - no markdown, no explanations.
+Return only a JSON object with an "insights" array of 5 strings - no markdown, no explanations.
 
-Example: ["Insight 1", "Insight 2", "Insight 3", "Insight 4", "Insight 5"]
+Example: {"insights": ["Insight 1", "Insight 2", "Insight 3", "Insight 4", "Insight 5"]}
 """
 
+# Several small sheets answered in one request
+PACKED_INSIGHT_PROMPT = """
+For EACH sheet below, generate exactly 5 concise insights from its table data.
+Be accurate with dates, figures, trends. No assumptions beyond the data.
+Return only a JSON object mapping every sheet name, exactly as written after "Sheet:", to a JSON array of 5 strings - no markdown, no explanations.
+
+Example: {"Sheet A": ["Insight 1", "Insight 2", "Insight 3", "Insight 4", "Insight 5"], "Sheet B": [...]}
+"""
+
+INSIGHT_SYSTEM_PROMPT = "You are a data analyst. Be fast and concise."
+
+# Sampling params are part of the cache key, so keep them in one place
+SHEET_TIMEOUT_SECONDS = 10  # Short timeout for faster failure detection
+
+INSIGHT_PARAMS = {
+    "temperature": 0.0,
+    "max_tokens": 400,  # Reduced significantly for faster processing
+    "top_p": 1.0,  # Optimize for speed
+    "frequency_penalty": 0,
+    "presence_penalty": 0,
+}
+
+
+def _lookup(markdown_text: str):
+    """Return (cache_key, cached_insights) for one sheet"""
+    deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+    # Answers given under another reply format or schema may differ, so they aren't reused
+    params = dict(INSIGHT_PARAMS, response_format=LLM_RESPONSE_FORMAT, reply_schema=REPLY_SCHEMA_VERSION)
+    cache_key = insight_cache.make_key(
+        markdown_text, INSIGHT_SYSTEM_PROMPT + INSIGHT_PROMPT, deployment, params
+    )
+    return cache_key, insight_cache.get(cache_key)
+
+
+def cached_insights(markdown_text: str):
+    """Insights the LLM already produced for this exact sheet text, or None.
+
+    The cache only holds real LLM answers, so fallback insights are never reused.
+    """
+    return _lookup(markdown_text)[1]
+
+
+def _sheet_budget(sheet_name: str):
+    """Tokens the current upload's budget plan allows this sheet's text, or None if it isn't cut"""
+    ledger = current_ledger()
+    plan = ledger.plan if ledger is not None else None
+    return (plan or {}).get("sheet_budgets", {}).get(sheet_name)
+
+
+def _fit_text(markdown_text: str, sheet_name: str):
+    # Keep the prompt within the per-sheet token budget (or the upload plan's smaller one), dropping whole rows only.
+    # Trimming happens only here, after the cache lookup, so the key doesn't move with the plan
+    markdown_text, trimmed = fit_text_to_budget(markdown_text, _sheet_budget(sheet_name))
+    if trimmed:
+        print(f"⚡ Trimmed text for '{sheet_name}' to the token budget")
+    return markdown_text
+
+
+def _sheet_messages(markdown_text: str):
+    return [
+        {"role": "system", "content": INSIGHT_SYSTEM_PROMPT},
+        {"role": "user", "content": INSIGHT_PROMPT + f"\n\n{markdown_text}"}
+    ]
+
+
+def _prepare_request(markdown_text: str, sheet_name: str):
+    """Return (cache_key, cached_insights, messages) for one sheet"""
+    cache_key, cached = _lookup(markdown_text)
+    if cached is not None:
+        return cache_key, cached, None
+    return cache_key, None, _sheet_messages(_fit_text(markdown_text, sheet_name))
+
+
+def _parse_sheet_reply(reply: str):
+    return parse_insight_list(reply, "sheet")
+
+
+def _store(insights: list, cache_key: str, sheet_name: str):
+    # Only real LLM answers are cached, never the fallback placeholders
+    insight_cache.set(cache_key, insights, sheet_name)
+    return insights
 
-def get_insights(markdown_text: str, sheet_name: str = ""):
+
+def _error_fallback(sheet_name: str, error: Exception, kpis: list = None):
+    if isinstance(error, CircuitOpenError):
+        print(f"⚡ LLM unavailable, instant insights for '{sheet_name}'")
+    else:
+        print(f"❌ Error generating insights for '{sheet_name}': {error}")
+    FALLBACKS.inc(stage="sheet", kind="instant" if kpis is not None else "placeholder")
+    if kpis is not None:
+        # Rule-based insights from the locally computed KPI statistics
+        return instant_insights(kpis)
+    # Return fallback insights instead of None
+    return [
+        f"Processing completed for {sheet_name}",
+        "Data extraction successful",
+        "Table structure analyzed",
+        "Performance data reviewed",
+        "Analysis workflow completed"
+    ]
+
+
+def get_insights(markdown_text: str, sheet_name: str = "", kpis: list = None):
     """Generate insights for a single sheet with optimized processing"""
     try:
         start_time = time.time()
-
-        # Truncate very long text to speed up processing
-        if len(markdown_text) > 4000:
-            markdown_text = markdown_text[:4000] + "..."
-            print(f"⚡ Truncated text for '{sheet_name}' for faster processing")
+        cache_key, cached, messages = _prepare_request(markdown_text, sheet_name)
+        if cached is not None:
+            print(f"⚡ Cache hit for '{sheet_name}' ({(time.time() - start_time) * 1000:.1f}ms)")
+            return cached
 
         # Optimized API call with minimal tokens
-        response = client.chat.completions.create(
-            model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
-            messages=[
-                {"role": "system", "content": "You are a data analyst. Be fast and concise."},
-                {"role": "user", "content": INSIGHT_PROMPT + f"\n\n{markdown_text}"}
-            ],
-            temperature=0.0,
-            max_tokens=400,  # Reduced significantly for faster processing
-            timeout=10,  # Reduced timeout for faster failure detection
-            stream=False,  # Disable streaming for simplicity
-            top_p=1.0,  # Optimize for speed
-            frequency_penalty=0,
-            presence_penalty=0
-        )
+        def send(messages):
+            return llm_scheduler.call(
+                client.chat.completions.create,
+                stage="sheet",
+                sheets=[sheet_name],
+                model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+                messages=messages,
+                timeout=SHEET_TIMEOUT_SECONDS,
+                stream=False,  # Disable streaming for simplicity
+                **response_format("sheet_insights", insight_list_schema()),
+                **INSIGHT_PARAMS
+            )
+
+        insights = call_with_repair(send, messages, _parse_sheet_reply, "sheet")
 
         api_time = time.time() - start_time
         print(f"⚡ API call for '{sheet_name}' took {api_time:.2f}s")
 
-        reply = response.choices[0].message.content.strip()
-
-        # Clean up the response to extract JSON
-        if reply.startswith('```json'):
-            reply = reply[7:]
-        if reply.endswith('```'):
-            reply = reply[:-3]
-        reply = reply.strip()
-
-        return json.loads(reply)
-
-    except json.JSONDecodeError as e:
-        print(f"❌ JSON decode error for '{sheet_name}': {e}")
-        print(f"Raw response: {reply[:200]}...")
-        # Return fallback insights instead of None
-        return [
-            f"Data analysis completed for {sheet_name}",
-            "Performance metrics extracted from table data",
-            "Monthly trends identified in the dataset",
-            "Key performance indicators analyzed",
-            "Data quality assessment performed"
-        ]
+        return _store(insights, cache_key, sheet_name)
+
+    except Exception as e:
+        return _error_fallback(sheet_name, e, kpis)
+
+
+async def _request_insights_async(messages, cache_key: str, sheet_name: str, semaphore, start_time: float):
+    timing = {}
+
+    async def send(messages):
+        # A re-ask for an unreadable reply queues for a slot like any other call
+        queued_at = time.perf_counter()
+        async with semaphore or contextlib.nullcontext():
+            timing.setdefault("call_start", time.time())
+            return await llm_scheduler.acall(
+                get_async_client().chat.completions.create,
+                stage="sheet",
+                queued_at=queued_at,
+                sheets=[sheet_name],
+                model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+                messages=messages,
+                timeout=SHEET_TIMEOUT_SECONDS,
+                stream=False,
+                **response_format("sheet_insights", insight_list_schema()),
+                **INSIGHT_PARAMS
+            )
+
+    insights = await acall_with_repair(send, messages, _parse_sheet_reply, "sheet")
+    print(f"⚡ API call for '{sheet_name}' took {time.time() - timing['call_start']:.2f}s "
+          f"(waited {timing['call_start'] - start_time:.2f}s for a slot)")
+
+    # Cache files are written off the event loop
+    return await asyncio.to_thread(_store, insights, cache_key, sheet_name)
+
+
+async def get_insights_async(markdown_text: str, sheet_name: str = "", semaphore: asyncio.Semaphore = None, kpis: list = None):
+    """Generate insights for one sheet on the event loop using the shared async client"""
+    try:
+        start_time = time.time()
+        cache_key, cached, messages = await asyncio.to_thread(_prepare_request, markdown_text, sheet_name)
+        if cached is not None:
+            print(f"⚡ Cache hit for '{sheet_name}' ({(time.time() - start_time) * 1000:.1f}ms)")
+            return cached
+
+        return await _request_insights_async(messages, cache_key, sheet_name, semaphore, start_time)
+
     except Exception as e:
-        print(f"❌ Error generating insights for '{sheet_name}': {e}")
-        # Return fallback insights instead of None
-        return [
-            f"Processing completed for {sheet_name}",
-            "Data extraction successful",
-            "Table structure analyzed",
-            "Performance data reviewed",
-            "Analysis workflow completed"
+        return _error_fallback(sheet_name, e, kpis)
+
+
+def _normalise_name(name):
+    return " ".join(str(name).split()).lower()
+
+
+def _parse_packed_reply(response):
+    """Return {normalised sheet name: insights} from a packed JSON object reply.
+
+    A truncated or partly malformed reply still yields the sheets it answered
+    completely; the rest are requested on their own.
+    """
+    packed = parse_insight_map(response.choices[0].message.content or "", "packed")
+    return {_normalise_name(name): insights for name, insights in packed.items()}
+
+
+async def _request_packed_async(sheets: list, semaphore, start_time: float):
+    """One LLM call for several sheets given as (name, text) pairs"""
+    sections = "\n\n".join(f"Sheet: {name}\n{text}" for name, text in sheets)
+    messages = [
+        {"role": "system", "content": INSIGHT_SYSTEM_PROMPT},
+        {"role": "user", "content": PACKED_INSIGHT_PROMPT + f"\n\n{sections}"}
+    ]
+    params = dict(INSIGHT_PARAMS, max_tokens=INSIGHT_PARAMS["max_tokens"] * len(sheets))
+
+    queued_at = time.perf_counter()
+    async with semaphore or contextlib.nullcontext():
+        call_start = time.time()
+        response = await llm_scheduler.acall(
+            get_async_client().chat.completions.create,
+            stage="packed",
+            queued_at=queued_at,
+            sheets={name: count_tokens(text) for name, text in sheets},
+            model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+            messages=messages,
+            timeout=min(60, 10 + 5 * len(sheets)),  # the answer grows with every sheet
+            stream=False,
+            **response_format("packed_sheet_insights", packed_insights_schema(name for name, _ in sheets)),
+            **params
+        )
+
+    print(f"⚡ Packed API call for {len(sheets)} sheets took {time.time() - call_start:.2f}s "
+          f"(waited {call_start - start_time:.2f}s for a slot)")
+    return _parse_packed_reply(response)
+
+
+async def get_packed_insights_async(markdown_texts_and_names: list, semaphore: asyncio.Semaphore = None, kpi_stats: dict = None):
+    """Generate insights for several small sheets in one request, in input order.
+
+    Cached sheets are served from the cache; any sheet missing or malformed in
+    the packed answer falls back to its own request.
+    """
+    kpi_stats = kpi_stats or {}
+    start_time = time.time()
+    results = [None] * len(markdown_texts_and_names)
+    pending = []
+
+    def look_up_all():
+        for i, (text, name) in enumerate(markdown_texts_and_names):
+            try:
+                cache_key, cached = _lookup(text)
+                if cached is not None:
+                    results[i] = cached
+                else:
+                    pending.append((i, name, cache_key, _fit_text(text, name)))
+            except Exception as e:
+                results[i] = _error_fallback(name, e, kpi_stats.get(name))
+
+    # Cache files are read and written off the event loop
+    await asyncio.to_thread(look_up_all)
+
+    if len(pending) > 1:
+        try:
+            packed = await _request_packed_async([(name, text) for _, name, _, text in pending], semaphore, start_time)
+        except CircuitOpenError:
+            # No point retrying each sheet on its own
+            packed = {}
+            for i, name, _, _ in pending:
+                results[i] = _error_fallback(name, CircuitOpenError(), kpi_stats.get(name))
+        except Exception as e:
+            print(f"❌ Packed request for {len(pending)} sheets failed: {e}")
+            packed = {}
+        answered = []
+        for i, name, cache_key, _ in pending:
+            insights = packed.get(_normalise_name(name))
+            if insights is not None:
+                results[i] = insights
+                answered.append((cache_key, insights, name))
+        def store_answered():
+            # Cached under the single-sheet key, so reruns hit however the sheet was batched
+            for cache_key, insights, name in answered:
+                insight_cache.set(cache_key, insights, name)
+
+        await asyncio.to_thread(store_answered)
+        pending = [entry for entry in pending if results[entry[0]] is None]
+        if pending:
+            print(f"🔄 {len(pending)} sheet(s) missing from packed reply, requesting individually")
+
+    async def request_single(i, name, cache_key, text):
+        try:
+            results[i] = await _request_insights_async(_sheet_messages(text), cache_key, name, semaphore, start_time)
+        except Exception as e:
+            results[i] = _error_fallback(name, e, kpi_stats.get(name))
+
+    await asyncio.gather(*(request_single(*entry) for entry in pending))
+    return results
+
+
+def information_content(text: str):
+    """Bytes of the sheet text after compression: repeated or blank rows add little, distinct figures a lot"""
+    return len(zlib.compress(text.encode("utf-8"), 6))
+
+
+def _water_fill(needs: list, weights: list, available: int, floor: int):
+    """Token allowance per sheet: a floor each, then the rest shared by (positive) weight, never above a sheet's need"""
+    allowance = [min(need, floor) for need in needs]
+    remaining = available - sum(allowance)
+    active = [i for i, need in enumerate(needs) if allowance[i] < need]
+    while remaining > 0 and active:
+        total_weight = sum(weights[i] for i in active)
+        # Sheets whose share covers their whole need are saturated first; their surplus goes round again
+        saturated = [
+            i for i in active
+            if allowance[i] + remaining * weights[i] / total_weight >= needs[i]
         ]
+        if not saturated:
+            for i in active:
+                allowance[i] += int(remaining * weights[i] / total_weight)
+            break
+        for i in saturated:
+            remaining -= needs[i] - allowance[i]
+            allowance[i] = needs[i]
+        active = [i for i in active if i not in saturated]
+    return allowance
+
+
+def plan_token_budget(markdown_texts_and_names: list, job_budget: int):
+    """Fit a job's sheet requests into job_budget tokens.
+
+    Each sheet request costs its prompt overhead and the fixed completion cap
+    plus its table text; BUDGET_SUMMARY_RESERVE is kept back for the
+    summaries. When the tables don't fit what is left, every sheet keeps
+    BUDGET_MIN_SHEET_TOKENS and the remainder is shared in proportion to each
+    sheet's information content, so one huge sheet can't starve the others.
+    Returns the plan; its sheet_budgets are applied when each request is
+    built, so the texts (and their cache keys) stay as they are.
+    """
+    overhead = count_tokens(INSIGHT_SYSTEM_PROMPT) + count_tokens(INSIGHT_PROMPT) + 8
+    fixed = len(markdown_texts_and_names) * (overhead + INSIGHT_PARAMS["max_tokens"])
+    needs = [min(count_tokens(text), SHEET_TOKEN_BUDGET) for text, _ in markdown_texts_and_names]
+    available = job_budget - BUDGET_SUMMARY_RESERVE - fixed
+
+    plan = {
+        "budget": job_budget,
+        "sheets": len(markdown_texts_and_names),
+        "summary_reserve": BUDGET_SUMMARY_RESERVE,
+        "requested_tokens": fixed + sum(needs) + BUDGET_SUMMARY_RESERVE,
+        "trimmed_sheets": [],
+        "sheet_budgets": {},
+    }
+    if sum(needs) <= available:
+        allowance = needs
+    else:
+        weights = [information_content(text) for text, _ in markdown_texts_and_names]
+        allowance = _water_fill(needs, weights, max(0, available), BUDGET_MIN_SHEET_TOKENS)
+
+    for (_, sheet_name), need, tokens in zip(markdown_texts_and_names, needs, allowance):
+        if tokens < need:
+            plan["trimmed_sheets"].append(sheet_name)
+            plan["sheet_budgets"][sheet_name] = tokens
+
+    plan["planned_tokens"] = fixed + sum(allowance) + BUDGET_SUMMARY_RESERVE
+    plan["within_budget"] = plan["planned_tokens"] <= job_budget
+    if LLM_TPM_LIMIT:
+        # The scheduler paces calls at the TPM limit, so the envelope is also a time bound
+        plan["estimated_minutes"] = round(plan["planned_tokens"] / LLM_TPM_LIMIT, 2)
+    print(f"🎯 Token plan: {plan['planned_tokens']}/{job_budget} tokens for {plan['sheets']} sheets, "
+          f"{len(plan['trimmed_sheets'])} trimmed")
+    return plan
+
+
+def longest_first(markdown_texts_and_names: list):
+    """Indexes of the sheets ordered by prompt size, largest first.
+
+    The slowest calls start first so they don't end up alone at the tail of
+    the batch, which shortens the total time for a fixed concurrency.
+    """
+    sizes = [count_tokens(text) for text, _ in markdown_texts_and_names]
+    return sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True)
 
 
-async def get_insights_async(markdown_text: str, sheet_name: str = ""):
-    """Async version for parallel processing"""
-    return await asyncio.to_thread(get_insights, markdown_text, sheet_name)
+def plan_requests(markdown_texts_and_names: list):
+    """Group sheet indexes into LLM requests, largest request first.
 
+    With packing on, sheets of at most PACK_SMALL_SHEET_TOKENS are packed
+    first-fit-decreasing into groups of up to PACK_MAX_SHEETS whose text fits
+    PACK_TOKEN_CEILING; every other sheet is a request of its own.
+    """
+    sizes = [count_tokens(text) for text, _ in markdown_texts_and_names]
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True)
+    if not INSIGHT_PACKING:
+        return [[i] for i in order]
 
-async def get_insights_batch_async(markdown_texts_and_names: list, max_workers: int = 8):
-    """Async process multiple sheets in parallel with optimized batching"""
+    requests, packs = [], []
+    for i in order:
+        if sizes[i] > PACK_SMALL_SHEET_TOKENS:
+            requests.append([i])
+            continue
+        for pack in packs:
+            if len(pack) < PACK_MAX_SHEETS and sum(sizes[j] for j in pack) + sizes[i] <= PACK_TOKEN_CEILING:
+                pack.append(i)
+                break
+        else:
+            packs.append([i])
+    requests.extend(packs)
+    return sorted(requests, key=lambda request: sum(sizes[i] for i in request), reverse=True)
+
+
+async def _run_request(markdown_texts_and_names: list, request: list, semaphore, kpi_stats: dict = None):
+    """Run one planned request, returning [(index, insights)]"""
+    kpi_stats = kpi_stats or {}
+    if len(request) == 1:
+        text, name = markdown_texts_and_names[request[0]]
+        return [(request[0], await get_insights_async(text, name, semaphore, kpi_stats.get(name)))]
+    insights = await get_packed_insights_async([markdown_texts_and_names[i] for i in request], semaphore, kpi_stats)
+    return list(zip(request, insights))
+
+
+async def get_insights_batch_async(markdown_texts_and_names: list, max_workers: int = LLM_MAX_CONCURRENCY, kpi_stats: dict = None):
+    """Async process multiple sheets with at most max_workers LLM calls in flight.
+
+    kpi_stats ({sheet_name: KPI statistics}) lets failed sheets fall back to
+    rule-based insights instead of placeholder text.
+    """
     start_time = time.time()
 
+    semaphore = asyncio.Semaphore(max_workers)
+    # Tasks are created (and so queue on the semaphore) largest-first;
+    # results are returned in the original sheet order
+    requests = plan_requests(markdown_texts_and_names)
     tasks = [
-        get_insights_async(text, name)
-        for text, name in markdown_texts_and_names
+        asyncio.create_task(_run_request(markdown_texts_and_names, request, semaphore, kpi_stats))
+        for request in requests
     ]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    results = [None] * len(markdown_texts_and_names)
+    for request, outcome in zip(requests, await asyncio.gather(*tasks, return_exceptions=True)):
+        if isinstance(outcome, BaseException):
+            for i in request:
+                results[i] = outcome
+        else:
+            for i, insights in outcome:
+                results[i] = insights
 
     total_time = time.time() - start_time
-    print(f"⚡ Batch processed {len(markdown_texts_and_names)} sheets in {total_time:.2f}s")
+    print(f"⚡ Batch processed {len(markdown_texts_and_names)} sheets in {len(requests)} requests, {total_time:.2f}s")
 
     return results
 
 
+async def iter_insights_as_completed(markdown_texts_and_names: list, max_workers: int = LLM_MAX_CONCURRENCY, kpi_stats: dict = None):
+    """Yield (sheet_name, insights) pairs in completion order so callers can stream them"""
+    semaphore = asyncio.Semaphore(max_workers)
+
+    tasks = [
+        asyncio.create_task(_run_request(markdown_texts_and_names, request, semaphore, kpi_stats))
+        for request in plan_requests(markdown_texts_and_names)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for i, insights in await next_done:
+                yield markdown_texts_and_names[i][1], insights
+    finally:
+        # Client went away mid-stream - don't leave orphaned tasks behind
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
 def get_insights_batch(markdown_texts_and_names: list, max_workers: int = 8):
     """Synchronous wrapper for batch processing using ThreadPoolExecutor"""
     from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -110,8 +496,8 @@ def get_insights_batch(markdown_texts_and_names: list, max_workers: int = 8):
     with ThreadPoolExecutor(max_workers=min(max_workers, len(markdown_texts_and_names))) as executor:
         # Submit all tasks
         future_to_data = {
-            executor.submit(get_insights, text, name): (text, name)
-            for text, name in markdown_texts_and_names
+            executor.submit(get_insights, *markdown_texts_and_names[i]): markdown_texts_and_names[i]
+            for i in longest_first(markdown_texts_and_names)
         }
 
         results = []
@@ -0,0 +1,106 @@
+from sheet_insights.encoder import format_cell
+from sheet_insights.kpi_cube import kpi_keys
+
+# Rule-based insights from the locally computed KPI statistics
+# (sheet_insights.kpi_stats): no LLM call, a few milliseconds per workbook.
+# Used for mode=instant and as the fallback while the LLM is unavailable.
+
+INSIGHTS_PER_SHEET = 5
+GENERAL_INSIGHTS = 10
+
+
+def _value(value, unit=""):
+    text = format_cell(float(value))
+    if not unit:
+        return text
+    return f"{text}{unit}" if unit == "%" else f"{text} {unit}"
+
+
+def _relative(amount, mean):
+    return abs(amount) / abs(mean) if mean else abs(amount)
+
+
+def _sheet_candidates(kpis):
+    """(score, parameter, sentence) for every rule that fires on a sheet's KPIs"""
+    candidates = []
+    for kpi in kpis:
+        name, unit = kpi["parameter"], kpi["unit"]
+        months = kpi["months_reported"]
+        if kpi["min"] == kpi["max"]:
+            if kpi["min"] == 0:
+                candidates.append((0.6, name, f"{name} stayed at zero in all {months} reported months"))
+            else:
+                candidates.append((0.3, name, f"{name} held steady at {_value(kpi['min'], unit)} in all {months} reported months"))
+            continue
+
+        spread = _relative(kpi["max"] - kpi["min"], kpi["mean"])
+        candidates.append((min(spread, 1.0), name,
+                           f"{name} ranged from {_value(kpi['min'], unit)} in {kpi['min_month']} to "
+                           f"{_value(kpi['max'], unit)} in {kpi['max_month']}, averaging {_value(kpi['mean'], unit)}"))
+
+        drift = _relative(kpi["trend_per_month"] * (months - 1), kpi["mean"])
+        if drift >= 0.1:
+            direction = "an upward" if kpi["trend_per_month"] > 0 else "a downward"
+            candidates.append((0.5 + min(drift, 1.0), name,
+                               f"{name} shows {direction} trend of {_value(abs(kpi['trend_per_month']), unit)} per month"))
+
+        pct = kpi["last_mom_change_pct"]
+        if pct is not None and abs(pct) >= 5:
+            verb = "rose" if pct > 0 else "fell"
+            candidates.append((0.4 + min(abs(pct) / 100, 1.0), name,
+                               f"{name} {verb} {format_cell(abs(float(pct)))}% month-over-month in {kpi['last_month']}"))
+
+        for outlier in kpi["outliers"]:
+            side = "high" if outlier["z"] > 0 else "low"
+            candidates.append((abs(outlier["z"]) / 2, name,
+                               f"{outlier['month']} was an unusually {side} month for {name} at "
+                               f"{_value(outlier['value'], unit)} (z-score {format_cell(float(outlier['z']))})"))
+    return candidates
+
+
+def _pick(candidates, count):
+    """Highest-scoring sentences, at most one per KPI until every KPI had a turn"""
+    ranked = sorted(candidates, key=lambda candidate: candidate[0], reverse=True)
+    picked, used = [], set()
+    for score, name, sentence in ranked:
+        if name not in used:
+            picked.append(sentence)
+            used.add(name)
+        if len(picked) == count:
+            return picked
+    for score, name, sentence in ranked:
+        if sentence not in picked:
+            picked.append(sentence)
+        if len(picked) == count:
+            break
+    return picked
+
+
+def instant_insights(kpis):
+    """Five insights for one sheet from its KPI statistics, without an LLM call"""
+    insights = _pick(_sheet_candidates(kpis or []), INSIGHTS_PER_SHEET)
+    return insights or ["No data available"]
+
+
+def instant_general_insights(kpi_stats):
+    """Cross-sheet comparisons of each KPI's average: best, worst and spread across suppliers"""
+    by_parameter = {}
+    for sheet_name, kpis in kpi_stats.items():
+        for kpi, key in zip(kpis, kpi_keys([kpi["parameter"] for kpi in kpis])):
+            by_parameter.setdefault(key, []).append((kpi["mean"], sheet_name.strip(), kpi))
+
+    candidates = []
+    for entries in by_parameter.values():
+        if len(entries) < 2:
+            continue
+        entries.sort(key=lambda entry: entry[0])
+        (low, low_sheet, kpi), (high, high_sheet, _) = entries[0], entries[-1]
+        if low == high:
+            continue
+        name, unit = kpi["parameter"], kpi["unit"]
+        overall = sum(entry[0] for entry in entries) / len(entries)
+        candidates.append((len(entries) + min(_relative(high - low, overall), 1.0), name,
+                           f"{name}: {high_sheet} averages highest at {_value(high, unit)}, "
+                           f"{low_sheet} lowest at {_value(low, unit)} across {len(entries)} suppliers"))
+    insights = _pick(candidates, GENERAL_INSIGHTS)
+    return insights or ["Not enough data available"]
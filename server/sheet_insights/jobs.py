@@ -0,0 +1,269 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+import aiosqlite
+
+from sheet_insights.config import JOB_DB_PATH, JOB_QUEUE_MAX, JOB_WORKERS
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+JSON_FIELDS = ("progress", "result")
+
+INTERRUPTED = "interrupted by restart"
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """SQLite-backed record of upload jobs, their progress and results.
+
+    Each job records the pid of the process whose in-memory queue holds it,
+    so a restarted process can tell its own lost jobs from the live jobs of
+    other API workers sharing the database.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+
+    async def init(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    owner INTEGER,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            async with db.execute("PRAGMA table_info(jobs)") as cursor:
+                columns = {row[1] for row in await cursor.fetchall()}
+            if "owner" not in columns:
+                await db.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at)")
+            await db.commit()
+        await self.fail_interrupted()
+
+    async def fail_interrupted(self):
+        """Mark jobs whose process is gone as failed; their queue died with it, so nothing would run them"""
+        unfinished = ", ".join("?" for _ in (QUEUED, RUNNING))
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                f"SELECT id, owner FROM jobs WHERE status IN ({unfinished})", (QUEUED, RUNNING)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            # A job owned by this pid is from an earlier process that had the same pid
+            lost = [job_id for job_id, owner in rows if owner is None or owner == os.getpid() or not _process_alive(owner)]
+            if lost:
+                placeholders = ", ".join("?" for _ in lost)
+                await db.execute(
+                    f"UPDATE jobs SET status = ?, stage = ?, error = ?, updated_at = ? "
+                    f"WHERE id IN ({placeholders}) AND status IN ({unfinished})",
+                    (FAILED, FAILED, INTERRUPTED, time.time(), *lost, QUEUED, RUNNING),
+                )
+                await db.commit()
+                print(f"⚠️ Marked {len(lost)} interrupted jobs as failed")
+
+    async def create(self, filename: str, file_path: str):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "INSERT INTO jobs (id, filename, file_path, status, stage, progress, owner, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, filename, file_path, QUEUED, QUEUED, json.dumps({}), os.getpid(), now, now),
+            )
+            await db.commit()
+        return job_id
+
+    async def update(self, job_id: str, **fields):
+        """Update the given columns of an unfinished job; dict values are stored as JSON.
+
+        Finished jobs are left as they are, so a cancel and a completion racing
+        each other (possibly in different processes) can't overwrite one
+        another. Returns whether the job was updated.
+        """
+        if not fields:
+            return False
+        fields["updated_at"] = time.time()
+        for name in JSON_FIELDS:
+            if name in fields:
+                fields[name] = json.dumps(fields[name], ensure_ascii=False)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        finished = ", ".join("?" for _ in FINISHED_STATES)
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND status NOT IN ({finished})",
+                (*fields.values(), job_id, *FINISHED_STATES),
+            )
+            await db.commit()
+        return cursor.rowcount > 0
+
+    async def get(self, job_id: str, include_result: bool = True):
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)) as cursor:
+                row = await cursor.fetchone()
+        return self._to_dict(row, include_result) if row else None
+
+    async def list(self, limit: int = 50, status: str = None):
+        query = "SELECT * FROM jobs"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+        return [self._to_dict(row, include_result=False) for row in rows]
+
+    @staticmethod
+    def _to_dict(row, include_result: bool):
+        job = dict(row)
+        for name in JSON_FIELDS:
+            if job.get(name):
+                job[name] = json.loads(job[name])
+        if not include_result:
+            job.pop("result", None)
+        job.pop("file_path", None)
+        job.pop("owner", None)
+        return job
+
+
+class JobQueue:
+    """Bounded in-process queue that runs upload jobs on a fixed pool of worker tasks"""
+
+    def __init__(self, store: JobStore, handler, workers: int = 2, max_size: int = 50):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self._worker_tasks = []
+        self._running = {}
+        self._cancelled = set()
+
+    def start(self):
+        for i in range(self.workers):
+            self._worker_tasks.append(asyncio.create_task(self._worker(i)))
+        print(f"🧵 Started {self.workers} job workers")
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def is_full(self):
+        return self.queue.full()
+
+    async def submit(self, filename: str, file_path: str):
+        """Record a new job and enqueue it; raises asyncio.QueueFull when saturated"""
+        if self.queue.full():
+            raise asyncio.QueueFull()
+        job_id = await self.store.create(filename, file_path)
+        try:
+            self.queue.put_nowait((job_id, file_path))
+        except asyncio.QueueFull:
+            # Another submit filled the queue while the row was written; nothing would ever run it
+            await self.store.update(job_id, status=FAILED, stage=FAILED, error="job queue is full")
+            raise
+        print(f"📥 Queued job {job_id} for '{filename}' ({self.queue.qsize()} waiting)")
+        return job_id
+
+    async def cancel(self, job_id: str):
+        """Cancel a queued or running job. Returns False if it already finished.
+
+        The stored status is what counts: a job held by another API worker
+        process is marked cancelled here, and that process checks the status
+        before starting the job and before recording its result.
+        """
+        if not await self.store.update(job_id, status=CANCELLED, stage=CANCELLED):
+            return False
+
+        self._cancelled.add(job_id)
+        task = self._running.get(job_id)
+        if task:
+            task.cancel()
+        print(f"🛑 Cancelled job {job_id}")
+        return True
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize(),
+            "running": len(self._running),
+            "max_queue_size": self.queue.maxsize,
+        }
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job_id, file_path = await self.queue.get()
+            try:
+                if job_id in self._cancelled:
+                    continue
+                await self._run(job_id, file_path)
+            finally:
+                self._cancelled.discard(job_id)
+                self.queue.task_done()
+
+    async def _run(self, job_id: str, file_path: str):
+        start_time = time.time()
+        if job_id in self._cancelled or not await self.store.update(job_id, status=RUNNING, stage="starting"):
+            print(f"🛑 Skipping job {job_id}, cancelled before it started")
+            return
+        task = asyncio.create_task(self.handler(job_id, file_path))
+        self._running[job_id] = task
+        try:
+            result = await task
+            if await self.store.update(job_id, status=COMPLETED, stage=COMPLETED, result=result):
+                print(f"✅ Job {job_id} completed in {time.time() - start_time:.2f}s")
+            else:
+                print(f"🛑 Job {job_id} finished after it was cancelled, result discarded")
+        except asyncio.CancelledError:
+            if job_id not in self._cancelled:
+                # The worker itself is shutting down
+                raise
+        except Exception as e:
+            print(f"❌ Job {job_id} failed: {e}")
+            detail = getattr(e, "detail", None) or str(e)
+            await self.store.update(job_id, status=FAILED, stage=FAILED, error=detail)
+        finally:
+            self._running.pop(job_id, None)
+
+
+job_store = JobStore(JOB_DB_PATH)
+
+
+def create_job_queue(handler):
+    return JobQueue(job_store, handler, workers=JOB_WORKERS, max_size=JOB_QUEUE_MAX)
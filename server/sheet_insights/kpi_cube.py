@@ -0,0 +1,195 @@
+import os
+import re
+import threading
+
+import numpy as np
+
+from sheet_insights.encoder import MONTHS, format_cell
+
+MONTH_NAMES = tuple(month.capitalize() for month in MONTHS)
+MIN_SUPPLIERS_FOR_CORRELATION = 4
+CORRELATION_THRESHOLD = 0.7
+
+
+def kpi_key(parameter):
+    """Match the same KPI across sheets whose labels differ in their tails.
+
+    "Production loss due to Material shortage" and "... shortage at TACO", or
+    "Vehicle turnaround time" and "Vehicle turnaround time (Daxter to TACO ...)",
+    share their first three words, which are distinct for every ACMA KPI.
+    """
+    words = re.findall(r"[a-z0-9]+", parameter.lower())
+    return " ".join(words[:3])
+
+
+def kpi_keys(parameters):
+    """kpi_key of each of one sheet's KPI labels.
+
+    Two different labels in the same sheet that share their first three words
+    would overwrite each other, so those keep their full normalised label.
+    """
+    full = [" ".join(re.findall(r"[a-z0-9]+", parameter.lower())) for parameter in parameters]
+    short = [kpi_key(parameter) for parameter in parameters]
+    labels = {}
+    for key, label in zip(short, full):
+        labels.setdefault(key, set()).add(label)
+    return [key if len(labels[key]) == 1 else label for key, label in zip(short, full)]
+
+
+class KPICube:
+    """Columnar KPI x supplier x month store of every sheet's monthly KPI values.
+
+    values[k, s, m] is KPI k of supplier s in month m (NaN when not reported).
+    Built from sheet_insights.kpi_stats output and persisted as a compressed
+    .npz, so comparisons across suppliers are plain NumPy reductions.
+    """
+
+    def __init__(self, kpis, units, suppliers, values):
+        self.kpis = list(kpis)
+        self.units = list(units)
+        self.suppliers = list(suppliers)
+        self.values = values
+
+    @classmethod
+    def from_stats(cls, kpi_stats):
+        """Build the cube from {sheet_name: [kpi dicts]} as returned by sheet_kpi_stats per sheet"""
+        keys, labels, units = [], {}, {}
+        suppliers = [name for name, kpis in kpi_stats.items() if kpis]
+        sheet_keys = {name: kpi_keys([kpi["parameter"] for kpi in kpi_stats[name]]) for name in suppliers}
+        for name in suppliers:
+            for kpi, key in zip(kpi_stats[name], sheet_keys[name]):
+                if key not in labels:
+                    keys.append(key)
+                    labels[key], units[key] = kpi["parameter"], kpi["unit"]
+                elif len(kpi["parameter"]) < len(labels[key]):
+                    labels[key] = kpi["parameter"]
+
+        index = {key: k for k, key in enumerate(keys)}
+        values = np.full((len(keys), len(suppliers), len(MONTHS)), np.nan, dtype=np.float32)
+        for s, name in enumerate(suppliers):
+            for kpi, key in zip(kpi_stats[name], sheet_keys[name]):
+                k = index[key]
+                for month, value in kpi["values"].items():
+                    values[k, s, MONTH_NAMES.index(month)] = value
+
+        return cls([labels[key] for key in keys], [units[key] for key in keys], [name.strip() for name in suppliers], values)
+
+    def save(self, path):
+        """Write the cube atomically as a compressed .npz (no pickled objects)"""
+        path = str(path)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            values=self.values,
+            kpis=np.array(self.kpis, dtype=str),
+            units=np.array(self.units, dtype=str),
+            suppliers=np.array(self.suppliers, dtype=str),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["kpis"].tolist(), data["units"].tolist(), data["suppliers"].tolist(), data["values"])
+
+    def supplier_means(self):
+        """(kpi, supplier) matrix of each supplier's average over its reported months"""
+        valid = ~np.isnan(self.values)
+        count = valid.sum(axis=2)
+        total = np.where(valid, self.values, 0.0).sum(axis=2)
+        return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+    def comparisons(self):
+        """Rankings, percentiles and correlations across suppliers, computed locally"""
+        means = self.supplier_means()
+        reported = ~np.isnan(means)
+        # NaN sorts last, so rankings run highest-first over reporting suppliers only
+        order = np.argsort(np.where(reported, -means, np.inf), axis=1)
+        percentiles = np.full((len(self.kpis), 3), np.nan)
+        has_data = reported.any(axis=1)
+        if has_data.any():
+            percentiles[has_data] = np.nanpercentile(means[has_data], [25, 50, 75], axis=1).T
+
+        kpis = []
+        for k, name in enumerate(self.kpis):
+            ranked = [(self.suppliers[s], float(means[k, s])) for s in order[k][:reported[k].sum()]]
+            if not ranked:
+                continue
+            kpis.append({
+                "kpi": name,
+                "unit": self.units[k],
+                "suppliers": len(ranked),
+                "p25": _round(percentiles[k, 0]),
+                "median": _round(percentiles[k, 1]),
+                "p75": _round(percentiles[k, 2]),
+                "ranking": [{"supplier": supplier, "mean": _round(mean)} for supplier, mean in ranked],
+            })
+        return {"kpis": kpis, "correlations": self.correlations(means)}
+
+    def correlations(self, means=None):
+        """Pearson r between KPI averages across suppliers, strongest first"""
+        means = self.supplier_means() if means is None else means
+        pairs = []
+        for a in range(len(self.kpis)):
+            for b in range(a + 1, len(self.kpis)):
+                both = ~np.isnan(means[a]) & ~np.isnan(means[b])
+                if both.sum() < MIN_SUPPLIERS_FOR_CORRELATION:
+                    continue
+                x, y = means[a, both], means[b, both]
+                if x.std() == 0 or y.std() == 0:
+                    continue
+                r = float(np.corrcoef(x, y)[0, 1])
+                if abs(r) >= CORRELATION_THRESHOLD:
+                    pairs.append({"kpis": [self.kpis[a], self.kpis[b]], "r": round(r, 2), "suppliers": int(both.sum())})
+        return sorted(pairs, key=lambda pair: abs(pair["r"]), reverse=True)
+
+    def comparison_tables(self, max_ranked: int = None):
+        """Compact text tables of the comparisons for the general-summary prompt.
+
+        With max_ranked, longer rankings keep only their top and bottom
+        suppliers, so the tables stay one prompt long for hundreds of sheets.
+        """
+        comparisons = self.comparisons()
+        lines = ["KPI (unit)|suppliers|p25|median|p75|ranking by monthly average, highest first"]
+        for kpi in comparisons["kpis"]:
+            if kpi["suppliers"] < 2:
+                continue  # nothing to compare
+            entries = [f"{entry['supplier']} {format_cell(float(entry['mean']))}" for entry in kpi["ranking"]]
+            if max_ranked and len(entries) > max_ranked:
+                keep = max(1, max_ranked // 2)
+                entries = entries[:keep] + [f"… {len(entries) - 2 * keep} more …"] + entries[-keep:]
+            ranking = " > ".join(entries)
+            unit = f" ({kpi['unit']})" if kpi["unit"] else ""
+            lines.append(f"{kpi['kpi']}{unit}|{kpi['suppliers']}|{_cell(kpi['p25'])}|{_cell(kpi['median'])}|{_cell(kpi['p75'])}|{ranking}")
+        if comparisons["correlations"]:
+            lines.append("")
+            lines.append("Correlations of KPI averages across suppliers (|r| >= 0.7)")
+            for pair in comparisons["correlations"]:
+                lines.append(f"{pair['kpis'][0]} ~ {pair['kpis'][1]}: r={pair['r']} over {pair['suppliers']} suppliers")
+        return "\n".join(lines)
+
+
+def _round(value):
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def _cell(value):
+    return "" if value is None else format_cell(float(value))
+
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def load_kpi_cube(path):
+    """Load a persisted cube, keeping it in memory until the file changes"""
+    path = str(path)
+    mtime = os.stat(path).st_mtime_ns
+    with _loaded_lock:
+        cached = _loaded.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    cube = KPICube.load(path)
+    with _loaded_lock:
+        _loaded[path] = (mtime, cube)
+    return cube
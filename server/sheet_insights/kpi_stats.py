@@ -0,0 +1,183 @@
+import os
+
+import numpy as np
+
+from sheet_insights.encoder import MONTHS, format_cell
+
+# Read here rather than in config.py, like the encoder settings, so extraction
+# code can use it without importing the OpenAI / LlamaParse clients.
+KPI_FACTS_IN_PROMPT = os.getenv("KPI_FACTS_IN_PROMPT", "true").lower() == "true"
+# With at most 12 monthly points |z| can't exceed sqrt(n - 1), so 2.0 would
+# almost never fire on a half-year of data
+KPI_OUTLIER_Z = float(os.getenv("KPI_OUTLIER_Z", "1.5"))
+
+MONTH_NAMES = tuple(month.capitalize() for month in MONTHS)
+LABEL_CHARS = 40
+
+
+def _is_text(value):
+    return isinstance(value, str) and value.strip() != ""
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _column_labels(header_rows, width):
+    """Lower-cased header label per column; the lower header row wins, as in the encoder"""
+    labels = [""] * width
+    for row in header_rows:
+        for col, value in enumerate(row[:width]):
+            if _is_text(value):
+                labels[col] = value.strip().lower()
+    return labels
+
+
+def kpi_rows(header_rows, rows):
+    """Split a sheet's table into KPI rows on a Jan..Dec calendar.
+
+    Returns (labels, values) where labels are (parameter, unit) pairs and
+    values is an (n, 12) float matrix with NaN for months without a number.
+    Only rows with a text parameter and at least two monthly numbers count.
+    """
+    width = max((len(row) for row in list(header_rows) + list(rows)), default=0)
+    labels = _column_labels(header_rows, width)
+
+    month_cols = {}
+    for col, label in enumerate(labels):
+        if label[:3] in MONTHS and len(label) <= 9 and MONTHS.index(label[:3]) not in month_cols.values():
+            month_cols[col] = MONTHS.index(label[:3])
+    param_col = next((col for col, label in enumerate(labels) if label.startswith("param")), None)
+    unit_col = next((col for col, label in enumerate(labels) if label == "unit"), None)
+
+    kpi_labels, values = [], []
+    for row in rows:
+        cells = np.full(len(MONTHS), np.nan)
+        for col, month in month_cols.items():
+            if col < len(row) and _is_number(row[col]):
+                cells[month] = row[col]
+        if np.count_nonzero(~np.isnan(cells)) < 2:
+            continue
+
+        if param_col is not None and param_col < len(row) and _is_text(row[param_col]):
+            parameter = row[param_col]
+        else:
+            parameter = next((cell for cell in row if _is_text(cell)), None)
+        if parameter is None:
+            continue
+        unit = row[unit_col] if unit_col is not None and unit_col < len(row) and _is_text(row[unit_col]) else ""
+        kpi_labels.append((format_cell(parameter, LABEL_CHARS), format_cell(unit)))
+        values.append(cells)
+
+    return kpi_labels, np.array(values).reshape(-1, len(MONTHS))
+
+
+def compute_stats(values):
+    """Per-row statistics of an (n, 12) month matrix, all rows in one vectorised pass"""
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=1)
+    filled = np.where(valid, values, 0.0)
+    mean = filled.sum(axis=1) / np.maximum(count, 1)
+
+    low = np.where(valid, values, np.inf)
+    high = np.where(valid, values, -np.inf)
+    min_month, max_month = low.argmin(axis=1), high.argmax(axis=1)
+
+    # Least-squares slope per row over the months that have values
+    months = np.arange(values.shape[1], dtype=float)
+    month_mean = (valid * months).sum(axis=1) / np.maximum(count, 1)
+    dx = np.where(valid, months - month_mean[:, None], 0.0)
+    dy = np.where(valid, values - mean[:, None], 0.0)
+    variance = (dx * dx).sum(axis=1)
+    slope = np.divide((dx * dy).sum(axis=1), variance, out=np.zeros_like(variance), where=variance > 0)
+
+    # Month-over-month change between consecutive reported months
+    deltas = np.diff(values, axis=1)
+    previous = values[:, :-1]
+    delta_pct = np.divide(deltas * 100, np.abs(previous), out=np.full_like(deltas, np.nan), where=previous != 0)
+
+    std = np.sqrt((dy * dy).sum(axis=1) / np.maximum(count, 1))
+    z = np.divide(values - mean[:, None], std[:, None], out=np.zeros_like(values), where=std[:, None] > 0)
+    z = np.where(valid, z, np.nan)
+    outliers = (np.abs(np.nan_to_num(z)) >= KPI_OUTLIER_Z) & (count[:, None] >= 4)
+
+    return {
+        "count": count,
+        "mean": mean,
+        "min": low.min(axis=1),
+        "min_month": min_month,
+        "max": high.max(axis=1),
+        "max_month": max_month,
+        "slope": slope,
+        "deltas": deltas,
+        "delta_pct": delta_pct,
+        "z": z,
+        "outliers": outliers,
+        "last_month": values.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1),
+    }
+
+
+def _number(value, digits=2):
+    value = float(value)
+    if np.isnan(value):
+        return None
+    value = round(value, digits)
+    return int(value) if value.is_integer() else value
+
+
+def _row_stats(stats, i, parameter, unit, values):
+    deltas = stats["deltas"][i]
+    last_delta = next((j for j in range(len(deltas) - 1, -1, -1) if not np.isnan(deltas[j])), None)
+    return {
+        "parameter": parameter,
+        "unit": unit,
+        "months_reported": int(stats["count"][i]),
+        "values": {MONTH_NAMES[m]: _number(v, 4) for m, v in enumerate(values) if not np.isnan(v)},
+        "mean": _number(stats["mean"][i]),
+        "min": _number(stats["min"][i]),
+        "min_month": MONTH_NAMES[stats["min_month"][i]],
+        "max": _number(stats["max"][i]),
+        "max_month": MONTH_NAMES[stats["max_month"][i]],
+        "trend_per_month": _number(stats["slope"][i]),
+        "last_month": MONTH_NAMES[stats["last_month"][i]],
+        "last_mom_change": _number(deltas[last_delta]) if last_delta is not None else None,
+        "last_mom_change_pct": _number(stats["delta_pct"][i][last_delta], 1) if last_delta is not None else None,
+        "outliers": [
+            {"month": MONTH_NAMES[m], "value": _number(values[m]), "z": _number(stats["z"][i][m])}
+            for m in np.flatnonzero(stats["outliers"][i])
+        ],
+    }
+
+
+def sheet_kpi_stats(header_rows, rows):
+    """KPI statistics for one sheet's table as a list of JSON-ready dicts"""
+    labels, values = kpi_rows(header_rows, rows)
+    stats = compute_stats(values)
+    return [_row_stats(stats, i, parameter, unit, values[i]) for i, (parameter, unit) in enumerate(labels)]
+
+
+def _signed(value):
+    return f"+{format_cell(float(value))}" if value > 0 else format_cell(float(value))
+
+
+def format_facts(kpis):
+    """Render a sheet's KPI statistics as short "facts:" lines for the prompt"""
+    lines = []
+    for kpi in kpis:
+        unit = f" {kpi['unit']}" if kpi["unit"] else ""
+        if kpi["min"] == kpi["max"]:
+            lines.append(f"{kpi['parameter']}: {format_cell(float(kpi['min']))}{unit} in all {kpi['months_reported']} months")
+            continue
+        parts = [
+            f"mean {format_cell(float(kpi['mean']))}{unit}",
+            f"min {format_cell(float(kpi['min']))} ({kpi['min_month']})",
+            f"max {format_cell(float(kpi['max']))} ({kpi['max_month']})",
+            f"trend {_signed(kpi['trend_per_month'])}/mo",
+        ]
+        if kpi["last_mom_change"] is not None:
+            pct = f" / {_signed(kpi['last_mom_change_pct'])}%" if kpi["last_mom_change_pct"] is not None else ""
+            parts.append(f"{kpi['last_month']} MoM {_signed(kpi['last_mom_change'])}{pct}")
+        if kpi["outliers"]:
+            parts.append("outliers " + ", ".join(f"{o['month']} (z={format_cell(float(o['z']))})" for o in kpi["outliers"]))
+        lines.append(f"{kpi['parameter']}: " + ", ".join(parts))
+    return ["facts (computed locally):"] + lines if lines else []
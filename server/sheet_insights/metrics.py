@@ -0,0 +1,224 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Standard library only: parser.py imports this in extraction worker processes
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, list(zip(self.labels, key)), value
+
+
+class Histogram:
+    """Bucketed observations per label combination, rendered as cumulative Prometheus buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, **labels):
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            return sum(counts[:-1]) if counts else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in items:
+            labels = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts[:-1]):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", labels + [("le", _format_value(float(bound)))], cumulative
+            yield f"{self.name}_sum", labels, counts[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class MetricsRegistry:
+    """In-process metrics, rendered in the Prometheus text exposition format.
+
+    Each worker process keeps its own values, so with API_WORKERS > 1 scrape
+    every process (or run one worker per container).
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labels=()):
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS):
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+WORKBOOK_OPEN_SECONDS = metrics.histogram(
+    "sheet_insights_workbook_open_seconds", "Time to open an uploaded workbook", ("engine",))
+SHEET_EXTRACT_SECONDS = metrics.histogram(
+    "sheet_insights_sheet_extract_seconds", "Time to parse and encode one sheet into prompt text")
+STAGE_SECONDS = metrics.histogram(
+    "sheet_insights_stage_seconds", "Duration of upload pipeline and summary stages", ("stage",))
+LLM_PROMPT_TOKENS = metrics.histogram(
+    "sheet_insights_llm_prompt_tokens", "Estimated prompt tokens per LLM call", ("stage",), buckets=TOKEN_BUCKETS)
+LLM_QUEUE_SECONDS = metrics.histogram(
+    "sheet_insights_llm_queue_seconds", "Time an LLM call waited for a concurrency slot and rate-limit pacing", ("stage",))
+LLM_NETWORK_SECONDS = metrics.histogram(
+    "sheet_insights_llm_network_seconds", "Duration of each LLM request attempt on the wire", ("stage", "outcome"))
+LLM_TOKENS = metrics.counter(
+    "sheet_insights_llm_tokens_total", "Tokens billed by LLM calls (prompt estimate when usage is missing)", ("stage", "kind"))
+LLM_HEDGES = metrics.counter(
+    "sheet_insights_llm_hedges_total", "Duplicate requests sent for slow LLM calls, by which request answered first", ("stage", "winner"))
+LLM_HEDGES_SKIPPED = metrics.counter(
+    "sheet_insights_llm_hedges_skipped_total", "Slow LLM calls not hedged because of the traffic cap or the rate limits", ("stage", "reason"))
+LLM_HEDGE_SAVED_SECONDS = metrics.histogram(
+    "sheet_insights_llm_hedge_saved_seconds", "Estimated latency removed when a hedge answered before the original request", ("stage",))
+LLM_REQUESTS = metrics.counter(
+    "sheet_insights_llm_requests_total", "LLM calls by final outcome", ("stage", "outcome"))
+LLM_RETRIES = metrics.counter(
+    "sheet_insights_llm_retries_total", "LLM request attempts retried by the scheduler", ("stage", "reason"))
+JSON_PARSE_FAILURES = metrics.counter(
+    "sheet_insights_json_parse_failures_total", "LLM replies that could not be repaired into the expected JSON", ("stage",))
+JSON_REPAIRS = metrics.counter(
+    "sheet_insights_json_repairs_total", "Near-JSON LLM replies recovered by local repair", ("stage", "repair"))
+LIST_REPLIES = metrics.counter(
+    "sheet_insights_list_replies_total", "LLM replies with no JSON, read as a bulleted or numbered list", ("stage",))
+FALLBACKS = metrics.counter(
+    "sheet_insights_fallbacks_total", "Results replaced by rule-based or placeholder insights", ("stage", "kind"))
+CACHE_REQUESTS = metrics.counter(
+    "sheet_insights_cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+
+
+class Trace:
+    """Timeline of one upload's stages and LLM calls, offsets in seconds from its start"""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, seconds, **attributes):
+        span = {"name": name, "start": round(start - self._origin, 4), "seconds": round(seconds, 4)}
+        span.update(attributes)
+        with self._lock:
+            self._spans.append(span)
+
+    def as_dict(self):
+        with self._lock:
+            spans = sorted(self._spans, key=lambda span: span["start"])
+        return {"run_id": self.run_id, "started_at": self.started_at, "spans": spans}
+
+
+# Set per upload; asyncio tasks and asyncio.to_thread inherit it, plain thread pools need copy_context()
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def start_trace(run_id):
+    """Trace everything the current task (and the tasks and threads it starts) does from now on"""
+    trace = Trace(run_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def record_span(name, start, seconds, **attributes):
+    """Add a span to the current upload's trace, if it is being traced; start is a perf_counter() value"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, start, seconds, **attributes)
+
+
+@contextmanager
+def timed(stage, **attributes):
+    """Observe a block in STAGE_SECONDS and add it to the current trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        record_span(stage, start, seconds, **attributes)
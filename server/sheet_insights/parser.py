@@ -1,14 +1,32 @@
+import os
 import re
 from pathlib import Path
-import openpyxl
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import threading
 import time
 
+from sheet_insights.xlsx_reader import open_workbook, READER_ENGINE
+from sheet_insights.formulas import evaluate_formulas
+from sheet_insights.encoder import encode_table, count_tokens, TABLE_ENCODING, SHEET_TOKEN_BUDGET
+from sheet_insights.kpi_stats import sheet_kpi_stats, format_facts, KPI_FACTS_IN_PROMPT
+from sheet_insights.metrics import SHEET_EXTRACT_SECONDS
+
+# Read here rather than in config.py so spawned extraction workers don't have to
+# import the OpenAI / LlamaParse clients just to parse a sheet.
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "thread")  # "thread" or "process"
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "0")) or (os.cpu_count() or 1)
+EXTRACTION_THREADS = 6  # Thread mode: limit workers to avoid memory issues
+
+_process_pool = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
 def get_sheet_names(file_path):
     """Extract all sheet names from Excel file with optimized loading"""
     try:
-        # Use read_only and data_only for faster loading
-        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        # Streaming engine only reads workbook.xml; openpyxl fallback uses read_only/data_only
+        workbook = open_workbook(file_path)
         names = workbook.sheetnames
         workbook.close()
         print(f"📋 Found {len(names)} sheets: {names}")
@@ -26,14 +44,32 @@ def format_metadata(sheet):
             metadata.append(line)
     return metadata
 
-def extract_table(sheet):
-    """Extract and format the core table with optimized processing"""
+def read_table_rows(sheet):
+    """Read the two header rows and the core table block of a sheet in one pass"""
     start_row = 6  # Adjust based on where your actual data starts
+    header_start = start_row - 2  # "Parameters / Unit / Rating" and month name rows
 
     # Limit rows for faster processing - only take first 50 rows of data
     max_rows = start_row + 50
-    rows = list(sheet.iter_rows(min_row=start_row, max_row=max_rows, values_only=True))
+    rows = list(sheet.iter_rows(min_row=header_start, max_row=max_rows, values_only=True))
+
+    # Resolve formulas without cached values (e.g. =AVERAGE(G7:R7)) before empty rows are dropped
+    rows = evaluate_formulas(rows, first_row=header_start)
+
+    return rows[:start_row - header_start], rows[start_row - header_start:]
 
+def extract_compact_table(sheet, token_budget=None):
+    """Extract the core table in the dense, token-budgeted encoding used for prompts"""
+    header_rows, rows = read_table_rows(sheet)
+    return encode_table(rows, header_rows, token_budget=token_budget)
+
+def extract_table(sheet):
+    """Extract and format the core table with optimized processing"""
+    _, rows = read_table_rows(sheet)
+    return markdown_table(rows)
+
+def markdown_table(rows):
+    """Format already read table rows as a markdown table"""
     # Filter out completely empty rows
     rows = [row for row in rows if any(cell for cell in row)]
 
@@ -70,79 +106,218 @@ def extract_table(sheet):
 
     return markdown_lines
 
-def process_single_sheet(args):
-    """Process a single sheet - for parallel processing"""
-    sheet_name, file_path, output_dir, name_mapping = args
+def render_sheet(wb, sheet_name):
+    """Render one sheet of an already opened workbook as its prompt text.
+
+    The table is read once and its KPI statistics are computed from the same
+    rows. Their facts go ahead of the table, whose token budget is reduced by
+    what they take, so trimming a prompt to the sheet budget drops table rows
+    rather than facts. Returns (text, table) where table holds the header and
+    data rows and the KPI statistics (None if they could not be computed).
+    """
+    header_rows, rows = read_table_rows(wb[sheet_name])
     try:
-        # Load workbook for this sheet only
-        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
-        sheet = wb[sheet_name]
+        kpis = sheet_kpi_stats(header_rows, rows)
+    except Exception as e:
+        print(f"⚠️ KPI stats skipped for '{sheet_name}': {e}")
+        kpis = None
+
+    # Minimal content for speed: title, facts and table, no metadata
+    facts = format_facts(kpis or []) if KPI_FACTS_IN_PROMPT else []
+    heading = f"## {sheet_name}\n\n" + "".join(line + "\n" for line in facts) + ("\n" if facts else "")
+    if TABLE_ENCODING == "markdown":
+        table_lines = markdown_table(rows)
+    else:
+        token_budget = max(SHEET_TOKEN_BUDGET - count_tokens(heading), SHEET_TOKEN_BUDGET // 4)
+        table_lines = encode_table(rows, header_rows, token_budget=token_budget)
+
+    text = heading + "".join(line + "\n" for line in table_lines)
+    return text, {"rows": list(header_rows) + list(rows), "kpis": kpis}
 
+
+def write_markdown_files(sheets, output_dir):
+    """Write extracted (sheet_name, text) pairs to output_dir/<sheet>.md.
+
+    Only used for debug output and benchmarks: file names are stable, so a
+    re-upload overwrites the previous files instead of adding _1, _2 copies.
+    Returns (markdown_paths, {file stem: sheet_name}).
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    markdown_paths, name_mapping = [], {}
+    for sheet_name, text in sheets:
         clean_sheet_name = re.sub(r'[^\w\-_]', '_', sheet_name.strip())
         clean_sheet_name = re.sub(r'_+', '_', clean_sheet_name).strip('_')
 
-        markdown_path = output_dir / f"{clean_sheet_name}.md"
-        counter = 1
-        while markdown_path.exists():
-            markdown_path = output_dir / f"{clean_sheet_name}_{counter}.md"
+        # Suffix only names that clash within this workbook
+        stem, counter = clean_sheet_name, 1
+        while stem in name_mapping:
+            stem = f"{clean_sheet_name}_{counter}"
             counter += 1
 
-        metadata_lines = format_metadata(sheet)
-        table_lines = extract_table(sheet)
-
-        # Write file with minimal content for speed
+        markdown_path = output_dir / f"{stem}.md"
         with open(markdown_path, "w", encoding="utf-8") as f:
-            f.write(f"## {sheet_name}\n\n")
-            # Skip metadata for speed
-            for line in table_lines:
-                f.write(line + "\n")
+            f.write(text)
+        markdown_paths.append(markdown_path)
+        name_mapping[stem] = sheet_name
+    return markdown_paths, name_mapping
+
 
+def process_single_sheet(args):
+    """Process a single sheet - for parallel processing; returns (text, sheet_name, seconds, table)"""
+    sheet_name, file_path = args
+    try:
+        # Load workbook for this sheet only
+        wb = open_workbook(file_path)
+        start_time = time.perf_counter()
+        text, table = render_sheet(wb, sheet_name)
+        seconds = time.perf_counter() - start_time
         wb.close()
-        name_mapping[markdown_path.stem] = sheet_name
         print(f"✅ Processed: {sheet_name}")
-        return markdown_path, sheet_name
+        return text, sheet_name, seconds, table
 
     except Exception as e:
         print(f"❌ Failed to process {sheet_name}: {e}")
-        return None, sheet_name
+        return None, sheet_name, None, None
 
 
-def extract_markdown(file_path, output_dir, sheets_to_process=None, skip_first_sheet=True):
-    """Optimized markdown extraction with parallel processing"""
-    start_time = time.time()
+def _process_with_workbook(wb, sheet_name):
+    try:
+        start_time = time.perf_counter()
+        text, table = render_sheet(wb, sheet_name)
+        print(f"✅ Processed: {sheet_name}")
+        return text, sheet_name, time.perf_counter() - start_time, table
+    except Exception as e:
+        print(f"❌ Failed to process {sheet_name}: {e}")
+        return None, sheet_name, None, None
+
+
+def process_sheet_group(args):
+    """Process a group of sheets in a worker process, opening the workbook only once"""
+    sheet_names, file_path = args
+    results = []
+    try:
+        wb = open_workbook(file_path)
+    except Exception as e:
+        print(f"❌ Failed to open workbook in worker {os.getpid()}: {e}")
+        return [(None, sheet_name, None, None) for sheet_name in sheet_names]
+
+    try:
+        for sheet_name in sheet_names:
+            results.append(_process_with_workbook(wb, sheet_name))
+    finally:
+        wb.close()
+    return results
+
+
+def _warm_up(_):
+    return os.getpid()
 
-    all_sheet_names = get_sheet_names(file_path)
-    if not all_sheet_names:
-        return [], {}
+
+def get_extraction_pool(max_workers=None):
+    """Return the shared process pool, creating and warming it on first use.
+
+    The pool is reused across requests so worker start-up (interpreter spawn
+    plus openpyxl import) is paid once per server process, not per upload.
+    """
+    global _process_pool, _process_pool_workers
+    max_workers = max_workers or EXTRACTION_WORKERS
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != max_workers:
+            if _process_pool is not None:
+                _process_pool.shutdown(wait=False, cancel_futures=True)
+            # spawn, not fork: the server process runs threads and an event loop
+            _process_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _process_pool_workers = max_workers
+            start_time = time.time()
+            list(_process_pool.map(_warm_up, range(max_workers)))
+            print(f"🔥 Warmed {max_workers} extraction processes in {time.time() - start_time:.2f}s")
+        return _process_pool
+
+
+def shutdown_extraction_pool():
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=True, cancel_futures=True)
+            _process_pool = None
+            _process_pool_workers = 0
+
+
+def extract_sheets(file_path, sheets_to_process=None, skip_first_sheet=True, mode=None, max_workers=None, tables=None):
+    """Optimized sheet extraction with parallel processing, kept in memory
+
+    Returns [(sheet_name, text)] in workbook order for every sheet that could
+    be extracted. mode selects the executor: "thread" (default) or "process",
+    which spreads sheet groups over a persistent process pool so openpyxl
+    parsing is not serialised by the GIL. Defaults come from EXTRACTION_MODE /
+    EXTRACTION_WORKERS. If a tables dict is given it is filled with each
+    extracted sheet's rows and KPI statistics, so callers need not parse the
+    workbook again.
+    """
+    mode = mode or EXTRACTION_MODE
+    start_time = time.time()
 
     if sheets_to_process:
         target_sheets = sheets_to_process
     else:
+        all_sheet_names = get_sheet_names(file_path)
+        if not all_sheet_names:
+            return []
         target_sheets = all_sheet_names[2:] if skip_first_sheet else all_sheet_names
 
-    print(f"📋 Processing {len(target_sheets)} sheet(s) in parallel: {target_sheets}")
+    print(f"📋 Processing {len(target_sheets)} sheet(s) in parallel ({mode} mode): {target_sheets}")
 
-    markdown_paths = []
-    name_mapping = {}
+    if mode == "process":
+        workers = min(len(target_sheets), max_workers or EXTRACTION_WORKERS)
+        pool = get_extraction_pool(max_workers or EXTRACTION_WORKERS)
 
-    # Prepare arguments for parallel processing
-    args_list = [
-        (sheet_name, file_path, output_dir, name_mapping)
-        for sheet_name in target_sheets
-    ]
+        # One group per worker so each process opens the workbook once
+        groups = [target_sheets[i::workers] for i in range(workers)]
+        extracted = {}
+        for group_results in pool.map(process_sheet_group, [(group, file_path) for group in groups]):
+            extracted.update((result[1], result) for result in group_results)
+        results = [extracted.get(sheet_name, (None, sheet_name, None, None)) for sheet_name in target_sheets]
+    elif READER_ENGINE == "stream":
+        # The streaming reader is safe to share, so the package is opened once for all sheets
+        wb = open_workbook(file_path)
+        try:
+            workers = min(len(target_sheets), max_workers or EXTRACTION_THREADS)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lambda name: _process_with_workbook(wb, name), target_sheets))
+        finally:
+            wb.close()
+    else:
+        # Prepare arguments for parallel processing
+        args_list = [(sheet_name, file_path) for sheet_name in target_sheets]
 
-    # Use parallel processing for sheet extraction
-    max_workers = min(len(target_sheets), 6)  # Limit workers to avoid memory issues
+        # Use parallel processing for sheet extraction
+        workers = min(len(target_sheets), max_workers or EXTRACTION_THREADS)
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(executor.map(process_single_sheet, args_list))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(process_single_sheet, args_list))
 
-    # Collect successful results
-    for markdown_path, sheet_name in results:
-        if markdown_path:
-            markdown_paths.append(markdown_path)
+    # Collect successful results; workers in process mode report their timings back here
+    sheets = [(sheet_name, text) for text, sheet_name, _, _ in results if text is not None]
+    for text, sheet_name, seconds, table in results:
+        if seconds is not None:
+            SHEET_EXTRACT_SECONDS.observe(seconds)
+        if tables is not None and text is not None:
+            tables[sheet_name] = table
 
     processing_time = time.time() - start_time
-    print(f"⚡ Markdown extraction completed in {processing_time:.2f}s")
+    print(f"⚡ Sheet extraction completed in {processing_time:.2f}s")
 
-    return markdown_paths, name_mapping
+    return sheets
+
+
+def extract_markdown(file_path, output_dir, sheets_to_process=None, skip_first_sheet=True, mode=None, max_workers=None):
+    """extract_sheets() plus a markdown file per sheet in output_dir.
+
+    Returns (markdown_paths, {file stem: sheet_name}).
+    """
+    sheets = extract_sheets(file_path, sheets_to_process, skip_first_sheet, mode, max_workers)
+    return write_markdown_files(sheets, output_dir)
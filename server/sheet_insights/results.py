@@ -0,0 +1,178 @@
+import json
+import shutil
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+
+from sheet_insights.config import RESULT_DB_PATH, RESULT_RUNS_DIR, RESULT_RUNS_KEEP, RESULT_STALE_RUN_HOURS
+
+# Result kinds stored per run
+SHEET_INSIGHTS = "sheet_insights"
+GENERAL_INSIGHTS = "general_insights"
+ADDITIONAL_INSIGHTS = "additional_insights"
+KPI_STATS = "kpi_stats"
+TRACE = "trace"
+TOKEN_USAGE = "token_usage"
+
+
+class ResultStore:
+    """SQLite-backed results of every upload run, safe to share between worker processes.
+
+    Each upload (or queued job) writes its results under its own run id, so
+    concurrent uploads never overwrite each other. A run only becomes the
+    "latest" one that readers see once complete() has committed, so readers
+    never mix one upload's sheet insights with another's summary. Every write
+    is a single SQLite transaction (WAL mode), so a crashed or concurrent
+    writer can't leave a half-written result behind.
+    """
+
+    def __init__(self, db_path, runs_dir, keep_runs=50, stale_run_seconds=86400):
+        self.db_path = Path(db_path)
+        self.runs_dir = Path(runs_dir)
+        self.keep_runs = keep_runs
+        self.stale_run_seconds = stale_run_seconds
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.execute("PRAGMA busy_timeout = 30000")
+        return db
+
+    def init(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS runs (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT,
+                    created_at REAL NOT NULL,
+                    completed_at REAL,
+                    failed_at REAL
+                )
+                """
+            )
+            if "failed_at" not in {row[1] for row in db.execute("PRAGMA table_info(runs)")}:
+                db.execute("ALTER TABLE runs ADD COLUMN failed_at REAL")
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS results (
+                    run_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (run_id, kind)
+                )
+                """
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_runs_completed ON runs (completed_at)")
+        db.close()
+
+    def create_run(self, filename: str = None, run_id: str = None):
+        """Register a new run; queued jobs pass their job id so both share one id"""
+        run_id = run_id or uuid.uuid4().hex
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO runs (id, filename, created_at) VALUES (?, ?, ?)",
+                (run_id, filename, time.time()),
+            )
+        db.close()
+        return run_id
+
+    def run_dir(self, run_id: str):
+        """Directory for a run's binary artefacts (e.g. its KPI cube)"""
+        return self.runs_dir / run_id
+
+    def put(self, run_id: str, kind: str, data):
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO results (run_id, kind, data, updated_at) VALUES (?, ?, ?, ?)",
+                (run_id, kind, json.dumps(data, ensure_ascii=False), time.time()),
+            )
+        db.close()
+
+    def complete(self, run_id: str):
+        """Make the run the latest one readers see, then drop runs beyond the retention limit"""
+        with self._connect() as db:
+            db.execute("UPDATE runs SET completed_at = ? WHERE id = ?", (time.time(), run_id))
+        db.close()
+        self.prune()
+
+    def fail(self, run_id: str):
+        """Mark a run that will never complete (error or abandoned stream), so pruning needn't wait for it"""
+        with self._connect() as db:
+            db.execute(
+                "UPDATE runs SET failed_at = ? WHERE id = ? AND completed_at IS NULL", (time.time(), run_id)
+            )
+        db.close()
+
+    def get(self, run_id: str, kind: str):
+        return self.get_many(run_id, (kind,))[kind]
+
+    def get_many(self, run_id: str, kinds):
+        """{kind: data or None} for several kinds, read in one consistent snapshot"""
+        placeholders = ", ".join("?" for _ in kinds)
+        with self._connect() as db:
+            rows = db.execute(
+                f"SELECT kind, data FROM results WHERE run_id = ? AND kind IN ({placeholders})",
+                (run_id, *kinds),
+            ).fetchall()
+        db.close()
+        found = {kind: json.loads(data) for kind, data in rows}
+        return {kind: found.get(kind) for kind in kinds}
+
+    def version(self, run_id: str):
+        """Last write time of a run's results; changes whenever any of them is rewritten"""
+        with self._connect() as db:
+            row = db.execute("SELECT MAX(updated_at) FROM results WHERE run_id = ?", (run_id,)).fetchone()
+        db.close()
+        return row[0]
+
+    def latest_run_id(self):
+        """Id of the most recently completed run, or None before the first upload finishes"""
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT id FROM runs WHERE completed_at IS NOT NULL ORDER BY completed_at DESC LIMIT 1"
+            ).fetchone()
+        db.close()
+        return row[0] if row else None
+
+    def has_run(self, run_id: str):
+        with self._connect() as db:
+            row = db.execute("SELECT 1 FROM runs WHERE id = ?", (run_id,)).fetchone()
+        db.close()
+        return row is not None
+
+    def prune(self):
+        """Keep the newest `keep_runs` completed or failed runs; older ones lose their results and artefacts.
+
+        Runs still in progress are never pruned, however many newer runs have
+        finished, unless they have been unfinished for `stale_run_seconds`.
+        """
+        if self.keep_runs <= 0:
+            return
+        with self._connect() as db:
+            stale = [row[0] for row in db.execute(
+                "SELECT id FROM runs WHERE completed_at IS NOT NULL OR failed_at IS NOT NULL "
+                "ORDER BY completed_at IS NULL, COALESCE(completed_at, failed_at) DESC LIMIT -1 OFFSET ?",
+                (self.keep_runs,)
+            )]
+            stale += [row[0] for row in db.execute(
+                "SELECT id FROM runs WHERE completed_at IS NULL AND failed_at IS NULL AND created_at < ?",
+                (time.time() - self.stale_run_seconds,),
+            )]
+            if stale:
+                placeholders = ", ".join("?" for _ in stale)
+                db.execute(f"DELETE FROM results WHERE run_id IN ({placeholders})", stale)
+                db.execute(f"DELETE FROM runs WHERE id IN ({placeholders})", stale)
+        db.close()
+        for run_id in stale:
+            shutil.rmtree(self.runs_dir / run_id, ignore_errors=True)
+        if stale:
+            print(f"🧹 Pruned {len(stale)} old result runs")
+
+
+result_store = ResultStore(
+    RESULT_DB_PATH, RESULT_RUNS_DIR, keep_runs=RESULT_RUNS_KEEP, stale_run_seconds=RESULT_STALE_RUN_HOURS * 3600
+)
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import time
+from pathlib import Path
+
+
+class ArtefactCollector:
+    """Deletes on-disk artefacts that haven't been touched for a while.
+
+    Each rule is (directory, glob pattern, max age in seconds). Files are
+    judged by mtime, so anything still in use (a re-uploaded blob, a workbook
+    version updated by the latest upload) keeps being refreshed and survives.
+    """
+
+    def __init__(self, rules, interval_seconds=6 * 3600):
+        self.rules = [(Path(directory), pattern, max_age) for directory, pattern, max_age in rules]
+        self.interval_seconds = interval_seconds
+        self.runs = 0
+        self.deleted_files = 0
+        self.freed_bytes = 0
+        self.last_run = None
+        self._lock = threading.Lock()
+
+    def collect(self):
+        """Run every rule once; returns (files deleted, bytes freed)"""
+        now = time.time()
+        deleted = freed = 0
+        for directory, pattern, max_age in self.rules:
+            if not directory.exists():
+                continue
+            for path in directory.glob(pattern):
+                try:
+                    stat = path.stat()
+                    if not path.is_file() or now - stat.st_mtime < max_age:
+                        continue
+                    path.unlink()
+                except OSError:
+                    continue  # removed concurrently, e.g. by another worker process
+                deleted += 1
+                freed += stat.st_size
+                # Drop fan-out directories (e.g. blobs/3b/) left empty
+                if path.parent != directory:
+                    try:
+                        path.parent.rmdir()
+                    except OSError:
+                        pass
+
+        with self._lock:
+            self.runs += 1
+            self.deleted_files += deleted
+            self.freed_bytes += freed
+            self.last_run = now
+        if deleted:
+            print(f"🧹 Removed {deleted} old artefacts ({freed / (1024 * 1024):.1f} MB)")
+        return deleted, freed
+
+    async def run_periodically(self):
+        """Collect now and then every interval_seconds until cancelled"""
+        while True:
+            try:
+                await asyncio.to_thread(self.collect)
+            except Exception as e:
+                print(f"⚠️ Artefact cleanup failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "deleted_files": self.deleted_files,
+                "freed_bytes": self.freed_bytes,
+                "last_run": self.last_run,
+            }
+
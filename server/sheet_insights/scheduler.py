@@ -0,0 +1,555 @@
+import asyncio
+import bisect
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+
+from sheet_insights.config import (
+    LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS, LLM_MAX_RETRIES, LLM_RATE_LIMIT_RETRIES, LLM_RPM_LIMIT, LLM_TPM_LIMIT,
+    LLM_HEDGING, LLM_HEDGE_STAGES, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MAX_SHARE, LLM_HEDGE_MIN_SAMPLES,
+)
+from sheet_insights.encoder import count_tokens
+from sheet_insights.metrics import (
+    LLM_NETWORK_SECONDS, LLM_PROMPT_TOKENS, LLM_QUEUE_SECONDS, LLM_REQUESTS, LLM_RETRIES, LLM_TOKENS, record_span,
+    LLM_HEDGES, LLM_HEDGES_SKIPPED, LLM_HEDGE_SAVED_SECONDS,
+)
+from sheet_insights.token_usage import current_ledger
+
+# Azure enforces quotas over short windows (RPM/6 per 10s), so buckets only
+# allow a 10-second burst rather than a full minute of quota at once.
+BURST_SECONDS = 10
+
+RETRYABLE_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `per_minute / 60` per second.
+
+    reserve() always succeeds and returns how long the caller must wait before
+    using what it reserved, so the same bucket serves threads and coroutines.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, per_minute * burst_seconds / 60.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float):
+        with self._lock:
+            self._refill(time.monotonic())
+            # A single request larger than the burst still has to be allowed through
+            self.tokens -= min(amount, self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_reserve(self, amount: float):
+        """Take amount only if it is available right now"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens < min(amount, self.capacity):
+                return False
+            self.tokens -= min(amount, self.capacity)
+            return True
+
+    def refund(self, amount: float):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the LLM while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Stops LLM calls after repeated failures so callers fall back immediately.
+
+    After `failure_threshold` consecutive failed calls the circuit opens; once
+    `reset_seconds` have passed a single trial call is let through, and its
+    outcome closes the circuit again or re-opens it for another period.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self._trial else "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._trial and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print("✅ LLM circuit breaker closed")
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def abandon_trial(self):
+        """End a trial call that finished without a verdict (cancelled, or a client-side error).
+
+        The circuit stays open and the next call after it is let through as a new trial.
+        """
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._trial = False
+                self.trips += 1
+                print(f"🛑 LLM circuit breaker open after {self.failures} failures, "
+                      f"retrying in {self.reset_seconds:.0f}s")
+
+
+class HedgePolicy:
+    """When to send a duplicate request for a slow call, and how much it helped.
+
+    Keeps a window of recent answer times per stage. Once a stage has
+    min_samples, a call still unanswered at the given percentile of them is
+    hedged, as long as hedges stay within max_share of the stage's calls.
+    When the hedge answers first, the latency it removed is estimated from
+    the recent answers slower than the hedge's (or the request timeout when
+    there are none): the original was still pending, so it would have taken
+    at least that long.
+    """
+
+    def __init__(self, stages, percentile=95.0, max_share=0.1, min_samples=20, window=200):
+        self.stages = set(stages)
+        self.percentile = percentile
+        self.max_share = max_share
+        self.min_samples = min_samples
+        self._latencies = {stage: deque(maxlen=window) for stage in self.stages}
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def start(self, stage):
+        """Count a request attempt; returns its hedge delay in seconds, or None if it isn't hedged"""
+        if stage not in self.stages:
+            return None
+        with self._lock:
+            self.calls += 1
+            latencies = sorted(self._latencies[stage])
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))]
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self._latencies[stage].append(seconds)
+
+    def admit(self):
+        """Claim a hedge within the traffic cap"""
+        with self._lock:
+            if self.hedged + 1 > self.max_share * self.calls:
+                return False
+            self.hedged += 1
+            return True
+
+    def release(self):
+        """Give back a claimed hedge that was not sent"""
+        with self._lock:
+            self.hedged -= 1
+
+    def settle(self, stage, winner, elapsed, timeout):
+        """Record which request answered first, elapsed seconds after the original was sent"""
+        LLM_HEDGES.inc(stage=stage, winner=winner)
+        if winner == "none":
+            return
+        self.observe(stage, elapsed)
+        if winner != "hedge":
+            return
+        with self._lock:
+            latencies = sorted(self._latencies[stage])
+        slower = latencies[bisect.bisect_right(latencies, elapsed):]
+        expected = sum(slower) / len(slower) if slower else (timeout or elapsed)
+        saved = max(0.0, expected - elapsed)
+        LLM_HEDGE_SAVED_SECONDS.observe(saved, stage=stage)
+        with self._lock:
+            self.hedge_wins += 1
+            self.saved_seconds += saved
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": True,
+                "stages": sorted(self.stages),
+                "percentile": self.percentile,
+                "max_share": self.max_share,
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "hedged_share": round(self.hedged / self.calls, 4) if self.calls else 0.0,
+                "estimated_saved_seconds": round(self.saved_seconds, 3),
+            }
+
+
+def _retry_after_seconds(error):
+    """Read the server's retry hint from a 429 response, if it sent one"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("x-ms-retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value:
+            try:
+                return max(0.0, float(value) * scale)
+            except ValueError:
+                continue
+    return None
+
+
+def _trips_breaker(error):
+    """Whether a final error means the service is unhealthy rather than the request being bad"""
+    return isinstance(error, RETRYABLE_ERRORS + (openai.RateLimitError,))
+
+
+def _outcome(error):
+    """Metric label for how a request attempt ended"""
+    if error is None:
+        return "ok"
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limited"
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    return "error"
+
+
+class LLMScheduler:
+    """Central gate in front of every chat completion call.
+
+    Paces requests against requests-per-minute and tokens-per-minute buckets
+    using an estimate of the prompt plus max_tokens. On a 429 it pauses all
+    callers for the server's retry-after interval and retries instead of
+    failing the sheet; timeouts and 5xx errors get a few backed-off retries.
+    Calls that still fail on a timeout, 5xx or 429 feed a circuit breaker;
+    while it is open, calls raise CircuitOpenError straight away.
+
+    Every call is labelled with a stage ("sheet", "general", ...) for the
+    metrics: queue time (slot wait plus pacing before the first attempt),
+    network time per attempt, prompt size, retries and final outcome.
+    Token usage is booked to the current upload's ledger, split over the
+    `sheets` the call was made for.
+
+    With a HedgePolicy, async calls on its stages that outlast the hedge
+    delay get a duplicate request; the first answer wins and the other is
+    cancelled. Duplicates are charged to the rate-limit buckets and only go
+    out when the buckets have room for them right away.
+    """
+
+    def __init__(self, rpm_limit=0, tpm_limit=0, max_retries=2, rate_limit_retries=6, breaker=None, hedge=None):
+        self.rpm = TokenBucket(rpm_limit) if rpm_limit else None
+        self.tpm = TokenBucket(tpm_limit) if tpm_limit else None
+        self.max_retries = max_retries
+        self.rate_limit_retries = rate_limit_retries
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+        self.estimated_tokens = 0
+        self.used_tokens = 0
+
+    @staticmethod
+    def estimate_tokens(messages, max_tokens=0):
+        """Prompt tokens plus the completion cap, i.e. what the quota will be charged"""
+        prompt = sum(count_tokens(message.get("content") or "") + 4 for message in messages)
+        return prompt + (max_tokens or 0)
+
+    def _reserve(self, estimate):
+        """Claim quota for one request and return how long to wait before sending it"""
+        delays = [self._resume_at - time.monotonic()]
+        if self.rpm:
+            delays.append(self.rpm.reserve(1))
+        if self.tpm:
+            delays.append(self.tpm.reserve(estimate))
+        delay = max(0.0, *delays)
+        with self._lock:
+            self.requests += 1
+            self.estimated_tokens += estimate
+            self.wait_seconds += delay
+        return delay
+
+    def _try_reserve(self, estimate):
+        """Claim quota for a hedge only if no pacing wait would be needed"""
+        if self._resume_at > time.monotonic():
+            return False
+        if self.rpm and not self.rpm.try_reserve(1):
+            return False
+        if self.tpm and not self.tpm.try_reserve(estimate):
+            if self.rpm:
+                self.rpm.refund(1)
+            return False
+        with self._lock:
+            self.requests += 1
+            self.estimated_tokens += estimate
+        return True
+
+    def _admit_hedge(self, stage, estimate):
+        if not self.hedge.admit():
+            LLM_HEDGES_SKIPPED.inc(stage=stage, reason="traffic_cap")
+            return False
+        if not self._try_reserve(estimate):
+            self.hedge.release()
+            LLM_HEDGES_SKIPPED.inc(stage=stage, reason="rate_limit")
+            return False
+        return True
+
+    async def _send(self, create, kwargs, stage, estimate):
+        """One request attempt, hedged with a duplicate if it outlasts the stage's hedge delay"""
+        sent = time.perf_counter()
+        delay = self.hedge.start(stage) if self.hedge else None
+        if delay is None:
+            response = await create(**kwargs)
+            if self.hedge and stage in self.hedge.stages:
+                self.hedge.observe(stage, time.perf_counter() - sent)
+            return response
+
+        primary = asyncio.ensure_future(create(**kwargs))
+        duplicate = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._admit_hedge(stage, estimate):
+                response = await primary
+                self.hedge.observe(stage, time.perf_counter() - sent)
+                return response
+
+            print(f"🪁 Hedging a {stage} call still unanswered after {delay:.2f}s")
+            duplicate = asyncio.ensure_future(create(**kwargs))
+            pending = {primary, duplicate}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None:
+                        winner = "hedge" if task is duplicate else "primary"
+                        self.hedge.settle(stage, winner, time.perf_counter() - sent, kwargs.get("timeout"))
+                        return task.result()
+            # Both failed: report the original's error, the duplicate's is only read so it isn't logged as lost
+            self.hedge.settle(stage, "none", time.perf_counter() - sent, kwargs.get("timeout"))
+            if not duplicate.cancelled():
+                duplicate.exception()
+            if primary.cancelled():
+                raise asyncio.CancelledError()
+            raise primary.exception()
+        finally:
+            # The request that lost (or both, if the caller was cancelled) is abandoned
+            for task in (primary, duplicate):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def _settle(self, response, estimate, prompt_estimate, stage="other", sheets=None):
+        """Book the call's real token usage and refund the unused part of the estimate.
+
+        Returns (prompt_tokens, completion_tokens).
+        """
+        usage = getattr(response, "usage", None)
+        prompt = getattr(usage, "prompt_tokens", None)
+        completion = getattr(usage, "completion_tokens", None)
+        estimated = not isinstance(prompt, int) or not isinstance(completion, int)
+        if estimated:
+            prompt, completion = prompt_estimate, 0
+
+        LLM_TOKENS.inc(prompt, stage=stage, kind="prompt")
+        LLM_TOKENS.inc(completion, stage=stage, kind="completion")
+        ledger = current_ledger()
+        if ledger is not None:
+            ledger.record(stage, prompt, completion, sheets, estimated=estimated)
+        if estimated:
+            return prompt, completion
+
+        total = prompt + completion
+        with self._lock:
+            self.used_tokens += total
+        if self.tpm and total < estimate:
+            self.tpm.refund(estimate - total)
+        return prompt, completion
+
+    def _backoff(self, error, attempt, stage="other"):
+        """Return seconds to wait before retrying, or None if the error is final"""
+        if isinstance(error, openai.RateLimitError):
+            if attempt >= self.rate_limit_retries:
+                return None
+            delay = _retry_after_seconds(error)
+            if delay is None:
+                delay = min(60.0, 2.0 ** attempt)
+            with self._lock:
+                self.rate_limited += 1
+                self.retries += 1
+                # Everyone backs off, not just this caller - the quota is shared
+                self._resume_at = max(self._resume_at, time.monotonic() + delay)
+            LLM_RETRIES.inc(stage=stage, reason="rate_limited")
+            return delay
+        if isinstance(error, RETRYABLE_ERRORS) and attempt < self.max_retries:
+            with self._lock:
+                self.retries += 1
+            LLM_RETRIES.inc(stage=stage, reason=_outcome(error))
+            return min(8.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+        return None
+
+    def _begin(self, stage, kwargs):
+        """Check the breaker and size the call; returns (quota estimate, prompt estimate)"""
+        if not self.breaker.allow():
+            LLM_REQUESTS.inc(stage=stage, outcome="circuit_open")
+            raise CircuitOpenError("LLM circuit breaker is open")
+        max_tokens = kwargs.get("max_tokens") or 0
+        estimate = self.estimate_tokens(kwargs.get("messages", []), max_tokens)
+        LLM_PROMPT_TOKENS.observe(estimate - max_tokens, stage=stage)
+        return estimate, estimate - max_tokens
+
+    @staticmethod
+    def _observe_attempt(stage, sent, error=None):
+        seconds = time.perf_counter() - sent
+        LLM_NETWORK_SECONDS.observe(seconds, stage=stage, outcome=_outcome(error))
+        return seconds
+
+    @staticmethod
+    def _observe_call(stage, queued_at, first_sent, network, attempts, error=None, tokens=(None, None)):
+        """Record the finished call in the metrics and the current trace"""
+        LLM_REQUESTS.inc(stage=stage, outcome=_outcome(error))
+        queue = first_sent - queued_at
+        LLM_QUEUE_SECONDS.observe(queue, stage=stage)
+        record_span(
+            "llm", queued_at, time.perf_counter() - queued_at, stage=stage, outcome=_outcome(error),
+            queue_seconds=round(queue, 4), network_seconds=round(network, 4), attempts=attempts,
+            prompt_tokens=tokens[0], completion_tokens=tokens[1],
+        )
+
+    async def acall(self, create, stage="other", queued_at=None, sheets=None, **kwargs):
+        """Await `create(**kwargs)` (an async chat completion) under the scheduler.
+
+        queued_at is the perf_counter() time the caller started waiting for a
+        slot, so queue time includes its semaphore wait. sheets names the
+        sheets the call is for (or maps them to their prompt share).
+        """
+        queued_at = queued_at or time.perf_counter()
+        estimate, prompt_estimate = self._begin(stage, kwargs)
+        attempt, first_sent, network = 0, None, 0.0
+        judged = False
+        try:
+            while True:
+                delay = self._reserve(estimate)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                sent = time.perf_counter()
+                first_sent = first_sent or sent
+                try:
+                    response = await self._send(create, kwargs, stage, estimate)
+                except Exception as e:
+                    network += self._observe_attempt(stage, sent, e)
+                    backoff = self._backoff(e, attempt, stage)
+                    if backoff is None:
+                        if _trips_breaker(e):
+                            self.breaker.record_failure()
+                            judged = True
+                        self._observe_call(stage, queued_at, first_sent, network, attempt + 1, e)
+                        raise
+                    attempt += 1
+                    print(f"⏳ LLM call retry {attempt} in {backoff:.1f}s after {type(e).__name__}")
+                    await asyncio.sleep(backoff)
+                    continue
+                network += self._observe_attempt(stage, sent)
+                self.breaker.record_success()
+                judged = True
+                tokens = self._settle(response, estimate, prompt_estimate, stage, sheets)
+                self._observe_call(stage, queued_at, first_sent, network, attempt + 1, tokens=tokens)
+                return response
+        finally:
+            # Cancelled, or rejected as a bad request: says nothing about the service's health
+            if not judged:
+                self.breaker.abandon_trial()
+
+    def call(self, create, stage="other", queued_at=None, sheets=None, **kwargs):
+        """Blocking counterpart of acall for the synchronous client"""
+        queued_at = queued_at or time.perf_counter()
+        estimate, prompt_estimate = self._begin(stage, kwargs)
+        attempt, first_sent, network = 0, None, 0.0
+        judged = False
+        try:
+            while True:
+                delay = self._reserve(estimate)
+                if delay > 0:
+                    time.sleep(delay)
+                sent = time.perf_counter()
+                first_sent = first_sent or sent
+                try:
+                    response = create(**kwargs)
+                except Exception as e:
+                    network += self._observe_attempt(stage, sent, e)
+                    backoff = self._backoff(e, attempt, stage)
+                    if backoff is None:
+                        if _trips_breaker(e):
+                            self.breaker.record_failure()
+                            judged = True
+                        self._observe_call(stage, queued_at, first_sent, network, attempt + 1, e)
+                        raise
+                    attempt += 1
+                    print(f"⏳ LLM call retry {attempt} in {backoff:.1f}s after {type(e).__name__}")
+                    time.sleep(backoff)
+                    continue
+                network += self._observe_attempt(stage, sent)
+                self.breaker.record_success()
+                judged = True
+                tokens = self._settle(response, estimate, prompt_estimate, stage, sheets)
+                self._observe_call(stage, queued_at, first_sent, network, attempt + 1, tokens=tokens)
+                return response
+        finally:
+            # Cancelled, or rejected as a bad request: says nothing about the service's health
+            if not judged:
+                self.breaker.abandon_trial()
+
+    def stats(self):
+        return {
+            "rpm_limit": self.rpm.per_minute if self.rpm else None,
+            "tpm_limit": self.tpm.per_minute if self.tpm else None,
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "estimated_tokens": self.estimated_tokens,
+            "used_tokens": self.used_tokens,
+            "circuit_breaker": self.breaker.state,
+            "circuit_breaker_trips": self.breaker.trips,
+            "hedging": self.hedge.stats() if self.hedge else {"enabled": False},
+        }
+
+
+llm_scheduler = LLMScheduler(
+    rpm_limit=LLM_RPM_LIMIT,
+    tpm_limit=LLM_TPM_LIMIT,
+    max_retries=LLM_MAX_RETRIES,
+    rate_limit_retries=LLM_RATE_LIMIT_RETRIES,
+    breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS),
+    hedge=HedgePolicy(LLM_HEDGE_STAGES, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MAX_SHARE, LLM_HEDGE_MIN_SAMPLES) if LLM_HEDGING else None,
+)
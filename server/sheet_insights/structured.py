@@ -0,0 +1,232 @@
+import ast
+import json
+import re
+
+from sheet_insights.config import LLM_RESPONSE_FORMAT, LLM_FORMAT_RETRIES
+from sheet_insights.metrics import JSON_PARSE_FAILURES, JSON_REPAIRS, LIST_REPLIES, LLM_RETRIES
+
+# Every insight reply is a JSON object: strict structured output needs an object at the root
+INSIGHT_LIST_KEY = "insights"
+# Part of the insight cache key with LLM_RESPONSE_FORMAT; bump when the reply schemas change
+REPLY_SCHEMA_VERSION = 1
+
+FORMAT_RETRY_PROMPT = "That answer was not valid JSON in the requested shape. Answer again with only the JSON object."
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.S | re.I)
+_TRAILING_COMMA = re.compile(r",\s*([\]}])")
+_LIST_LINE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+(.+?)\s*$", re.M)
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"', "‘": "'", "’": "'"})
+
+
+class ReplyFormatError(ValueError):
+    """An LLM reply that no local repair could turn into the expected JSON"""
+
+    def __init__(self, message, reply=""):
+        super().__init__(message)
+        self.reply = reply
+
+
+def insight_list_schema():
+    return {
+        "type": "object",
+        "properties": {INSIGHT_LIST_KEY: {"type": "array", "items": {"type": "string"}}},
+        "required": [INSIGHT_LIST_KEY],
+        "additionalProperties": False,
+    }
+
+
+def packed_insights_schema(sheet_names):
+    """One insight list per sheet, keyed by the sheet names exactly as sent"""
+    names = list(dict.fromkeys(sheet_names))
+    return {
+        "type": "object",
+        "properties": {name: {"type": "array", "items": {"type": "string"}} for name in names},
+        "required": names,
+        "additionalProperties": False,
+    }
+
+
+def response_format(name, schema):
+    """Chat completion kwargs asking for structured output, per LLM_RESPONSE_FORMAT"""
+    if LLM_RESPONSE_FORMAT == "json_schema":
+        return {"response_format": {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}}
+    if LLM_RESPONSE_FORMAT == "json_object":
+        return {"response_format": {"type": "json_object"}}
+    return {}
+
+
+def _closers(text):
+    """Brackets closing every structure open at the end of text; None if it ends inside a string"""
+    stack, in_string, escaped = [], False, False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "[{":
+            stack.append("]" if char == "[" else "}")
+        elif char in "]}" and stack:
+            stack.pop()
+    return None if in_string else "".join(reversed(stack))
+
+
+def _close_truncated(text):
+    """Parse a reply cut off mid-way (e.g. at max_tokens), keeping every complete element"""
+    for end in range(len(text), 0, -1):
+        if text[end - 1] not in '"]}':
+            continue
+        prefix = text[:end].rstrip()
+        closers = _closers(prefix)
+        if closers is None or not closers:
+            continue
+        try:
+            return json.loads(prefix + closers)
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("nothing complete to keep")
+
+
+def _load(reply):
+    """Parse a near-JSON reply; returns (value, repair) with repair None for clean JSON"""
+    text = reply.strip()
+    try:
+        return json.loads(text), None
+    except json.JSONDecodeError:
+        pass
+
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    starts = [i for i in (text.find("["), text.find("{")) if i >= 0]
+    if starts:
+        text = text[min(starts):]
+        end = max(text.rfind("]"), text.rfind("}"))
+        candidate = text[:end + 1] if end >= 0 else text
+    else:
+        candidate = text
+
+    repairs = (
+        ("extracted", lambda: json.loads(candidate)),
+        ("syntax", lambda: json.loads(_TRAILING_COMMA.sub(r"\1", candidate.translate(_SMART_QUOTES)))),
+        ("python_literal", lambda: ast.literal_eval(candidate)),
+        ("truncated", lambda: _close_truncated(_TRAILING_COMMA.sub(r"\1", text.translate(_SMART_QUOTES)))),
+    )
+    for repair, parse in repairs:
+        try:
+            return parse(), repair
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            continue
+
+    # Prose that merely contains a few bullets is not an answer; a reply that is mostly a list is
+    lines = [line for line in reply.splitlines() if line.strip()]
+    items = _LIST_LINE.findall(reply)
+    if items and len(items) * 2 > len(lines):
+        return items, "list_lines"
+    raise ValueError("no JSON found in the reply")
+
+
+def _strings(value):
+    """Non-empty strings from a list of insights, or None when it isn't one.
+
+    An empty list is a valid answer; a non-empty one with nothing usable in it is not.
+    """
+    if isinstance(value, dict) and len(value) == 1:
+        # {"insights": [...]} or any single-key wrapper around the list
+        value = next(iter(value.values()))
+    if not isinstance(value, list):
+        return None
+    items = []
+    for item in value:
+        if isinstance(item, dict) and len(item) == 1:
+            item = next(iter(item.values()))
+        if isinstance(item, (str, int, float)) and not isinstance(item, bool):
+            item = str(item).strip()
+            if item:
+                items.append(item)
+    return items if items or not value else None
+
+
+def _parse(reply, stage, shape):
+    try:
+        value, repair = _load(reply or "")
+        result = shape(value, repair)
+        if result is None:
+            raise ValueError(f"reply is {type(value).__name__}, not the expected shape")
+    except ValueError as e:
+        JSON_PARSE_FAILURES.inc(stage=stage)
+        raise ReplyFormatError(f"unreadable {stage} reply: {e}", reply) from None
+    if repair == "list_lines":
+        LIST_REPLIES.inc(stage=stage)
+    elif repair:
+        JSON_REPAIRS.inc(stage=stage, repair=repair)
+    return result
+
+
+def parse_insight_list(reply, stage):
+    """List of insight strings from a reply; raises ReplyFormatError when it can't be repaired"""
+    return _parse(reply, stage, lambda value, repair: _strings(value))
+
+
+def parse_insight_map(reply, stage):
+    """{sheet name: insight strings} from a packed reply, leaving out sheets whose list is unusable"""
+    def shape(value, repair):
+        if not isinstance(value, dict):
+            return None
+        names = list(value)
+        if repair == "truncated":
+            # The reply was cut off in the last sheet's list; that sheet is asked for on its own
+            names = names[:-1]
+        packed = {name: _strings(value[name]) for name in names if not isinstance(value[name], str)}
+        return {name: insights for name, insights in packed.items() if insights is not None}
+
+    return _parse(reply, stage, shape)
+
+
+def _reply_text(response):
+    return response.choices[0].message.content or ""
+
+
+def _retry_messages(messages, reply):
+    """The conversation so far plus a request to restate the answer as JSON"""
+    return messages + [
+        {"role": "assistant", "content": reply},
+        {"role": "user", "content": FORMAT_RETRY_PROMPT},
+    ]
+
+
+def call_with_repair(send, messages, parse, stage):
+    """send(messages) -> chat completion; parse(reply) -> result.
+
+    Replies that local repair can read are used as they are; only unreadable
+    ones are asked again, up to LLM_FORMAT_RETRIES times, before the last
+    ReplyFormatError is raised.
+    """
+    for attempt in range(LLM_FORMAT_RETRIES + 1):
+        reply = _reply_text(send(messages))
+        try:
+            return parse(reply)
+        except ReplyFormatError:
+            if attempt == LLM_FORMAT_RETRIES:
+                raise
+            print(f"⏳ LLM call retry {attempt + 1} after an unreadable {stage} reply")
+            LLM_RETRIES.inc(stage=stage, reason="unreadable_reply")
+            messages = _retry_messages(messages, reply)
+
+
+async def acall_with_repair(send, messages, parse, stage):
+    """call_with_repair for an async send"""
+    for attempt in range(LLM_FORMAT_RETRIES + 1):
+        reply = _reply_text(await send(messages))
+        try:
+            return parse(reply)
+        except ReplyFormatError:
+            if attempt == LLM_FORMAT_RETRIES:
+                raise
+            print(f"⏳ LLM call retry {attempt + 1} after an unreadable {stage} reply")
+            LLM_RETRIES.inc(stage=stage, reason="unreadable_reply")
+            messages = _retry_messages(messages, reply)
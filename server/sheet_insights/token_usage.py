@@ -0,0 +1,101 @@
+import contextvars
+import threading
+
+
+def _totals():
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+
+def _add(totals, prompt, completion, calls=1):
+    totals["calls"] += calls
+    totals["prompt_tokens"] += prompt
+    totals["completion_tokens"] += completion
+    totals["total_tokens"] += prompt + completion
+
+
+def _split(amount, weights):
+    """Split an integer amount by weight; rounding leftovers go to the last share"""
+    names = list(weights)
+    if sum(weights.values()) <= 0:
+        weights = {name: 1 for name in names}
+    total = sum(weights.values())
+    shares, given = {}, 0
+    for name in names[:-1]:
+        shares[name] = int(amount * weights[name] / total)
+        given += shares[name]
+    shares[names[-1]] = amount - given
+    return shares
+
+
+class TokenLedger:
+    """Tokens one upload spent, per call, per stage and per sheet.
+
+    Filled by the LLM scheduler from each response's usage. A packed call is
+    split across its sheets by their share of the prompt; when a response
+    carries no usage the prompt estimate is booked and the call is counted
+    as estimated.
+    """
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.totals = _totals()
+        self.estimated_calls = 0
+        self.by_stage = {}
+        self.by_sheet = {}
+        self.calls = []
+        self.plan = None
+        self._lock = threading.Lock()
+
+    def record(self, stage, prompt_tokens, completion_tokens, sheets=None, estimated=False):
+        """Book one call; sheets is a list of sheet names or {sheet_name: prompt share}"""
+        if isinstance(sheets, (list, tuple)):
+            sheets = {name: 1 for name in sheets}
+        with self._lock:
+            _add(self.totals, prompt_tokens, completion_tokens)
+            _add(self.by_stage.setdefault(stage, _totals()), prompt_tokens, completion_tokens)
+            if estimated:
+                self.estimated_calls += 1
+            if sheets:
+                prompt_shares = _split(prompt_tokens, sheets)
+                completion_shares = _split(completion_tokens, sheets)
+                for name in sheets:
+                    _add(self.by_sheet.setdefault(name, _totals()), prompt_shares[name], completion_shares[name])
+            self.calls.append({
+                "stage": stage,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "sheets": len(sheets) if sheets else 0,
+                "estimated": estimated,
+            })
+
+    def summary(self):
+        """Totals, per-stage usage and the budget plan, without the per-call and per-sheet detail"""
+        with self._lock:
+            return {
+                **self.totals,
+                "estimated_calls": self.estimated_calls,
+                "by_stage": {stage: dict(totals) for stage, totals in self.by_stage.items()},
+                "plan": self.plan,
+            }
+
+    def as_dict(self):
+        summary = self.summary()
+        with self._lock:
+            summary["run_id"] = self.run_id
+            summary["by_sheet"] = {name: dict(totals) for name, totals in self.by_sheet.items()}
+            summary["calls"] = list(self.calls)
+        return summary
+
+
+# Set per upload like the trace, so every call made on its behalf is booked to it
+_current_ledger = contextvars.ContextVar("current_ledger", default=None)
+
+
+def start_ledger(run_id):
+    ledger = TokenLedger(run_id)
+    _current_ledger.set(ledger)
+    return ledger
+
+
+def current_ledger():
+    return _current_ledger.get()
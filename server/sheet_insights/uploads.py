@@ -0,0 +1,81 @@
+import hashlib
+import os
+import uuid
+from pathlib import Path
+
+from sheet_insights.config import UPLOAD_BLOB_DIR, UPLOAD_CHUNK_BYTES, UPLOAD_MAX_BYTES
+from sheet_insights.metrics import CACHE_REQUESTS
+
+XLSX_MAGIC = b"PK\x03\x04"  # .xlsx files are zip archives
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeded UPLOAD_MAX_BYTES"""
+
+
+class InvalidUpload(ValueError):
+    """The upload isn't an .xlsx workbook"""
+
+
+class UploadStore:
+    """Content-addressed store of uploaded workbooks.
+
+    Uploads are read in chunks, hashed with SHA-256 and size-checked while
+    they arrive, then stored once as blobs/<2 hex>/<sha256>.xlsx. The same
+    content uploaded under any name is kept once, different files with the
+    same name no longer overwrite each other, and the parser reads the blob
+    directly.
+    """
+
+    def __init__(self, blob_dir, max_bytes=50 * 1024 * 1024, chunk_bytes=1024 * 1024):
+        self.blob_dir = Path(blob_dir)
+        self.max_bytes = max_bytes
+        self.chunk_bytes = chunk_bytes
+        self.stored = 0
+        self.deduplicated = 0
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+
+    def blob_path(self, digest: str):
+        return self.blob_dir / digest[:2] / f"{digest}.xlsx"
+
+    async def ingest(self, upload):
+        """Store an UploadFile's content; returns (blob path, sha256 hex digest, size, deduplicated)"""
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = self.blob_dir / f".{uuid.uuid4().hex}.part"
+        try:
+            with open(tmp_path, "wb") as f:
+                while chunk := await upload.read(self.chunk_bytes):
+                    if size == 0 and not chunk.startswith(XLSX_MAGIC[:len(chunk)]):
+                        raise InvalidUpload("File content is not an .xlsx workbook")
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge(f"Upload exceeds the {self.max_bytes // (1024 * 1024)} MB limit")
+                    digest.update(chunk)
+                    f.write(chunk)
+            if size == 0:
+                raise InvalidUpload("Uploaded file is empty")
+
+            path = self.blob_path(digest.hexdigest())
+            if path.exists():
+                os.utime(path, None)  # still in use, so retention keeps it
+                self.deduplicated += 1
+                CACHE_REQUESTS.inc(cache="upload_blob", result="hit")
+                return path, digest.hexdigest(), size, True
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, path)  # atomic, so readers never see a partial blob
+            self.stored += 1
+            CACHE_REQUESTS.inc(cache="upload_blob", result="miss")
+            return path, digest.hexdigest(), size, False
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def stats(self):
+        return {
+            "max_bytes": self.max_bytes,
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+        }
+
+
+upload_store = UploadStore(UPLOAD_BLOB_DIR, max_bytes=UPLOAD_MAX_BYTES, chunk_bytes=UPLOAD_CHUNK_BYTES)
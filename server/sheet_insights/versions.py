@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from openpyxl.utils import get_column_letter
+
+from sheet_insights.config import WORKBOOK_VERSIONS_DIR
+from sheet_insights.encoder import TABLE_ENCODING, SHEET_TOKEN_BUDGET
+from sheet_insights.kpi_stats import KPI_FACTS_IN_PROMPT
+from sheet_insights.xlsx_reader import open_workbook
+
+TABLE_FIRST_ROW = 4  # parser.read_table_rows starts at the two header rows
+
+
+def _normalise_rows(rows):
+    """JSON round-trip so freshly read rows compare equal to stored ones"""
+    return json.loads(json.dumps([list(row) for row in rows], default=str))
+
+
+def _changed_cells(old_rows, new_rows):
+    """Sheet coordinates (e.g. "L9") of every cell whose value differs"""
+    changed = []
+    for r in range(max(len(old_rows), len(new_rows))):
+        old = old_rows[r] if r < len(old_rows) else []
+        new = new_rows[r] if r < len(new_rows) else []
+        for c in range(max(len(old), len(new))):
+            if (old[c] if c < len(old) else None) != (new[c] if c < len(new) else None):
+                changed.append(f"{get_column_letter(c + 1)}{TABLE_FIRST_ROW + r}")
+    return changed
+
+
+class WorkbookVersions:
+    """Last processed version of each workbook, so a re-upload only re-analyses changed sheets.
+
+    A workbook is identified by its set of sheet names, so monthly uploads saved
+    under a new file name still find their previous version. Whether a sheet is
+    reused is decided by its content alone: the zip CRCs first, then its cells.
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = Path(root_dir)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def settings():
+        """Stored sheet text depends on these; a change invalidates every snapshot"""
+        return {
+            "table_encoding": TABLE_ENCODING, "sheet_token_budget": SHEET_TOKEN_BUDGET,
+            "kpi_facts": KPI_FACTS_IN_PROMPT, "facts_first": True,
+        }
+
+    def _path(self, sheet_names):
+        key = hashlib.sha256("\n".join(sorted(sheet_names)).encode("utf-8")).hexdigest()[:32]
+        return self.root_dir / f"{key}.json"
+
+    def load(self, sheet_names):
+        """{sheet_name: entry} of the previous version, or {} if there is none"""
+        try:
+            with open(self._path(sheet_names), "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if snapshot.get("settings") != self.settings():
+            return {}
+        return snapshot.get("sheets", {})
+
+    def save(self, sheet_names, sheets):
+        """Replace the stored version atomically; entries need fingerprint, rows, text and kpis"""
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(sheet_names)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"settings": self.settings(), "sheets": sheets}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+    def candidates(self, file_path, sheet_names):
+        """Find the sheets that may have changed since the previous version.
+
+        Only the zip CRCs are compared here, so no sheet is parsed. Returns
+        (previous, fingerprints, candidates): the previous entries, each
+        sheet's fingerprint (None with the openpyxl engine) and, in order,
+        the sheets whose fingerprint does not match, to be read and passed to
+        diff().
+        """
+        previous = self.load(sheet_names)
+        wb = open_workbook(file_path)
+        try:
+            fingerprints = {
+                sheet_name: wb.sheet_fingerprint(sheet_name) if hasattr(wb, "sheet_fingerprint") else None
+                for sheet_name in sheet_names
+            }
+        finally:
+            wb.close()
+        candidates = [
+            sheet_name for sheet_name in sheet_names
+            if not (previous.get(sheet_name) and fingerprints[sheet_name]
+                    and previous[sheet_name].get("fingerprint") == fingerprints[sheet_name])
+        ]
+        return previous, fingerprints, candidates
+
+    def diff(self, previous, fingerprints, sheet_names, tables):
+        """Compare a workbook with its previous version.
+
+        tables maps each candidate sheet that could be read to its header and
+        data rows; candidates missing from it count as changed. Returns
+        (entries, changed, cell_changes): entries holds the previous entry of
+        every unchanged sheet and a new {fingerprint, rows} entry for every
+        changed one, changed lists changed sheets in order, and cell_changes
+        maps each changed sheet to the coordinates that differ.
+        """
+        entries, changed, cell_changes = {}, [], {}
+        for sheet_name in sheet_names:
+            old = previous.get(sheet_name)
+            fingerprint = fingerprints.get(sheet_name)
+            if old and fingerprint and old.get("fingerprint") == fingerprint:
+                entries[sheet_name] = old
+                continue
+
+            rows = _normalise_rows(tables[sheet_name]) if sheet_name in tables else None
+            if old and rows is not None and old.get("rows") == rows:
+                # Re-saved without value changes (e.g. formatting only)
+                entries[sheet_name] = dict(old, fingerprint=fingerprint)
+                continue
+
+            entries[sheet_name] = {"fingerprint": fingerprint, "rows": rows}
+            changed.append(sheet_name)
+            if old and rows is not None:
+                cell_changes[sheet_name] = _changed_cells(old.get("rows") or [], rows)
+        return entries, changed, cell_changes
+
+
+workbook_versions = WorkbookVersions(WORKBOOK_VERSIONS_DIR)
@@ -0,0 +1,392 @@
+import os
+import posixpath
+import re
+import threading
+import time
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+import openpyxl
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.formula.translate import Translator, TranslatorError
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_ISO8601, from_excel
+
+from sheet_insights.metrics import WORKBOOK_OPEN_SECONDS
+
+# "stream" parses the .xlsx package directly; "openpyxl" is the fallback engine
+READER_ENGINE = os.getenv("XLSX_READER_ENGINE", "stream")
+
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+CELL_REF = re.compile(r"([A-Z]+)(\d+)")
+# OOXML escapes characters XML can't carry (e.g. _x000D_ for a carriage return);
+# a literal "_xHHHH_" in the text is itself written with an escaped underscore, _x005F_
+XML_CHAR_ESCAPE = re.compile(r"_x([0-9A-Fa-f]{4})_")
+
+
+def _local(tag):
+    """Strip the XML namespace so transitional and strict OOXML parse the same way"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _column_index(letters):
+    index = 0
+    for char in letters:
+        index = index * 26 + (ord(char) - 64)
+    return index
+
+
+def _cast_number(value):
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+def _unescape(text):
+    # One pass, so the text after a decoded _x005F_ stays literal
+    if "_x" not in text:
+        return text
+    return XML_CHAR_ESCAPE.sub(lambda match: chr(int(match.group(1), 16)), text)
+
+
+def _text_content(node):
+    """Concatenate the text runs of a shared or inline string, skipping phonetic hints"""
+    parts = []
+    for child in node:
+        name = _local(child.tag)
+        if name == "t":
+            parts.append(child.text or "")
+        elif name == "r":
+            for run_child in child:
+                if _local(run_child.tag) == "t":
+                    parts.append(run_child.text or "")
+    return _unescape("".join(parts))
+
+
+class StreamingWorksheet:
+    """Read-only view of one worksheet that streams its XML row by row"""
+
+    def __init__(self, reader, title, member):
+        self.parent = reader
+        self.title = title
+        self._member = member
+        self._max_column = None
+        self._dimension_read = False
+
+    @property
+    def max_column(self):
+        if not self._dimension_read:
+            # The <dimension> element precedes <sheetData>, so this stops almost immediately
+            with self.parent._zip.open(self._member) as source:
+                for _, elem in iterparse(source, events=("start",)):
+                    name = _local(elem.tag)
+                    if name == "dimension":
+                        self._max_column = self._parse_dimension(elem.get("ref", ""))
+                        break
+                    if name == "sheetData":
+                        break
+            self._dimension_read = True
+        return self._max_column
+
+    @staticmethod
+    def _parse_dimension(ref):
+        last = ref.split(":")[-1]
+        match = CELL_REF.match(last)
+        return _column_index(match.group(1)) if match else None
+
+    def _parse_cell(self, elem, coordinate, shared_formulas):
+        data_type = elem.get("t", "n")
+        value = None
+        formula = None
+
+        if data_type == "inlineStr":
+            for child in elem:
+                if _local(child.tag) == "is":
+                    return _text_content(child)
+            return None
+
+        for child in elem:
+            name = _local(child.tag)
+            if name == "v":
+                value = child.text or None
+            elif name == "f":
+                formula = child
+
+        if value is None:
+            if formula is not None and self.parent.keep_formulas:
+                # No cached result (workbook saved without recalculation): hand the
+                # formula text on so sheet_insights.formulas can evaluate it locally
+                return self._formula_text(formula, coordinate, shared_formulas)
+            return None
+        if formula is not None and formula.get("t") == "shared" and formula.text:
+            shared_formulas[formula.get("si")] = (formula.text, coordinate)
+        if data_type == "n":
+            value = _cast_number(value)
+            style_id = int(elem.get("s", 0))
+            if style_id in self.parent._date_styles:
+                try:
+                    value = from_excel(value, self.parent.epoch)
+                except (OverflowError, ValueError):
+                    value = "#VALUE!"
+            return value
+        if data_type == "s":
+            return self.parent._shared_strings[int(value)]
+        if data_type == "b":
+            return bool(int(value))
+        if data_type == "d":
+            return from_ISO8601(value)
+        # "str" (formula string result) and "e" (error) are returned as text
+        return value
+
+    @staticmethod
+    def _formula_text(formula, coordinate, shared_formulas):
+        if formula.get("t") != "shared":
+            return f"={formula.text}" if formula.text else None
+        if formula.text:
+            shared_formulas[formula.get("si")] = (formula.text, coordinate)
+            return f"={formula.text}"
+        master = shared_formulas.get(formula.get("si"))
+        if master is None:
+            return None
+        text, origin = master
+        try:
+            return Translator(f"={text}", origin=origin).translate_formula(coordinate)
+        except TranslatorError:
+            return None
+
+    @staticmethod
+    def _collect_shared_formulas(row_elem, shared_formulas):
+        """Remember shared-formula masters in rows that are skipped, not yielded"""
+        for cell in row_elem:
+            for child in cell:
+                if _local(child.tag) == "f" and child.get("t") == "shared" and child.text:
+                    shared_formulas[child.get("si")] = (child.text, cell.get("r"))
+
+    def iter_rows(self, min_row=1, max_row=None, min_col=1, max_col=None, values_only=True):
+        """Yield row tuples like openpyxl's read-only iter_rows(values_only=True)"""
+        if not values_only:
+            raise ValueError("StreamingWorksheet only supports values_only=True")
+
+        max_col = max_col or self.max_column
+        width = (max_col - min_col + 1) if max_col else None
+        empty_row = (None,) * width if width else ()
+
+        counter = min_row
+        row_index = 0
+        shared_formulas = {}
+        with self.parent._zip.open(self._member) as source:
+            context = iterparse(source, events=("start", "end"))
+            _, root = next(context)
+            in_sheet_data = False
+            for event, elem in context:
+                name = _local(elem.tag)
+                if event == "start":
+                    if name == "sheetData":
+                        in_sheet_data = True
+                    continue
+                if name == "sheetData":
+                    break
+                if not in_sheet_data or name != "row":
+                    continue
+
+                row_index = int(elem.get("r", row_index + 1))
+                if max_row is not None and row_index > max_row:
+                    break
+
+                if row_index >= counter:
+                    # Rows missing from the XML are yielded as empty tuples
+                    for _ in range(counter, row_index):
+                        yield empty_row
+                    counter = row_index + 1
+                    yield self._build_row(elem, row_index, min_col, max_col, shared_formulas)
+                elif self.parent.keep_formulas:
+                    self._collect_shared_formulas(elem, shared_formulas)
+
+                # Drop parsed rows so memory stays flat on large sheets
+                elem.clear()
+                root.clear()
+
+        if max_row is not None and row_index > max_row:
+            for _ in range(counter, max_row + 1):
+                yield empty_row
+
+    def _build_row(self, row_elem, row_index, min_col, max_col, shared_formulas):
+        values = {}
+        column = 0
+        for cell in row_elem:
+            if _local(cell.tag) != "c":
+                continue
+            ref = cell.get("r")
+            if ref:
+                match = CELL_REF.match(ref)
+                column = _column_index(match.group(1)) if match else column + 1
+            else:
+                column += 1
+            if column < min_col or (max_col and column > max_col):
+                continue
+            values[column] = self._parse_cell(cell, ref or f"{get_column_letter(column)}{row_index}", shared_formulas)
+
+        last = max_col or (max(values) if values else min_col - 1)
+        return tuple(values.get(col) for col in range(min_col, last + 1))
+
+
+class StreamingXlsxReader:
+    """Single-pass .xlsx reader: opens the zip once and parses shared strings once.
+
+    Exposes the slice of openpyxl's read-only Workbook API the parser uses
+    (sheetnames, wb[name].iter_rows(...), close()), so it is a drop-in engine.
+    Worksheets are streamed with an incremental XML parser and reading stops
+    at max_row, so memory stays flat regardless of how large a sheet is.
+
+    With keep_formulas, a formula cell that has no cached value is returned as
+    its formula text (e.g. "=AVERAGE(G7:R7)") instead of None.
+    """
+
+    def __init__(self, file_path, keep_formulas=True):
+        self._zip = zipfile.ZipFile(file_path)
+        self.keep_formulas = keep_formulas
+        self._lock = threading.Lock()
+        self._strings = None
+        self._styles = None
+        self.epoch = CALENDAR_WINDOWS_1900
+        try:
+            self._workbook_path = self._find_workbook_path()
+            self._sheets = self._read_sheet_members()
+        except Exception:
+            self._zip.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._zip.close()
+
+    @property
+    def sheetnames(self):
+        return list(self._sheets)
+
+    def __getitem__(self, name):
+        if name not in self._sheets:
+            raise KeyError(f"Worksheet {name} does not exist.")
+        return StreamingWorksheet(self, name, self._sheets[name])
+
+    def sheet_fingerprint(self, name):
+        """Cheap change check from the zip directory alone: CRCs of the sheet XML,
+        shared strings and styles (a sheet's cell values depend on all three)"""
+        base_dir = posixpath.dirname(self._workbook_path)
+        crcs = [self._zip.getinfo(self._sheets[name]).CRC]
+        for part in ("sharedStrings.xml", "styles.xml"):
+            info = self._zip.NameToInfo.get(posixpath.join(base_dir, part))
+            crcs.append(info.CRC if info else 0)
+        return "-".join(f"{crc:08x}" for crc in crcs)
+
+    def _read_rels(self, rels_path):
+        rels = {}
+        with self._zip.open(rels_path) as source:
+            for _, elem in iterparse(source):
+                if _local(elem.tag) == "Relationship":
+                    rels[elem.get("Id")] = (elem.get("Target"), elem.get("Type", ""))
+        return rels
+
+    def _resolve(self, base_dir, target):
+        if target.startswith("/"):
+            return target.lstrip("/")
+        return posixpath.normpath(posixpath.join(base_dir, target))
+
+    def _find_workbook_path(self):
+        for target, rel_type in self._read_rels("_rels/.rels").values():
+            if rel_type.endswith("/officeDocument"):
+                return self._resolve("", target)
+        return "xl/workbook.xml"
+
+    def _read_sheet_members(self):
+        base_dir = posixpath.dirname(self._workbook_path)
+        rels_path = posixpath.join(base_dir, "_rels", posixpath.basename(self._workbook_path) + ".rels")
+        rels = self._read_rels(rels_path)
+
+        sheets = {}
+        with self._zip.open(self._workbook_path) as source:
+            for _, elem in iterparse(source):
+                name = _local(elem.tag)
+                if name == "workbookPr" and elem.get("date1904") in ("1", "true"):
+                    self.epoch = CALENDAR_MAC_1904
+                elif name == "sheet":
+                    rel_id = elem.get(f"{{{REL_NS}}}id") or elem.get("id")
+                    target, _ = rels.get(rel_id, (None, None))
+                    if target:
+                        sheets[elem.get("name")] = self._resolve(base_dir, target)
+        return sheets
+
+    @property
+    def _shared_strings(self):
+        if self._strings is None:
+            with self._lock:
+                if self._strings is None:
+                    self._strings = self._read_shared_strings()
+        return self._strings
+
+    def _read_shared_strings(self):
+        path = posixpath.join(posixpath.dirname(self._workbook_path), "sharedStrings.xml")
+        strings = []
+        if path not in self._zip.NameToInfo:
+            return strings
+        with self._zip.open(path) as source:
+            for _, elem in iterparse(source):
+                if _local(elem.tag) == "si":
+                    strings.append(_text_content(elem))
+                    elem.clear()
+        return strings
+
+    @property
+    def _date_styles(self):
+        if self._styles is None:
+            with self._lock:
+                if self._styles is None:
+                    self._styles = self._read_date_styles()
+        return self._styles
+
+    def _read_date_styles(self):
+        """Return the cellXfs indexes whose number format is a date, as openpyxl does"""
+        path = posixpath.join(posixpath.dirname(self._workbook_path), "styles.xml")
+        if path not in self._zip.NameToInfo:
+            return frozenset()
+
+        custom_formats = {}
+        xf_formats = []
+        in_cell_xfs = False
+        with self._zip.open(path) as source:
+            for event, elem in iterparse(source, events=("start", "end")):
+                name = _local(elem.tag)
+                if name == "cellXfs":
+                    in_cell_xfs = event == "start"
+                elif event == "end" and name == "numFmt":
+                    custom_formats[int(elem.get("numFmtId"))] = elem.get("formatCode", "")
+                elif event == "end" and name == "xf" and in_cell_xfs:
+                    xf_formats.append(int(elem.get("numFmtId", 0)))
+
+        date_styles = set()
+        for index, fmt_id in enumerate(xf_formats):
+            code = custom_formats.get(fmt_id, BUILTIN_FORMATS.get(fmt_id))
+            if code and is_date_format(code):
+                date_styles.add(index)
+        return frozenset(date_styles)
+
+
+def open_workbook(file_path, engine=None):
+    """Open a workbook with the configured reader engine, falling back to openpyxl"""
+    engine = engine or READER_ENGINE
+    start_time = time.perf_counter()
+    if engine == "stream":
+        try:
+            wb = StreamingXlsxReader(file_path)
+            WORKBOOK_OPEN_SECONDS.observe(time.perf_counter() - start_time, engine="stream")
+            return wb
+        except (KeyError, zipfile.BadZipFile, SyntaxError) as e:
+            print(f"⚠️ Streaming reader failed for {file_path} ({e}), falling back to openpyxl")
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    WORKBOOK_OPEN_SECONDS.observe(time.perf_counter() - start_time, engine="openpyxl")
+    return wb